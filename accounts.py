@@ -0,0 +1,148 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore.session
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+from botocore.exceptions import ClientError
+
+from clients import get_client
+from paginate import paginate
+
+# One account to inventory; name is '' when the source doesn't provide one
+Account = namedtuple('Account', ['id', 'name'])
+
+DEFAULT_ROLE_NAME = 'OrganizationAccountAccessRole'
+DEFAULT_SESSION_NAME = 'aws-inventory'
+DEFAULT_DURATION = 3600
+
+
+class AssumedRoleProvider(CredentialProvider):
+    # Hands botocore's credential chain the refreshable AssumeRole credentials of one account
+    METHOD = 'sts-assume-role'
+
+    def __init__(self, credentials):
+        super().__init__()
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+def organization_accounts():
+    # Active member accounts of the caller's organization
+    return [Account(account['Id'], account.get('Name', ''))
+            for account in paginate(get_client('organizations'), 'list_accounts', 'Accounts')
+            if account.get('Status', 'ACTIVE') == 'ACTIVE']
+
+
+def read_accounts(path):
+    # One account per line as "id" or "id,name"; blank lines and # comments are skipped
+    accounts = []
+    with open(path) as account_file:
+        for line in account_file:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            account_id, _, name = line.partition(',')
+            accounts.append(Account(account_id.strip(), name.strip()))
+    return accounts
+
+
+def list_accounts(source):
+    # source is 'organizations' or the path of an accounts file
+    if source == 'organizations':
+        return organization_accounts()
+    return read_accounts(source)
+
+
+class AccountSessions:
+    # boto3 sessions for other accounts, one per account, backed by AssumeRole credentials.
+    # botocore refreshes them on its own before they expire, so a session stays usable however
+    # long the run takes. The caller's own account uses the base session directly.
+    # hooks are called as hook(session, account_id) for every new session, before any client
+    # is built from it, e.g. to install instrumentation or rate limiting.
+    def __init__(self, role_name=DEFAULT_ROLE_NAME, base_session=None, session_name=DEFAULT_SESSION_NAME,
+                 duration=DEFAULT_DURATION, external_id=None, hooks=None):
+        self.role_name = role_name
+        self.base_session = base_session or boto3.Session()
+        self.session_name = session_name
+        self.duration = duration
+        self.external_id = external_id
+        self.hooks = list(hooks or [])
+        self.assumed = 0
+        self._caller_account = None
+        self._sessions = {}
+        # Data loader shared by every assumed-role session, so service models load once per run
+        # rather than once per account
+        self._loader = None
+        self._lock = threading.Lock()
+
+    def caller_account(self):
+        if self._caller_account is None:
+            self._caller_account = get_client('sts', session=self.base_session).get_caller_identity()['Account']
+        return self._caller_account
+
+    def _assume(self, account_id):
+        params = {
+            'RoleArn': f'arn:aws:iam::{account_id}:role/{self.role_name}',
+            'RoleSessionName': self.session_name,
+            'DurationSeconds': self.duration,
+        }
+        if self.external_id:
+            params['ExternalId'] = self.external_id
+        credentials = get_client('sts', session=self.base_session).assume_role(**params)['Credentials']
+        with self._lock:
+            self.assumed += 1
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    def session(self, account_id):
+        with self._lock:
+            session = self._sessions.get(account_id)
+        if session is not None:
+            return session
+
+        if account_id == self.caller_account():
+            session = self.base_session
+        else:
+            # The first AssumeRole happens here, so a role we can't assume fails now rather than
+            # in the middle of the run
+            credentials = RefreshableCredentials.create_from_metadata(
+                metadata=self._assume(account_id),
+                refresh_using=lambda: self._assume(account_id),
+                method='sts-assume-role',
+            )
+            botocore_session = botocore.session.get_session()
+            with self._lock:
+                if self._loader is None:
+                    self._loader = botocore_session.get_component('data_loader')
+            botocore_session.register_component('data_loader', self._loader)
+            botocore_session.get_component('credential_provider').insert_before('env', AssumedRoleProvider(credentials))
+            session = boto3.Session(botocore_session=botocore_session, region_name=self.base_session.region_name)
+            for hook in self.hooks:
+                hook(session, account_id)
+
+        with self._lock:
+            # Another thread may have won the race; keep the first session so clients stay shared
+            return self._sessions.setdefault(account_id, session)
+
+    def resolve(self, accounts, func, max_workers=16):
+        # Run func(account, session) for every account concurrently and return
+        # [(account, session, result)] in account order. Accounts whose role can't be assumed
+        # (or whose func fails with an AWS error) are reported and skipped.
+        def run(account):
+            try:
+                session = self.session(account.id)
+                return account, session, func(account, session)
+            except ClientError as error:
+                print(f"Skipping account {account.id}: {error}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [result for result in executor.map(run, accounts) if result is not None]
@@ -1,284 +1,345 @@
-import boto3
+import argparse
 import csv
+import sys
+import time
 from datetime import datetime
 
-# Initialize the Boto3 clients for EC2, Lambda, ELB, VPC, S3, RDS, and EFS services
-ec2_client = boto3.client('ec2')
-lambda_client = boto3.client('lambda')
-elb_client = boto3.client('elbv2')
-s3_client = boto3.client('s3')
-rds_client = boto3.client('rds')
-efs_client = boto3.client('efs')
-
-# Fetch all AWS regions
-response = ec2_client.describe_regions()
-aws_regions = [region['RegionName'] for region in response['Regions']]
-
-# Open CSV file in write mode
-with open('aws_resources_info.csv', 'w', newline='') as csvfile:
-    # Define field names
-    fieldnames = ['Resource Type', 'Region', 'Resource Name', 'Resource ARN', 'Creation/Last Modified Time', 'Other Information']
-    # Initialize CSV writer
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    
-    # Write header
-    writer.writeheader()
-    
-    # Fetch and write EC2 instances information
-    for region in aws_regions:
-        print(f"Fetching EC2 instances in {region}...")
-        
-        # Initialize the Boto3 client for the EC2 service in the current region
-        ec2_client = boto3.client('ec2', region_name=region)
-        
-        # List all EC2 instances in the current region
-        response = ec2_client.describe_instances()
-        
-        # Extract EC2 instance information from the response
-        reservations = response['Reservations']
-        for reservation in reservations:
-            instances = reservation['Instances']
-            for instance in instances:
-                creation_time = instance['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S')
-                row = {
-                    'Resource Type': 'EC2 Instance',
-                    'Region': region,
-                    'Resource Name': instance['InstanceId'],
-                    'Resource ARN': '',
-                    'Creation/Last Modified Time': creation_time,
-                    'Other Information': f"Instance Type: {instance['InstanceType']}, State: {instance['State']['Name']}, Private IP: {instance.get('PrivateIpAddress', 'N/A')}, Public IP: {instance.get('PublicIpAddress', 'N/A')}"
-                }
-                writer.writerow(row)
-
-    # Fetch and write Lambda functions information
-    for region in aws_regions:
-        print(f"Fetching Lambda functions in {region}...")
-
-        # Initialize the Boto3 client for the AWS Lambda service in the current region
-        lambda_client = boto3.client('lambda', region_name=region)
-    
-        # List all Lambda functions in the current region
-        response = lambda_client.list_functions()
-    
-        # Extract Lambda function information from the response
-        functions = response['Functions']
-        
-        for function in functions:
-            last_modified = function.get('LastModified', 'N/A')
-            if isinstance(last_modified, str):
-                last_modified = last_modified.split('T')[0]
-            row = {
-                'Resource Type': 'Lambda Function',
-                'Region': region,
-                'Resource Name': function['FunctionName'],
-                'Resource ARN': function['FunctionArn'],
-                'Creation/Last Modified Time': last_modified,
-                'Other Information': f"Runtime: {function['Runtime']}, Handler: {function['Handler']}, Memory: {function['MemorySize']}, Timeout: {function['Timeout']}"
-            }
-            writer.writerow(row)
-    
-    # Fetch and write ELB information
-    for region in aws_regions:
-        print(f"Fetching ELBs in {region}...")
-
-        # Initialize the Boto3 client for the ELB service in the current region
-        elb_client = boto3.client('elbv2', region_name=region)
-    
-        # List all ELBs in the current region
-        response = elb_client.describe_load_balancers()
-    
-        # Extract ELB information from the response
-        elbs = response['LoadBalancers']
-        
-        for elb in elbs:
-            creation_time = elb['CreatedTime'].strftime('%Y-%m-%d %H:%M:%S')
-            dns_name = elb.get('DNSName', 'N/A')
-            scheme = elb.get('Scheme', 'N/A')  # Check if 'Scheme' key exists
-            row = {
-                'Resource Type': 'ELB',
-                'Region': region,
-                'Resource Name': elb['LoadBalancerName'],
-                'Resource ARN': elb['LoadBalancerArn'],
-                'Creation/Last Modified Time': creation_time,
-                'Other Information': f"DNS Name: {dns_name}, Scheme: {scheme}, Type: {elb['Type']}"
-            }
-            writer.writerow(row)
-    
-    # Fetch and write VPC information
-    for region in aws_regions:
-        print(f"Fetching VPCs in {region}...")
-
-        # Initialize the Boto3 client for the EC2 service in the current region
-        ec2_client = boto3.client('ec2', region_name=region)
-    
-        # List all VPCs in the current region
-        response = ec2_client.describe_vpcs()
-    
-        # Extract VPC information from the response
-        vpcs = response['Vpcs']
-        
-        for vpc in vpcs:
-            creation_time_str = "N/A"
-            if 'CreateTime' in vpc:
-                creation_time_str = vpc['CreateTime'].strftime('%Y-%m-%d %H:%M:%S')
-            row = {
-                'Resource Type': 'VPC',
-                'Region': region,
-                'Resource Name': vpc['VpcId'],
-                'Resource ARN': '',
-                'Creation/Last Modified Time': creation_time_str,
-                'Other Information': ''
-            }
-            writer.writerow(row)
-
-   # Fetch and write S3 bucket information
-    print("Fetching S3 buckets...")
-    response = s3_client.list_buckets()
-
-    # Extract S3 bucket information from the response
-    buckets = response['Buckets']
-
-    for bucket in buckets:
-        creation_time = bucket.get('CreationDate', 'N/A')
-        creation_time_str = creation_time.strftime('%Y-%m-%d %H:%M:%S') if creation_time != 'N/A' else 'N/A'
-        row = {
-            'Resource Type': 'S3 Bucket',
-            'Region': 'Global',
-            'Resource Name': bucket['Name'],
-            'Resource ARN': '',
-            'Creation/Last Modified Time': creation_time_str,
-            'Other Information': ''
+import bulk
+import clients
+import collectors
+from accounts import DEFAULT_ROLE_NAME, AccountSessions, list_accounts
+from filters import LIVE_INSTANCE_STATES, STATES, FilterStats, ResourceFilter
+from graph import ResourceGraph
+from instrumentation import Instrumentation
+from occupancy import DEFAULT_FULL_SWEEP_INTERVAL, OccupancyMap
+from ratelimit import DEFAULT_INITIAL_RATE, DEFAULT_MAX_RATE, Deadline, DeadlineExceeded, RateLimiter
+from regions import DEFAULT_CATALOGUE_TTL, RegionCatalogue, list_regions
+from s3_collector import BucketRegionCache
+from scheduler import Scheduler, Task
+from sinks import DEFAULT_OUTPUTS, open_sink
+from snapshot import SnapshotStore
+
+
+def split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+def parse_ttls(value):
+    # 'ec2=3600,sqs=600' -> {'ec2': 3600, 'sqs': 600}
+    ttls = {}
+    for item in split_list(value):
+        service, seconds = item.split('=')
+        ttls[service.strip()] = float(seconds)
+    return ttls
+
+
+def parse_states(values):
+    # ['running,stopped'] or ['ec2=running', 'vpc=available'] -> (states for every type,
+    # {collector name: states}); a collector named on its own replaces the common list
+    common, scoped = [], {}
+    for value in values or []:
+        name, _, states = value.rpartition('=')
+        if name:
+            scoped.setdefault(name.strip(), []).extend(split_list(states))
+        else:
+            common.extend(split_list(states))
+    return common, scoped
+
+
+def parse_tags(values):
+    # ['Env=prod', 'Owner'] -> {'Env': 'prod', 'Owner': None}
+    tags = {}
+    for value in values or []:
+        key, _, tag_value = value.partition('=')
+        tags[key] = tag_value if _ else None
+    return tags
+
+
+# Command-line flag of each ResourceFilter field, for error messages
+FILTER_FLAGS = {'states': '--state', 'tags': '--tag', 'vpc_id': '--vpc-id', 'instance_types': '--instance-type',
+                'created_before': '--created-before'}
+
+
+def build_filters(args):
+    # One ResourceFilter per collector; --skip-terminated only narrows EC2 instance states.
+    # Also returns {collector name: fields} for collectors a field can't apply to (--vpc-id for
+    # S3 buckets, say): none of their resources could match, so they are left out of the run.
+    # Raises ValueError for states a type can't be in, as state names differ between types.
+    common_states, scoped_states = parse_states(args.state)
+    unknown = set(scoped_states) - {collector.name for collector in args.collectors}
+    if unknown:
+        raise ValueError(f"--state names collectors that aren't being run: {', '.join(sorted(unknown))}")
+    base = dict(
+        tags=parse_tags(args.tag),
+        vpc_id=args.vpc_id,
+        instance_types=split_list(args.instance_type),
+        created_before=datetime.fromisoformat(args.created_before) if args.created_before else None,
+    )
+    filters = {}
+    inapplicable = {}
+    for collector in args.collectors:
+        collector_filter = dict(base, states=scoped_states.get(collector.name, common_states))
+        if collector.name == 'ec2' and args.skip_terminated and not collector_filter['states']:
+            collector_filter['states'] = LIVE_INSTANCE_STATES
+        resource_filter = ResourceFilter(**collector_filter)
+        invalid = resource_filter.invalid_states(collector.service, collector.operation)
+        if invalid:
+            valid = ', '.join(STATES[(collector.service, collector.operation)])
+            raise ValueError(f"{collector.name} resources are never {', '.join(invalid)} (their states: {valid}); "
+                             f"give states per type, e.g. --state ec2=running --state vpc=available")
+        if resource_filter.active_fields():
+            filters[collector.name] = resource_filter
+            fields = resource_filter.inapplicable(collector.service, collector.operation)
+            if fields:
+                inapplicable[collector.name] = fields
+    return filters, inapplicable
+
+
+def use_snapshot(store, tasks, rescan_services, rescan_regions, ttls, default_ttl):
+    # Swap in cached rows for every task that doesn't need a rescan. A task is rescanned when it
+    # was never scanned, matches --rescan-services/--rescan-regions, or its cache is older than
+    # its TTL. Without a selection or TTL, every task is rescanned and diffed.
+    selecting = bool(rescan_services or rescan_regions)
+    planned = []
+    for task in tasks:
+        ttl = ttls.get(task.service, default_ttl)
+        selected = selecting and (not rescan_services or task.service in rescan_services) and (not rescan_regions or task.region in rescan_regions)
+        if selected or (not selecting and ttl is None) or not store.is_fresh(task.service, task.region, ttl):
+            planned.append((task, False))
+        else:
+            cached = Task(task.service, task.region, lambda task=task: store.cached_rows(task.service, task.region))
+            planned.append((cached, True))
+    return planned
+
+
+def counted(rows, occupancy, task):
+    # Pass rows through, then record how many the task produced
+    count = 0
+    for row in rows:
+        count += 1
+        yield row
+    occupancy.record(task.account, task.service, task.region, count)
+
+
+def write_changes(store, path):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Change', 'Service', 'Region', 'Resource ID', 'Resource Type', 'Resource Name'])
+        for change, service, region, changed_id, row in store.changes():
+            writer.writerow([change, service, region, changed_id, row['Resource Type'], row['Resource Name']])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Write an inventory of AWS resources to a CSV file')
+    parser.add_argument('--services', default='', help=f"Comma-separated collectors to run (default: all of {', '.join(collectors.REGISTRY)})")
+    parser.add_argument('--format', default='csv', choices=sorted(DEFAULT_OUTPUTS), help='Output format')
+    parser.add_argument('--output', default=None, help='File to write (default depends on --format)')
+    parser.add_argument('--backend', default='native', choices=bulk.BACKENDS,
+                        help='How resources are discovered: per-service list calls, the Resource Groups Tagging API (tagged resources only) or an AWS Config aggregator')
+    parser.add_argument('--config-aggregator', default=None, help='AWS Config aggregator to query with --backend config')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows buffered by the output sink between writes')
+    parser.add_argument('--workers', type=int, default=16, help='Maximum number of tasks running at once')
+    parser.add_argument('--service-limit', type=int, default=None, help='Maximum concurrent tasks per service')
+    parser.add_argument('--region-limit', type=int, default=None, help='Maximum concurrent tasks per region')
+    parser.add_argument('--lookahead', type=int, default=None,
+                        help='Maximum tasks started ahead of the one being written (default twice --workers)')
+    parser.add_argument('--max-pool-connections', type=int, default=clients.DEFAULT_MAX_POOL_CONNECTIONS, help='HTTP connections kept per client')
+    parser.add_argument('--retry-mode', default=None, choices=['legacy', 'standard', 'adaptive'],
+                        help="botocore retry mode (default: standard with the rate limiter, else adaptive)")
+    parser.add_argument('--max-attempts', type=int, default=clients.DEFAULT_MAX_ATTEMPTS, help='Maximum attempts per API call')
+    parser.add_argument('--no-rate-limit', action='store_true', help='Disable the adaptive per-account/service/region rate limiter')
+    parser.add_argument('--initial-rate', type=float, default=DEFAULT_INITIAL_RATE, help='Starting calls/s per account, service and region')
+    parser.add_argument('--max-rate', type=float, default=DEFAULT_MAX_RATE, help='Ceiling for the adaptive calls/s per account, service and region')
+    parser.add_argument('--deadline', type=float, default=None, help='Stop the run after this many seconds, keeping what was written so far')
+    parser.add_argument('--sqs-names-only', action='store_true', help='List SQS queue names without fetching their attributes')
+    parser.add_argument('--sqs-workers', type=int, default=8, help='Concurrent get_queue_attributes calls per region')
+    parser.add_argument('--s3-names-only', action='store_true', help='List S3 bucket names and regions without their versioning, encryption and lifecycle')
+    parser.add_argument('--s3-workers', type=int, default=16, help='Concurrent S3 bucket region and detail lookups')
+    parser.add_argument('--s3-region-cache', default=None, help='JSON file caching each S3 bucket\'s region between runs')
+    parser.add_argument('--state', action='append',
+                        help='Resource states to keep, per type as ec2=running,stopped (repeatable), or running,stopped for every type')
+    parser.add_argument('--tag', action='append', help='Tag the resource must carry, Key=Value or just Key (repeatable)')
+    parser.add_argument('--vpc-id', default=None, help='Keep only resources in this VPC')
+    parser.add_argument('--instance-type', default='', help='Comma-separated instance types/classes to keep')
+    parser.add_argument('--created-before', default=None, help='Keep only resources created before this ISO date/time (UTC)')
+    parser.add_argument('--skip-terminated', action='store_true', help="Don't list EC2 instances that are already terminated")
+    parser.add_argument('--accounts', default=None, help="Inventory other accounts: 'organizations' or a file of account IDs (id[,name] per line)")
+    parser.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in each account')
+    parser.add_argument('--external-id', default=None, help='External ID for AssumeRole, if the role requires one')
+    parser.add_argument('--account-workers', type=int, default=16, help='Accounts whose roles and regions are resolved concurrently')
+    parser.add_argument('--snapshot', default=None, help='SQLite snapshot file; enables cached, diffed incremental runs')
+    parser.add_argument('--rescan-services', default='', help='Comma-separated services to rescan; the rest come from the snapshot')
+    parser.add_argument('--rescan-regions', default='', help='Comma-separated regions to rescan; the rest come from the snapshot')
+    parser.add_argument('--ttl', default='', help='Per-service cache TTL in seconds, e.g. ec2=3600,sqs=600')
+    parser.add_argument('--default-ttl', type=float, default=None, help='Cache TTL in seconds for services without --ttl')
+    parser.add_argument('--diff-output', default=None, help='CSV file to write added/removed/changed resources to')
+    parser.add_argument('--region-cache', default=None, help='JSON file caching each account\'s enabled regions between runs')
+    parser.add_argument('--region-cache-ttl', type=float, default=DEFAULT_CATALOGUE_TTL, help='Seconds before the cached region list is refreshed')
+    parser.add_argument('--occupancy', default=None, help='JSON file of which services/regions held resources; long-empty ones are probed less often')
+    parser.add_argument('--full-sweep', action='store_true', help='Scan every service in every region regardless of --occupancy')
+    parser.add_argument('--full-sweep-interval', type=float, default=DEFAULT_FULL_SWEEP_INTERVAL, help='Seconds between forced full sweeps with --occupancy')
+    parser.add_argument('--graph-output', default=None, help='JSON file to write the resource relationship graph to (query it with graph.py)')
+    parser.add_argument('--timings', action='store_true', help='Print wall time per task and client reuse when done')
+    parser.add_argument('--metrics', action='store_true', help='Print per-call API metrics by service, operation and region when done')
+    parser.add_argument('--metrics-output', default=None, help='JSON file to write per-call API metrics to')
+    parser.add_argument('--trace-output', default=None, help='JSON Lines file to write one span per API call to')
+    args = parser.parse_args()
+    try:
+        args.collectors = collectors.select(split_list(args.services))
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        args.filters, inapplicable = build_filters(args)
+    except ValueError as error:
+        parser.error(str(error))
+    if inapplicable:
+        flags = lambda fields: ', '.join(FILTER_FLAGS[field] for field in fields)
+        if args.services:
+            parser.error('; '.join(f"{flags(fields)} can't filter {name}" for name, fields in inapplicable.items())
+                         + '. Drop those services from --services or the filter')
+        for name, fields in inapplicable.items():
+            print(f"Leaving out {name}: {flags(fields)} doesn't apply to it")
+            del args.filters[name]
+        args.collectors = [collector for collector in args.collectors if collector.name not in inapplicable]
+    if args.snapshot and args.filters:
+        # A filtered scan would show every filtered-out resource as removed
+        parser.error('--snapshot cannot be combined with resource filters')
+    if args.snapshot and args.accounts:
+        parser.error('--snapshot cannot be combined with --accounts')
+    if args.backend != 'native' and (args.filters or args.snapshot or args.occupancy or args.graph_output):
+        parser.error(f'--backend {args.backend} cannot be combined with resource filters, --snapshot, --occupancy or --graph-output')
+    if args.backend == 'config' and not args.config_aggregator:
+        parser.error('--backend config needs --config-aggregator')
+    if args.occupancy and (args.filters or args.snapshot):
+        # Filtered-out or cached scopes would be learned as empty
+        parser.error('--occupancy cannot be combined with resource filters or --snapshot')
+    if args.snapshot and args.graph_output:
+        # Rows served from the snapshot carry no relationships, so the graph would have holes
+        parser.error('--snapshot cannot be combined with --graph-output')
+    args.output = args.output or DEFAULT_OUTPUTS[args.format]
+    return args
+
+
+def main():
+    args = parse_args()
+    deadline = Deadline(args.deadline)
+    # botocore's adaptive mode would rate limit a second time on top of ours
+    retry_mode = args.retry_mode or ('adaptive' if args.no_rate_limit else 'standard')
+    pool = clients.configure(max_pool_connections=args.max_pool_connections, retry_mode=retry_mode, max_attempts=args.max_attempts)
+    # Hooked into the pool's session before any client exists, so every API call is measured
+    # and paced
+    instrumentation = Instrumentation(record_spans=bool(args.trace_output)).install(pool.session)
+    limiter = None
+    if not args.no_rate_limit:
+        limiter = RateLimiter(deadline, args.max_attempts, rate=args.initial_rate, max_rate=args.max_rate).install(pool.session)
+
+    # Fetch all AWS regions, per account in multi-account runs (from the region cache when it is
+    # fresh). Each account's session gets the same hooks as the default one; the rate limiter
+    # keys its buckets by account.
+    catalogue = RegionCatalogue(args.region_cache, args.region_cache_ttl) if args.region_cache else None
+    if catalogue:
+        list_regions_for = lambda account_id, session: catalogue.regions(session, account_id or 'default')
+    else:
+        list_regions_for = lambda account_id, session: list_regions(session)
+    if args.accounts:
+        hooks = [lambda session, account_id: instrumentation.install(session)]
+        if limiter:
+            hooks.append(lambda session, account_id: limiter.install(session, account_id))
+        account_sessions = AccountSessions(args.role_name, pool.session, external_id=args.external_id, hooks=hooks)
+        scopes = [(account.id, session, regions) for account, session, regions in account_sessions.resolve(
+            list_accounts(args.accounts), lambda account, session: list_regions_for(account.id, session), args.account_workers)]
+        print(f"Inventorying {len(scopes)} accounts")
+    else:
+        scopes = [(None, None, list_regions_for(None, None))]
+
+    store = SnapshotStore(args.snapshot) if args.snapshot else None
+    # Relationships come from the responses the collectors already fetch (plus list_services per
+    # ECS cluster), so later lookups like "what's in this VPC" need no API calls
+    graph = ResourceGraph() if args.graph_output else None
+    scheduler = Scheduler(max_workers=args.workers, default_service_limit=args.service_limit, region_limit=args.region_limit,
+                          lookahead=args.lookahead)
+    start = time.perf_counter()
+
+    # Open the output sink; rows are typed until the sink renders them for its format
+    details = collectors.details_schema(args.collectors)
+    with open_sink(args.format, args.output, details, args.batch_size, accounts=bool(args.accounts)) as sink:
+        collector_options = {
+            'sqs': {'names_only': args.sqs_names_only, 'max_workers': args.sqs_workers},
+            's3': {'names_only': args.s3_names_only, 'max_workers': args.s3_workers, 'region_cache': BucketRegionCache(args.s3_region_cache)},
         }
-        writer.writerow(row)
-
-    # Fetch and write RDS information
-    for region in aws_regions:
-        print(f"Fetching RDS instances in {region}...")
-
-        # Initialize the Boto3 client for the RDS service in the current region
-        rds_client = boto3.client('rds', region_name=region)
-    
-        # List all RDS instances in the current region
-        response = rds_client.describe_db_instances()
-    
-        # Extract RDS instance information from the response
-        db_instances = response['DBInstances']
-        
-        for db_instance in db_instances:
-            creation_time = db_instance['InstanceCreateTime'].strftime('%Y-%m-%d %H:%M:%S')
-            row = {
-                'Resource Type': 'RDS Instance',
-                'Region': region,
-                'Resource Name': db_instance['DBInstanceIdentifier'],
-                'Resource ARN': db_instance['DBInstanceArn'],
-                'Creation/Last Modified Time': creation_time,
-                'Other Information': f"Engine: {db_instance['Engine']}, Status: {db_instance['DBInstanceStatus']}"
-            }
-            writer.writerow(row)
-    
-    # Fetch and write EFS information
-    for region in aws_regions:
-        print(f"Fetching EFS file systems in {region}...")
-
-        # Initialize the Boto3 client for the EFS service in the current region
-        efs_client = boto3.client('efs', region_name=region)
-
-        # List all EFS file systems in the current region
-        response = efs_client.describe_file_systems()
-
-        # Extract EFS file system information from the response
-        file_systems = response['FileSystems']
-
-        for file_system in file_systems:
-            creation_time = file_system['CreationTime'].strftime('%Y-%m-%d %H:%M:%S')
-            row = {
-                'Resource Type': 'EFS File System',
-                'Region': region,
-                'Resource Name': file_system['Name'],
-                'Resource ARN': file_system['FileSystemArn'],
-                'Creation/Last Modified Time': creation_time,
-                'Other Information': f"Performance Mode: {file_system['PerformanceMode']}, Throughput Mode: {file_system['ThroughputMode']}, LifeCycle State: {file_system['LifeCycleState']}"
-            }
-            writer.writerow(row)
-
-    # Fetch and write SQS information
-    for region in aws_regions:
-        print(f"Fetching SQS queues in {region}...")
-        # Initialize the Boto3 client for the SQS service in the current region
-        sqs_client = boto3.client('sqs', region_name=region)
-        # List all SQS queues in the current region
-        response = sqs_client.list_queues()
-        # Extract SQS queue information from the response
-        queues = response.get('QueueUrls', [])
-        for queue_url in queues:
-            queue_name = queue_url.split('/')[-1]
-            # Fetch additional details for the SQS queue
-            queue_attributes = sqs_client.get_queue_attributes(
-                QueueUrl=queue_url,
-                AttributeNames=['All']
-            )['Attributes']
-            arn = queue_attributes.get('QueueArn', '')
-            created_timestamp = int(queue_attributes.get('CreatedTimestamp', 0)) / 1000  # Convert milliseconds to seconds
-            creation_time = datetime.utcfromtimestamp(created_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-            last_updated_timestamp = int(queue_attributes.get('LastModifiedTimestamp', 0)) / 1000  # Convert milliseconds to seconds
-            last_updated = datetime.utcfromtimestamp(last_updated_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-            message_retention_period = queue_attributes.get('MessageRetentionPeriod', '')
-            visibility_timeout = queue_attributes.get('VisibilityTimeout', '')
-            max_message_size = queue_attributes.get('MaximumMessageSize', '')
-            delay_seconds = queue_attributes.get('DelaySeconds', '')
-            redrive_policy = queue_attributes.get('RedrivePolicy', '')
-            row = {
-                'Resource Type': 'SQS Queue',
-                'Region': region,
-                'Resource Name': queue_name,
-                'Resource ARN': arn,
-                'Creation/Last Modified Time': creation_time,
-                'Other Information': f"Last Updated: {last_updated}, Message Retention Period: {message_retention_period} seconds, Visibility Timeout: {visibility_timeout} seconds, Maximum Message Size: {max_message_size} bytes, Delay Seconds: {delay_seconds} seconds, Redrive Policy: {redrive_policy}"
-            }
-            writer.writerow(row)
-
-    # Fetch and write ECR repositories information
-    for region in aws_regions:
-        print(f"Fetching ECR repositories in {region}...")
-        # Initialize the Boto3 client for the ECR service in the current region
-        ecr_client = boto3.client('ecr', region_name=region)
-        # List all ECR repositories in the current region
-        response = ecr_client.describe_repositories()
-        # Extract ECR repository information from the response
-        repositories = response.get('repositories', [])
-        for repository in repositories:
-            repository_name = repository.get('repositoryName', '')
-            repository_arn = repository.get('repositoryArn', '')
-            creation_time = repository.get('createdAt', '')
-            creation_time_str = datetime.strftime(creation_time, '%Y-%m-%d %H:%M:%S')
-            row = {
-                'Resource Type': 'ECR Repository',
-                'Region': region,
-                'Resource Name': repository_name,
-                'Resource ARN': repository_arn,
-                'Creation/Last Modified Time': creation_time_str,
-                'Other Information': ''
-            }
-            writer.writerow(row)
-
-    # Fetch and write ECS information
-    for region in aws_regions:
-        print(f"Fetching ECS clusters in {region}...")
-        # Initialize the Boto3 client for the ECS service in the current region
-        ecs_client = boto3.client('ecs', region_name=region)
-        # List all ECS clusters in the current region
-        response = ecs_client.list_clusters()
-        # Extract ECS cluster information from the response
-        clusters = response['clusterArns']
-
-        for cluster in clusters:
-            cluster_name = cluster.split('/')[-1]  # Extract cluster name from ARN
-            row = {
-                'Resource Type': 'ECS Cluster',
-                'Region': region,
-                'Resource Name': cluster_name,
-                'Resource ARN': cluster,
-                'Creation/Last Modified Time': '',  # ECS clusters do not have a creation time
-                'Other Information': ''
-            }
-            writer.writerow(row)
\ No newline at end of file
+        filter_stats = FilterStats()
+        # Every account's tasks share one scheduler, so --workers is the budget for the whole run
+        if args.backend == 'native':
+            tasks = [task for account_id, session, regions in scopes for task in collectors.build_tasks(
+                args.collectors, regions, collector_options, args.filters, filter_stats, account_id, session, graph)]
+        else:
+            # One discovery stream per region (or per account for Config), then describe calls
+            # only for what it found
+            if args.backend == 'tagging':
+                print(bulk.TAGGING_WARNING)
+            tasks = [task for account_id, session, regions in scopes for task in bulk.build_tasks(
+                args.collectors, regions, args.backend, collector_options, account_id, session, args.config_aggregator)]
+        occupancy = None
+        if args.occupancy:
+            # Skip service/region pairs that have been empty for a while, unless an existence
+            # check or the backoff schedule says to look again
+            occupancy = OccupancyMap(args.occupancy, args.full_sweep_interval, full_sweep=args.full_sweep)
+            sessions = {account_id: session for account_id, session, _ in scopes}
+            tasks = occupancy.plan(tasks, sessions.get, args.workers)
+        if store:
+            planned = use_snapshot(store, tasks, set(split_list(args.rescan_services)), set(split_list(args.rescan_regions)), parse_ttls(args.ttl), args.default_ttl)
+        else:
+            planned = [(task, False) for task in tasks]
+
+        # Results come back in task order, so the file matches a serial run; rows are
+        # written as they stream in rather than collected first
+        deadline_exceeded = False
+        try:
+            for (task, rows), (_, cached) in zip(scheduler.run(task for task, _ in planned), planned):
+                if store and not cached:
+                    rows = store.track(task.service, task.region, rows)
+                if occupancy:
+                    rows = counted(rows, occupancy, task)
+                sink.write_rows(rows)
+        except DeadlineExceeded:
+            # Everything up to the task that ran out of time is already in the output
+            deadline_exceeded = True
+            print(f"Deadline of {args.deadline:.0f}s reached; output is incomplete")
+
+    if filter_stats.items_seen or filter_stats.pushed_down:
+        print(filter_stats.summary())
+
+    if occupancy:
+        occupancy.save(complete=not deadline_exceeded)
+        print(occupancy.summary())
+
+    if graph:
+        graph.save(args.graph_output)
+        print(graph.summary())
+        print(f"Orphaned VPCs: {len(graph.orphaned_vpcs())} (list them with: python graph.py {args.graph_output} --orphaned-vpcs)")
+
+    if store:
+        print(f"Added: {store.counts['added']}, Removed: {store.counts['removed']}, Changed: {store.counts['changed']}")
+        if args.diff_output:
+            write_changes(store, args.diff_output)
+        store.close()
+
+    if args.timings:
+        scheduler.print_summary()
+        stats = pool.stats()
+        print(f"Clients created: {stats['created']}, reused: {stats['reused']}")
+        if limiter:
+            print(limiter.summary())
+    if args.metrics:
+        print(instrumentation.summary_table())
+    if args.metrics_output:
+        instrumentation.write_json(args.metrics_output)
+    if args.trace_output:
+        instrumentation.write_spans(args.trace_output)
+    print(f"Inventory written to {args.output} in {time.perf_counter() - start:.2f}s")
+    if deadline_exceeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,520 @@
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import zipfile
+
+# Benchmark harness: runs the real collection code against moto seeded with a synthetic
+# account of N regions x M resources per service, with optional per-call latency and
+# injected throttling, and reports wall time, API calls, peak RSS and rows/sec as JSON.
+# Each scenario runs in its own process so peak RSS isn't inherited from the previous one.
+# Requires moto (pip install moto).
+
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+# Error code and HTTP status each protocol uses for throttling
+THROTTLE_ERRORS = {
+    'ec2': (400, 'RequestLimitExceeded'),
+    'query': (400, 'Throttling'),
+    'json': (400, 'ThrottlingException'),
+    'rest-json': (429, 'TooManyRequestsException'),
+    'rest-xml': (503, 'SlowDown'),
+}
+
+
+def throttle_response(protocol):
+    # Build the HTTP response a throttled call gets in this service's protocol, so botocore's
+    # own parsing and retry handling treat it exactly like the real thing
+    from botocore.awsrequest import AWSResponse
+
+    status, code = THROTTLE_ERRORS.get(protocol, (400, 'Throttling'))
+    headers = {}
+    if protocol == 'ec2':
+        body = f'<Response><Errors><Error><Code>{code}</Code><Message>Rate exceeded</Message></Error></Errors><RequestId>bench</RequestId></Response>'
+    elif protocol == 'query':
+        body = f'<ErrorResponse><Error><Type>Sender</Type><Code>{code}</Code><Message>Rate exceeded</Message></Error><RequestId>bench</RequestId></ErrorResponse>'
+    elif protocol == 'rest-xml':
+        body = f'<Error><Code>{code}</Code><Message>Rate exceeded</Message><RequestId>bench</RequestId></Error>'
+    else:
+        headers['x-amzn-ErrorType'] = code
+        headers['Content-Type'] = 'application/x-amz-json-1.1'
+        body = json.dumps({'__type': code, 'message': 'Rate exceeded'})
+
+    raw = _RawBody(body.encode('utf-8'))
+    return AWSResponse('https://benchmark.invalid/', status, headers, raw)
+
+
+class _RawBody:
+    # Minimal urllib3-style body for AWSResponse
+    def __init__(self, data):
+        self._data = data
+
+    def stream(self, **kwargs):
+        yield self._data
+
+
+class FaultInjector:
+    # botocore event hooks that count calls and add latency/throttling to every pooled client
+    def __init__(self, latency_ms=0, throttle_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.throttle_rate = throttle_rate
+        self.api_calls = 0
+        self.http_attempts = 0
+        self.throttles = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        events = session.events
+        events.register('before-call', self._before_call)
+        # Registered first so it runs ahead of moto's own before-send responder
+        events.register_first('before-send', self._before_send)
+
+    def _before_call(self, model, context, **kwargs):
+        # The request context travels with every HTTP attempt of this call
+        context['benchmark_protocol'] = model.metadata['protocol']
+        with self._lock:
+            self.api_calls += 1
+
+    def _before_send(self, request, **kwargs):
+        with self._lock:
+            self.http_attempts += 1
+            throttle = self._random.random() < self.throttle_rate
+            if throttle:
+                self.throttles += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            return throttle_response(request.context.get('benchmark_protocol'))
+        return None
+
+
+def lambda_zip():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('handler.py', 'def lambda_handler(event, context):\n    return event\n')
+    return buffer.getvalue()
+
+
+def seed_account(regions, resources):
+    # Create `resources` of every inventoried type in each region (S3 buckets are global). Every
+    # resource is tagged, so the tagging backend sees the same account as the native collectors.
+    import boto3
+
+    tags = [{'Key': 'benchmark', 'Value': 'true'}]
+    code = lambda_zip()
+    role = boto3.client('iam').create_role(
+        RoleName='benchmark-role', AssumeRolePolicyDocument='{}')['Role']['Arn']
+    for index in range(resources):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=f'benchmark-bucket-{index}')
+
+    for region in regions:
+        ec2 = boto3.client('ec2', region_name=region)
+        ec2.run_instances(ImageId='ami-12345678', MinCount=resources, MaxCount=resources, InstanceType='t3.micro',
+                          TagSpecifications=[{'ResourceType': 'instance', 'Tags': tags}])
+        subnets = [subnet['SubnetId'] for subnet in ec2.describe_subnets()['Subnets']][:2]
+        elbv2 = boto3.client('elbv2', region_name=region)
+        lambda_client = boto3.client('lambda', region_name=region)
+        rds = boto3.client('rds', region_name=region)
+        efs = boto3.client('efs', region_name=region)
+        sqs = boto3.client('sqs', region_name=region)
+        ecr = boto3.client('ecr', region_name=region)
+        ecs = boto3.client('ecs', region_name=region)
+        for index in range(resources):
+            ec2.create_vpc(CidrBlock=f'10.{index % 250}.0.0/16', TagSpecifications=[{'ResourceType': 'vpc', 'Tags': tags}])
+            elbv2.create_load_balancer(Name=f'benchmark-lb-{index}', Subnets=subnets, Tags=tags)
+            lambda_client.create_function(
+                FunctionName=f'benchmark-fn-{index}', Runtime='python3.12', Role=role,
+                Handler='handler.lambda_handler', Code={'ZipFile': code}, Tags={'benchmark': 'true'})
+            rds.create_db_instance(
+                DBInstanceIdentifier=f'benchmark-db-{index}', DBInstanceClass='db.t3.micro', Engine='postgres',
+                MasterUsername='bench', MasterUserPassword='benchmark-password', AllocatedStorage=20, Tags=tags)
+            efs.create_file_system(CreationToken=f'benchmark-fs-{index}', Tags=[{'Key': 'Name', 'Value': f'benchmark-fs-{index}'}])
+            sqs.create_queue(QueueName=f'benchmark-queue-{index}', tags={'benchmark': 'true'})
+            ecr.create_repository(repositoryName=f'benchmark-repo-{index}', tags=tags)
+            ecs.create_cluster(clusterName=f'benchmark-cluster-{index}', tags=[{'key': 'benchmark', 'value': 'true'}])
+
+
+def run_inventory(regions, workers, output_dir):
+    # The all.py path: every registered collector through the scheduler into a CSV sink
+    import collectors
+    from scheduler import Scheduler
+    from sinks import CsvSink
+
+    scheduler = Scheduler(max_workers=workers)
+    with CsvSink(os.path.join(output_dir, 'inventory.csv')) as sink:
+        for _, rows in scheduler.run(collectors.build_tasks(collectors.select(), regions)):
+            sink.write_rows(rows)
+        sink.flush()
+        return sink.rows_written
+
+
+def run_tagging_inventory(regions, workers, output_dir):
+    # all.py --backend tagging: one get_resources stream per region, then describe calls by ID
+    import bulk
+    import collectors
+    from scheduler import Scheduler
+    from sinks import CsvSink
+
+    scheduler = Scheduler(max_workers=workers)
+    with CsvSink(os.path.join(output_dir, 'inventory.csv')) as sink:
+        for _, rows in scheduler.run(bulk.build_tasks(collectors.select(), regions, 'tagging')):
+            sink.write_rows(rows)
+        sink.flush()
+        return sink.rows_written
+
+
+def run_cleanup(regions, workers, output_dir):
+    # The fetchNdel path: concurrent candidate scan, then batched terminations
+    from datetime import datetime, timedelta, timezone
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdafunction'))
+    import fetchNdel
+    from cleanup import CleanupEngine
+    from filters import LIVE_INSTANCE_STATES, ResourceFilter
+
+    engine = CleanupEngine(max_workers=workers)
+    # Everything launched before "tomorrow" counts, so every seeded instance is a candidate
+    cutoff = datetime.now(timezone.utc) + timedelta(days=1)
+    instance_filter = ResourceFilter(states=LIVE_INSTANCE_STATES, created_before=cutoff).compile('ec2', 'describe_instances')
+    candidates = engine.collect(regions, lambda region: fetchNdel.find_old_instances(region, instance_filter), name='ec2')
+    return len(engine.execute(candidates))
+
+
+TARGETS = {
+    'inventory': run_inventory,
+    'inventory-tagging': run_tagging_inventory,
+    'cleanup': run_cleanup,
+}
+
+
+def run_scenario(scenario):
+    # Runs in a fresh process: seed moto, install the fault injector, run the target
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    import tempfile
+
+    from moto import mock_aws
+
+    import clients
+
+    with mock_aws(), tempfile.TemporaryDirectory() as output_dir:
+        regions = scenario['region_names']
+        seed_account(regions, scenario['resources'])
+
+        retry_mode = 'standard' if scenario['rate_limit'] else 'adaptive'
+        pool = clients.configure(max_attempts=scenario['max_attempts'], retry_mode=retry_mode)
+        injector = FaultInjector(scenario['latency_ms'], scenario['throttle_rate'], scenario['seed'])
+        injector.install(pool.session)
+        if scenario['rate_limit']:
+            from ratelimit import RateLimiter
+            RateLimiter(max_attempts=scenario['max_attempts']).install(pool.session)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            rows = TARGETS[scenario['target']](regions, scenario['workers'], output_dir)
+        except Exception as exc:
+            rows = 0
+            error = f'{type(exc).__name__}: {exc}'
+        wall_time = time.perf_counter() - start
+
+    return {
+        'scenario': {key: value for key, value in scenario.items() if key != 'region_names'},
+        'wall_time': round(wall_time, 3),
+        'rows': rows,
+        'rows_per_second': round(rows / wall_time, 1) if wall_time else 0,
+        'api_calls': injector.api_calls,
+        'http_attempts': injector.http_attempts,
+        'throttles_injected': injector.throttles,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'error': error,
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def current_rss_mb():
+    # Resident set right now (Linux); elsewhere fall back to the peak
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+
+# Lambda handlers covered by --startup: name -> directory holding the module
+HANDLERS = {
+    'fetchNdel': 'lambdafunction',
+    'fetchNdelELB': 'lambdafunction',
+    'fetchingsavingreportins3': '.',
+}
+
+# Handler events for --startup; the cleanup handlers run dry so the warm invocation sees the
+# same resources as the cold one
+HANDLER_EVENTS = {
+    'fetchNdel': {'dry_run': True},
+    'fetchNdelELB': {'dry_run': True},
+    'fetchingsavingreportins3': {},
+}
+
+
+def run_startup(handler, event):
+    # Runs in a fresh process, like a Lambda cold start: time the handler module's import
+    # before anything else is loaded, then a cold and a warm invocation against moto. moto
+    # itself is imported after the import measurement but does inflate the RSS figures.
+    import contextlib
+    import importlib
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [root, os.path.join(root, HANDLERS[handler])]
+
+    baseline_rss = current_rss_mb()
+    start = time.perf_counter()
+    module = importlib.import_module(handler)
+    import_time = time.perf_counter() - start
+    import_rss = current_rss_mb() - baseline_rss
+
+    import boto3
+    from moto import mock_aws
+
+    invocations = []
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        for bucket in ('script07', 'abctesting789'):
+            s3.create_bucket(Bucket=bucket)
+        seed_account(['us-east-1'], 2)
+        for _ in range(2):
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                module.lambda_handler(dict(event), None)
+            invocations.append(time.perf_counter() - start)
+
+    return {
+        'handler': handler,
+        'import_ms': round(import_time * 1000, 1),
+        'import_rss_mb': round(import_rss, 1),
+        'cold_invocation_ms': round(invocations[0] * 1000, 1),
+        'warm_invocation_ms': round(invocations[1] * 1000, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def startup_benchmarks(output_path):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for handler in HANDLERS:
+        print(f"Running startup benchmark for {handler}...")
+        with context.Pool(1) as pool:
+            result = pool.apply(run_startup, (handler, HANDLER_EVENTS[handler]))
+        results.append(result)
+        print(f"  import {result['import_ms']} ms (+{result['import_rss_mb']} MB), cold invocation "
+              f"{result['cold_invocation_ms']} ms, warm invocation {result['warm_invocation_ms']} ms, "
+              f"{result['peak_rss_mb']} MB peak RSS")
+    with open(output_path, 'w') as output:
+        json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'startup': results}, output, indent=2)
+    print(f"Results written to {output_path}")
+
+
+# Regions the --memory rows are spread over
+MEMORY_REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-2']
+
+
+def synthetic_instance(index, launch_time):
+    # A describe_instances entry with the fields the EC2 mapper reads
+    return {
+        'InstanceId': f'i-{index:017x}',
+        'InstanceType': 't3.micro',
+        'State': {'Name': 'running'},
+        'PrivateIpAddress': f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}',
+        'LaunchTime': launch_time,
+    }
+
+
+def dict_row(instance, region):
+    # The report row as collectors built it before records.py: a dict per row plus a dict of details
+    return {
+        'Resource Type': 'EC2 Instance',
+        'Region': region,
+        'Resource Name': instance['InstanceId'],
+        'Resource ARN': '',
+        'Creation/Last Modified Time': instance['LaunchTime'],
+        'Other Information': {
+            'Instance Type': instance['InstanceType'],
+            'State': instance['State']['Name'],
+            'Private IP': instance.get('PrivateIpAddress', 'N/A'),
+            'Public IP': instance.get('PublicIpAddress', 'N/A'),
+        }
+    }
+
+
+def run_memory(model, count, trace):
+    # Runs in a fresh process: map count synthetic instances into rows of the given model and
+    # keep them all (as the snapshot diff, the graph or a merge would), then write them through
+    # the CSV sink. Peak RSS is only meaningful without trace; with trace, tracemalloc counts
+    # the bytes and blocks the rows hold instead.
+    import tracemalloc
+    from datetime import datetime, timedelta, timezone
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import collectors
+    from sinks import CsvSink
+
+    mapper = collectors.map_ec2_instance if model == 'record' else dict_row
+    launch_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    baseline_rss = current_rss_mb()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    rows = [mapper(synthetic_instance(index, launch_start + timedelta(seconds=index)), MEMORY_REGIONS[index % len(MEMORY_REGIONS)])
+            for index in range(count)]
+    build_time = time.perf_counter() - start
+    if trace:
+        current, _ = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+        return {'held_mb': round(current / (1024 * 1024), 1), 'held_blocks': blocks}
+
+    result = {'model': model, 'records': count, 'build_seconds': round(build_time, 2)}
+    start = time.perf_counter()
+    with open(os.devnull, 'w', newline='') as devnull:
+        sink = CsvSink(None, fileobj=devnull)
+        sink.write_rows(rows)
+        sink.close()
+    result.update(write_seconds=round(time.perf_counter() - start, 2), peak_rss_mb=round(peak_rss_mb() - baseline_rss, 1))
+    return result
+
+
+def memory_benchmarks(count, output_path):
+    # Each model is measured twice in its own process: once for RSS and write time, once under
+    # tracemalloc for allocations
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for model in ('dict', 'record'):
+        print(f"Running memory benchmark for {count} {model} rows...")
+        result = {}
+        for trace in (False, True):
+            with context.Pool(1) as pool:
+                result.update(pool.apply(run_memory, (model, count, trace)))
+        results.append(result)
+        print(f"  built in {result['build_seconds']}s, written in {result['write_seconds']}s, +{result['peak_rss_mb']} MB peak RSS, "
+              f"{result['held_mb']} MB in {result['held_blocks']} blocks held")
+    dict_result, record_result = results
+    print(f"Records hold {1 - record_result['held_mb'] / dict_result['held_mb']:.0%} less memory in "
+          f"{1 - record_result['held_blocks'] / dict_result['held_blocks']:.0%} fewer blocks; peak RSS "
+          f"{dict_result['peak_rss_mb']} -> {record_result['peak_rss_mb']} MB")
+    with open(output_path, 'w') as output:
+        json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'memory': results}, output, indent=2)
+    print(f"Results written to {output_path}")
+
+
+def scenario_key(result):
+    scenario = result['scenario']
+    return (scenario['target'], scenario['regions'], scenario['resources'], scenario['latency_ms'],
+            scenario['throttle_rate'], scenario['workers'], scenario.get('rate_limit', False))
+
+
+def compare(results, baseline, tolerance):
+    # Flag scenarios whose wall time grew by more than tolerance versus the baseline run
+    previous = {scenario_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(scenario_key(result))
+        if before and before['wall_time'] and result['wall_time'] > before['wall_time'] * (1 + tolerance):
+            regressions.append((result, before))
+    return regressions
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the collectors against a synthetic moto account')
+    parser.add_argument('--target', default='inventory', choices=sorted(TARGETS), help='Code path to benchmark')
+    parser.add_argument('--regions', default='2', help='Comma-separated region counts to try')
+    parser.add_argument('--resources', default='5', help='Comma-separated resources-per-service counts to try')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency added to every HTTP attempt')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of HTTP attempts answered with a throttling error')
+    parser.add_argument('--workers', default='16', help='Comma-separated scheduler worker counts to try')
+    parser.add_argument('--max-attempts', type=int, default=10, help='botocore max attempts per call')
+    parser.add_argument('--rate-limit', action='store_true', help="Pace calls with the adaptive rate limiter instead of botocore's adaptive mode")
+    parser.add_argument('--startup', action='store_true', help='Measure Lambda handler import time, cold/warm invocation latency and memory instead')
+    parser.add_argument('--memory', action='store_true', help='Compare the memory held by dict rows and records.py records instead')
+    parser.add_argument('--records', type=int, default=1000000, help='Rows built by --memory')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for throttle injection')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON file to write results to')
+    parser.add_argument('--baseline', default=None, help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed wall time growth before a scenario counts as a regression')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.startup:
+        startup_benchmarks(args.output)
+        return
+    if args.memory:
+        memory_benchmarks(args.records, args.output)
+        return
+
+    import boto3
+    available_regions = boto3.Session().get_available_regions('ec2')
+
+    scenarios = []
+    for regions, resources, workers in itertools.product(
+            parse_int_list(args.regions), parse_int_list(args.resources), parse_int_list(args.workers)):
+        scenarios.append({
+            'target': args.target,
+            'regions': regions,
+            'region_names': available_regions[:regions],
+            'resources': resources,
+            'latency_ms': args.latency_ms,
+            'throttle_rate': args.throttle_rate,
+            'workers': workers,
+            'max_attempts': args.max_attempts,
+            'rate_limit': args.rate_limit,
+            'seed': args.seed,
+        })
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for scenario in scenarios:
+        print(f"Running {scenario['target']}: {scenario['regions']} regions x {scenario['resources']} resources, {scenario['workers']} workers...")
+        with context.Pool(1) as pool:
+            result = pool.apply(run_scenario, (scenario,))
+        results.append(result)
+        print(f"  {result['wall_time']:.2f}s, {result['rows']} rows ({result['rows_per_second']}/s), "
+              f"{result['api_calls']} API calls, {result['throttles_injected']} throttles, {result['peak_rss_mb']} MB peak RSS"
+              + (f", error: {result['error']}" if result['error'] else ''))
+
+    with open(args.output, 'w') as output:
+        json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'results': results}, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for result, before in regressions:
+            print(f"Regression in {scenario_key(result)}: {before['wall_time']:.2f}s -> {result['wall_time']:.2f}s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
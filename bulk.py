@@ -0,0 +1,171 @@
+import json
+import threading
+from collections import namedtuple
+
+import jmespath
+from botocore.exceptions import ClientError
+
+from clients import get_client
+from collectors import build_tasks as build_native_tasks
+from collectors import with_account
+from occupancy import TAGGING_TYPES, tagging_service
+from paginate import iter_pages
+from scheduler import Task
+
+# Discovery backends for all.py. Instead of one list/describe stream per service per region,
+# one stream lists the ARNs of every resource type in a region (Resource Groups Tagging API)
+# or in the whole account (AWS Config aggregator). The services' own describe calls then run
+# only to fill in the report columns, batched by ID, and only where something was found.
+BACKENDS = ('native', 'tagging', 'config')
+
+# Printed by runs on the tagging backend, which can't see untagged resources at all
+TAGGING_WARNING = ("Warning: --backend tagging only finds resources that carry a tag; untagged resources are missing "
+                   "from this report. Use --backend native or config to include them.")
+
+# AWS Config resource type per collector
+CONFIG_TYPES = {
+    'ec2': 'AWS::EC2::Instance',
+    'lambda': 'AWS::Lambda::Function',
+    'elbv2': 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    'vpc': 'AWS::EC2::VPC',
+    'rds': 'AWS::RDS::DBInstance',
+    'efs': 'AWS::EFS::FileSystem',
+    'sqs': 'AWS::SQS::Queue',
+    'ecr': 'AWS::ECR::Repository',
+    'ecs': 'AWS::ECS::Cluster',
+}
+
+# How to describe a known set of resources of one collector in one call:
+#   batch_size - IDs one call accepts
+#   params     - params(ids) -> keyword arguments for the collector's own operation
+#   resource   - resource(arn) -> the ID the operation takes
+# Collectors missing here can't be described by ID (list_functions, describe_file_systems,
+# list_queues), so their native collector runs in regions where discovery found any.
+Enrichment = namedtuple('Enrichment', ['batch_size', 'params', 'resource'])
+
+ENRICHMENTS = {
+    'ec2': Enrichment(1000, lambda ids: {'InstanceIds': ids}, lambda arn: arn.rsplit('/', 1)[-1]),
+    'vpc': Enrichment(200, lambda ids: {'VpcIds': ids}, lambda arn: arn.rsplit('/', 1)[-1]),
+    'elbv2': Enrichment(20, lambda ids: {'LoadBalancerArns': ids}, lambda arn: arn),
+    'rds': Enrichment(100, lambda ids: {'Filters': [{'Name': 'db-instance-id', 'Values': ids}]}, lambda arn: arn),
+    'ecr': Enrichment(100, lambda ids: {'repositoryNames': ids}, lambda arn: arn.split('/', 1)[-1]),
+}
+
+# Collectors whose discovered ARN is already everything the report row needs
+ARN_ONLY = {'ecs'}
+
+
+def discover_tagging(region, collectors, session=None):
+    # {collector name: [ARN, ...]} for one region from a single get_resources stream. Only
+    # resources that carry (or once carried) a tag are listed.
+    wanted = {TAGGING_TYPES[collector.name]: collector.name for collector in collectors if collector.name in TAGGING_TYPES}
+    found = {}
+    if not wanted:
+        return found
+    client = get_client('resourcegroupstaggingapi', region, session)
+    for page in iter_pages(client, 'get_resources', ResourceTypeFilters=sorted(wanted)):
+        for item in page['ResourceTagMappingList']:
+            name = wanted.get(tagging_service(item['ResourceARN']))
+            if name:
+                found.setdefault(name, []).append(item['ResourceARN'])
+    return found
+
+
+def discover_config(aggregator, collectors, account=None, session=None):
+    # {region: {collector name: [ARN, ...]}} for the whole account from one aggregator query.
+    # Covers every resource Config records, tagged or not. The aggregator may span the whole
+    # organization, so the query is limited to the account (default: the caller's).
+    wanted = {CONFIG_TYPES[collector.name]: collector.name for collector in collectors if collector.name in CONFIG_TYPES}
+    found = {}
+    if not wanted:
+        return found
+    account = account or get_client('sts', session=session).get_caller_identity()['Account']
+    types = ', '.join(f"'{resource_type}'" for resource_type in sorted(wanted))
+    expression = f"SELECT arn, resourceType, awsRegion WHERE resourceType IN ({types}) AND accountId = '{account}'"
+    client = get_client('config', session=session)
+    for page in iter_pages(client, 'select_aggregate_resource_config', Expression=expression,
+                           ConfigurationAggregatorName=aggregator):
+        for result in page['Results']:
+            item = json.loads(result)
+            found.setdefault(item['awsRegion'], {}).setdefault(wanted[item['resourceType']], []).append(item['arn'])
+    return found
+
+
+def enrich(collector, region, arns, session=None, **options):
+    # Report rows for the discovered resources of one collector in one region; nothing (and no
+    # API call) when discovery found none
+    if not arns:
+        return
+    if collector.name in ARN_ONLY:
+        for arn in arns:
+            yield collector.mapper(arn, region)
+        return
+    enrichment = ENRICHMENTS.get(collector.name)
+    if enrichment is None:
+        yield from collector.collect(region, session=session, **options)
+        return
+
+    client = get_client(collector.service, region, session)
+    expression = jmespath.compile(collector.result_key)
+    ids = [enrichment.resource(arn) for arn in arns]
+    # Every batch is described before any row is yielded, so falling back to a native listing
+    # part way through can't repeat the rows of the batches before it
+    items = []
+    for start in range(0, len(ids), enrichment.batch_size):
+        batch = ids[start:start + enrichment.batch_size]
+        try:
+            response = getattr(client, collector.operation)(**collector.params, **enrichment.params(batch))
+        except ClientError as error:
+            # Discovery can lag behind deletions, and one stale ID fails the whole batch; list
+            # the region natively instead
+            print(f"Describing {collector.label} by ID failed in {region}, listing instead: {error}")
+            yield from collector.collect(region, session=session, **options)
+            return
+        items.extend(expression.search(response) or [])
+    for item in items:
+        yield collector.mapper(item, region)
+
+
+class RegionDiscovery:
+    # Runs discover(region) once per region, when the first task of that region asks for it;
+    # the other collectors' tasks for the region wait for and share the result
+    def __init__(self, discover):
+        self.discover = discover
+        self._found = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, region):
+        with self._lock:
+            lock = self._locks.setdefault(region, threading.Lock())
+        with lock:
+            if region not in self._found:
+                self._found[region] = self.discover(region)
+            return self._found[region]
+
+
+def build_tasks(collectors, regions, backend, options=None, account=None, session=None, aggregator=None):
+    # One task per (collector, region) in the same order as the native backend, so both give
+    # the same report for the same resources. Discovery is still one stream per region (one
+    # query per account for Config, run up front), shared by that region's tasks; global
+    # collectors run their usual tasks (S3 is a single list_buckets call anyway).
+    options = options or {}
+    regional = [collector for collector in collectors if collector.regional]
+    if backend == 'config':
+        by_region = discover_config(aggregator, regional, account, session)
+        discover = lambda region: by_region.get(region, {})
+    else:
+        discover = RegionDiscovery(lambda region: discover_tagging(region, regional, session))
+    tasks = []
+    for collector in collectors:
+        if not collector.regional:
+            tasks.extend(build_native_tasks([collector], regions, options, account=account, session=session))
+            continue
+        collector_options = options.get(collector.name, {})
+        for region in regions:
+            func = lambda collector=collector, region=region: enrich(collector, region, discover(region).get(collector.name, []),
+                                                                     session, **collector_options)
+            if account is not None:
+                func = lambda func=func: with_account(func(), account)
+            tasks.append(Task(collector.name, region, func, account))
+    return tasks
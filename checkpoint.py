@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from cleanup import ActionResult, Candidate
+from clients import get_client
+from instrumentation import emit_emf
+from snapshot import decode_row, encode_row
+
+# Stop starting new work once less than this much of the invocation is left; enough for the
+# call in flight to finish and the checkpoint to be written
+DEFAULT_MARGIN_MS = 2500
+
+# A checkpoint whose run started longer ago than this was abandoned; a new run starts afresh
+# rather than resuming it with a stale cutoff and candidate list
+MAX_CHECKPOINT_AGE = timedelta(days=1)
+
+# Candidates acted on between checks of the budget; the checkpoint is saved after each chunk so
+# an invocation killed mid-way loses at most one chunk's results
+ACT_CHUNK_SIZE = 100
+
+
+class TimeBudget:
+    # Wraps the Lambda context; without one (local runs) the budget never runs out
+    def __init__(self, context=None, margin_ms=DEFAULT_MARGIN_MS):
+        self.context = context
+        self.margin_ms = margin_ms
+
+    @property
+    def limited(self):
+        return self.context is not None
+
+    def remaining_ms(self):
+        return self.context.get_remaining_time_in_millis() if self.context is not None else None
+
+    def exhausted(self):
+        remaining = self.remaining_ms()
+        return remaining is not None and remaining < self.margin_ms
+
+
+class S3CheckpointStore:
+    def __init__(self, bucket, key, s3_client=None):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client or get_client('s3')
+
+    def load(self):
+        try:
+            return self.s3_client.get_object(Bucket=self.bucket, Key=self.key)['Body'].read().decode('utf-8')
+        except ClientError as error:
+            if error.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def save(self, data):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=data.encode('utf-8'))
+
+    def delete(self):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self.key)
+
+    def __str__(self):
+        return f's3://{self.bucket}/{self.key}'
+
+
+class FileCheckpointStore:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as checkpoint_file:
+            return checkpoint_file.read()
+
+    def save(self, data):
+        # Write then rename, so a crash mid-write never leaves half a checkpoint behind
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as checkpoint_file:
+            checkpoint_file.write(data)
+        os.replace(temporary, self.path)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __str__(self):
+        return self.path
+
+
+def open_store(location, bucket):
+    # 'file:///tmp/run.json' for a local file, anything else is a key in the report bucket
+    if location.startswith('file://'):
+        return FileCheckpointStore(location[len('file://'):])
+    return S3CheckpointStore(bucket, location)
+
+
+class Checkpoint:
+    # Progress of a cleanup run that may span several invocations:
+    #   scopes  - one entry per (account, service, region) in scan order, with the pagination
+    #             token to resume from, whether the scan is done, and the candidates found so far
+    #   actions - what happened to each candidate that has been acted on
+    # The report is built from this state alone, so however the work was split it comes out
+    # the same as a single uninterrupted run. fingerprint identifies the event the run is for;
+    # a checkpoint left by a different event, or older than max_age, is discarded.
+    def __init__(self, store, fingerprint, state=None):
+        self.store = store
+        self.fingerprint = fingerprint
+        self.state = state or {
+            'fingerprint': fingerprint,
+            'started': datetime.now(timezone.utc),
+            'invocations': 0,
+            'scopes': [],
+            'actions': {},
+        }
+        self._scopes = {(scope['account'], scope['service'], scope['region']): scope for scope in self.state['scopes']}
+        # Whether the store holds a copy that has to be deleted once the run is complete
+        self.persisted = state is not None
+        self._lock = threading.Lock()
+        # Serializes saves, so a slower save of an older state can't overwrite a newer one
+        self._save_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, store, fingerprint, max_age=MAX_CHECKPOINT_AGE):
+        data = store.load()
+        state = decode_row(data) if data else None
+        if state is not None and state.get('fingerprint') != fingerprint:
+            print(f"Ignoring checkpoint {store}: it was written for a different event")
+            state = None
+        elif state is not None and datetime.now(timezone.utc) - state['started'] > max_age:
+            print(f"Ignoring checkpoint {store}: its run started at {state['started'].isoformat()}, more than {max_age.total_seconds() / 3600:g} hours ago")
+            state = None
+        checkpoint = cls(store, fingerprint, state)
+        checkpoint.persisted = data is not None
+        checkpoint.state['invocations'] += 1
+        return checkpoint
+
+    @property
+    def started(self):
+        return self.state['started']
+
+    def resumed(self):
+        return self.state['invocations'] > 1
+
+    def scope(self, account, service, region):
+        key = (account, service, region)
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is None:
+                scope = self._scopes[key] = {'account': account, 'service': service, 'region': region,
+                                             'token': None, 'done': False, 'candidates': []}
+                self.state['scopes'].append(scope)
+            return scope
+
+    def regions(self, account, service):
+        # Regions planned by an earlier invocation, so a resumed run covers the same ones
+        return [scope['region'] for scope in self.state['scopes']
+                if scope['account'] == account and scope['service'] == service]
+
+    def plan(self, account, service, regions):
+        # Register the scopes in scan order before they run concurrently
+        for region in regions:
+            self.scope(account, service, region)
+
+    def add_page(self, scope, candidates, next_token):
+        with self._lock:
+            scope['candidates'].extend(candidate._asdict() for candidate in candidates)
+            scope['token'] = next_token
+            scope['done'] = next_token is None
+
+    def scanned(self, account, service):
+        return all(scope['done'] for scope in self.state['scopes']
+                   if scope['account'] == account and scope['service'] == service)
+
+    def candidates(self, account, service):
+        return [Candidate(**candidate) for scope in self.state['scopes']
+                if scope['account'] == account and scope['service'] == service
+                for candidate in scope['candidates']]
+
+    def _action_key(self, account, candidate):
+        return f'{account or ""}|{candidate.region}|{candidate.resource_id}'
+
+    def result(self, account, candidate):
+        recorded = self.state['actions'].get(self._action_key(account, candidate))
+        if recorded is None:
+            return None
+        return ActionResult(candidate.action, candidate.region, candidate.resource_id, candidate.name, *recorded)
+
+    def record(self, account, results):
+        with self._lock:
+            for result in results:
+                self.state['actions'][f'{account or ""}|{result.region}|{result.resource_id}'] = [result.status, result.message]
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                data = encode_row(self.state)
+            self.store.save(data)
+            self.persisted = True
+
+    def delete(self):
+        if self.persisted:
+            self.store.delete()
+            self.persisted = False
+
+
+def scan(engine, checkpoint, budget, account, service, regions, find_pages):
+    # Scan the regions that aren't finished yet, concurrently, resuming each from its saved
+    # pagination token. find_pages(region, starting_token) yields (candidates, next_token) per
+    # page. A region stops at the next page boundary once the budget runs low. Under a time
+    # budget the checkpoint is saved after every page, so an invocation killed outright (hard
+    # timeout, out of memory, a page that never returns) loses at most the pages in flight.
+    # Returns True when every region has been scanned to the end. A resumed run keeps the
+    # regions it planned first, whatever regions() would return now.
+    regions = checkpoint.regions(account, service) or regions()
+    checkpoint.plan(account, service, regions)
+
+    def finder(region):
+        scope = checkpoint.scope(account, service, region)
+        if scope['done']:
+            return
+        pages = find_pages(region, scope['token'])
+        while not budget.exhausted():
+            page = next(pages, None)
+            if page is None:
+                checkpoint.add_page(scope, [], None)
+                if budget.limited:
+                    checkpoint.save()
+                return
+            candidates, next_token = page
+            checkpoint.add_page(scope, candidates, next_token)
+            if budget.limited:
+                checkpoint.save()
+            yield from candidates
+            if next_token is None:
+                return
+
+    engine.collect(regions, finder, name=service)
+    return checkpoint.scanned(account, service)
+
+
+def act(engine, checkpoint, budget, account, service, execute):
+    # Run execute(engine, candidates) on the candidates nothing has been done to yet, a chunk at
+    # a time, recording and saving the results after each chunk. Returns True once every
+    # candidate has a result and False if the budget ran out first.
+    pending = [candidate for candidate in checkpoint.candidates(account, service)
+               if checkpoint.result(account, candidate) is None]
+    for start in range(0, len(pending), ACT_CHUNK_SIZE):
+        if budget.exhausted():
+            return False
+        checkpoint.record(account, execute(engine, pending[start:start + ACT_CHUNK_SIZE]))
+        if budget.limited:
+            checkpoint.save()
+    return True
+
+
+def fingerprint(scope, handler):
+    # Identifies the work an event asks for, so a checkpoint is only resumed by the same event
+    return json.dumps({'handler': handler, **scope._asdict()}, sort_keys=True)
+
+
+def open_checkpoint(scope, handler):
+    # The handler's checkpoint for this event: the event's own location, or
+    # '<prefix>checkpoints/<handler>-<event hash>.json' in the report bucket. The hash keeps
+    # Map items that share a prefix but differ otherwise from overwriting each other's progress.
+    event_fingerprint = fingerprint(scope, handler)
+    digest = hashlib.sha256(event_fingerprint.encode('utf-8')).hexdigest()[:16]
+    store = open_store(scope.checkpoint or f'{scope.prefix}checkpoints/{handler}-{digest}.json', scope.bucket)
+    return Checkpoint.load(store, event_fingerprint)
+
+
+def incomplete(checkpoint, handler):
+    # Save progress and tell the caller to invoke again with the same event
+    checkpoint.save()
+    print(f"Time budget exhausted; progress saved to {checkpoint.store}")
+    emit_emf(Handler=handler)
+    return {
+        'statusCode': 202,
+        'body': f'{handler} stopped before the Lambda timeout; invoke again with the same event to resume',
+        'complete': False,
+        'checkpoint': str(checkpoint.store),
+    }
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from clients import get_client
+from scheduler import Scheduler, Task
+
+# Something a cleanup sweep wants to act on
+Candidate = namedtuple('Candidate', ['action', 'region', 'resource_id', 'name', 'details'])
+
+# Outcome of one action on one resource; status is 'done', 'failed' or 'dry-run'
+ActionResult = namedtuple('ActionResult', ['action', 'region', 'resource_id', 'name', 'status', 'message'])
+
+# How to carry out each kind of action:
+#   service    - boto3 service the action calls
+#   batch_size - how many resource IDs one API call accepts
+#   call       - call(client, resource_ids) performing the action
+Action = namedtuple('Action', ['service', 'batch_size', 'call'])
+
+ACTIONS = {
+    'terminate_instance': Action('ec2', 1000, lambda client, ids: client.terminate_instances(InstanceIds=ids)),
+    'delete_load_balancer': Action('elbv2', 1, lambda client, ids: client.delete_load_balancer(LoadBalancerArn=ids[0])),
+}
+
+
+class RegionPacer:
+    # Spaces out calls to the same region so a sweep stays under the API rate limits
+    def __init__(self, calls_per_second):
+        self.interval = 1.0 / calls_per_second if calls_per_second else 0
+        self._next_call = {}
+        self._lock = threading.Lock()
+
+    def wait(self, region):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            scheduled = max(now, self._next_call.get(region, now))
+            self._next_call[region] = scheduled + self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+
+class CleanupEngine:
+    # Three phases: collect candidates from every region at once, group them into batches of
+    # up to the API's per-call limit, then run each region's batches in parallel under a
+    # per-region rate limit. In dry-run mode the plan is reported without calling any API.
+    def __init__(self, max_workers=16, workers_per_region=4, calls_per_second=5.0, dry_run=False, session=None):
+        # session selects another account's credentials for the actions
+        self.max_workers = max_workers
+        self.workers_per_region = workers_per_region
+        self.dry_run = dry_run
+        self.session = session
+        self.pacer = RegionPacer(calls_per_second)
+        self.scheduler = Scheduler(max_workers=max_workers)
+
+    def collect(self, regions, finder, name='cleanup'):
+        # finder(region) yields Candidates; regions are scanned concurrently and the result keeps
+        # region order
+        tasks = [Task(name, region, lambda region=region: finder(region)) for region in regions]
+        return [candidate for _, candidates in self.scheduler.run(tasks) for candidate in candidates]
+
+    def plan(self, candidates):
+        # {region: [(action, [candidates...]), ...]} with each batch sized for one API call
+        plan = OrderedDict()
+        for candidate in candidates:
+            batches = plan.setdefault(candidate.region, [])
+            batch_size = ACTIONS[candidate.action].batch_size
+            if batches and batches[-1][0] == candidate.action and len(batches[-1][1]) < batch_size:
+                batches[-1][1].append(candidate)
+            else:
+                batches.append((candidate.action, [candidate]))
+        return plan
+
+    def execute(self, candidates):
+        plan = self.plan(candidates)
+        if self.dry_run:
+            return [ActionResult(c.action, c.region, c.resource_id, c.name, 'dry-run', '')
+                    for batches in plan.values() for _, batch in batches for c in batch]
+
+        # Regions run side by side; within a region, batches share workers_per_region threads
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._run_region, region, batches) for region, batches in plan.items()]
+            return [result for future in futures for result in future.result()]
+
+    def _run_region(self, region, batches):
+        with ThreadPoolExecutor(max_workers=self.workers_per_region) as executor:
+            futures = [executor.submit(self._run_batch, region, action, batch) for action, batch in batches]
+            return [result for future in futures for result in future.result()]
+
+    def _run_batch(self, region, action_name, batch):
+        action = ACTIONS[action_name]
+        client = get_client(action.service, region, self.session)
+        self.pacer.wait(region)
+        try:
+            action.call(client, [candidate.resource_id for candidate in batch])
+            return [ActionResult(action_name, region, c.resource_id, c.name, 'done', '') for c in batch]
+        except ClientError as error:
+            if len(batch) == 1:
+                return [ActionResult(action_name, region, batch[0].resource_id, batch[0].name, 'failed', str(error))]
+        except BotoCoreError as error:
+            # Transport errors (no connection, read timeout) say nothing about single IDs, and
+            # the call may even have gone through, so the batch is reported as failed as a whole
+            # rather than escaping execute() and losing the results of the other batches
+            return [ActionResult(action_name, region, c.resource_id, c.name, 'failed', str(error)) for c in batch]
+        # One bad ID fails the whole call, so retry the batch one resource at a time to find out
+        # which ones actually failed
+        results = []
+        for candidate in batch:
+            results.extend(self._run_batch(region, action_name, [candidate]))
+        return results
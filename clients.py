@@ -0,0 +1,74 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Defaults for every pooled client: enough HTTP connections for the collectors that fan out
+# over one client, and botocore's adaptive retry mode so throttled calls back off client-side
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_RETRY_MODE = 'adaptive'
+DEFAULT_MAX_ATTEMPTS = 10
+
+
+class ClientPool:
+    def __init__(self, session=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 retry_mode=DEFAULT_RETRY_MODE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.session = session or boto3.Session()
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={'mode': retry_mode, 'max_attempts': max_attempts},
+        )
+        self.created = 0
+        self.reused = 0
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, service, region=None, session=None):
+        # Clients are keyed by (service, region, session); the session carries the credentials,
+        # so two accounts never share a client while every task for the same account does.
+        # boto3 clients are thread-safe, but building them from a shared session is not, so
+        # creation happens under the lock.
+        session = session or self.session
+        key = (service, region, session)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = session.client(service, region_name=region, config=self.config)
+                self._clients[key] = client
+                self.created += 1
+            else:
+                self.reused += 1
+            return client
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused, 'cached': len(self._clients)}
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+# Module-level pool, so clients survive across warm Lambda invocations of the same container
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ClientPool()
+        return _default_pool
+
+
+def configure(**kwargs):
+    # Replace the default pool, e.g. configure(max_pool_connections=100, retry_mode='standard')
+    global _default_pool
+    with _default_pool_lock:
+        _default_pool = ClientPool(**kwargs)
+        return _default_pool
+
+
+def get_client(service, region=None, session=None):
+    return default_pool().client(service, region, session)
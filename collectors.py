@@ -0,0 +1,285 @@
+import sys
+from datetime import date
+
+from clients import get_client
+from graph import SECURITY_GROUP, SERVICE, SUBNET, VPC
+from paginate import paginate
+from records import (EcrRepository, EcsCluster, Ec2Instance, EfsFileSystem, LambdaFunction, LoadBalancer, RdsInstance,
+                     S3Bucket, SqsQueue, Vpc, epoch_micros)
+from scheduler import Task
+from snapshot import resource_id
+from s3_collector import collect_s3_buckets
+from sqs_collector import collect_sqs_queues
+
+
+class Collector:
+    # Declares how to inventory one resource type:
+    #   name       - key used by --services, the scheduler and the snapshot store
+    #   label      - plural description used in progress messages
+    #   service    - boto3 service the client is created for
+    #   operation  - list/describe call; its paginator carries the pagination token
+    #   result_key - JMESPath expression selecting the items in each page
+    #   mapper     - mapper(item, region) -> report row, a Record from records.py
+    #   regional   - False for global APIs (like list_buckets), which run once as 'Global'; their
+    #                rows can still name each resource's own region
+    #   params     - extra keyword arguments for the API call
+    #   details    - typed fields of the row's 'Other Information' dict, name -> 'string',
+    #                'int64', 'timestamp' or 'json' (lists/objects); the CSV sink renders them
+    #                as "Name: value, ..."
+    #   fetch      - optional fetch(client, region, session=None, **options) generator for
+    #                collectors that need more than one call per item; replaces result_key and
+    #                mapper. operation then names the list call whose filter fields (see
+    #                filters.FIELDS) apply, and a resource filter is passed as
+    #                item_filter(items) -> items
+    #   relations  - optional relations(item, client) -> [(relation, target ID), ...] linking the
+    #                item to other resources in a ResourceGraph (see graph.py); only called when
+    #                a graph is being built
+    #   attributes - optional attributes(item) -> dict stored on the item's graph node
+    def __init__(self, name, label, service, operation=None, result_key=None, mapper=None,
+                 regional=True, params=None, fetch=None, details=None, relations=None, attributes=None):
+        self.name = name
+        self.label = label
+        self.service = service
+        self.operation = operation
+        self.result_key = result_key
+        self.mapper = mapper
+        self.regional = regional
+        self.params = dict(params or {})
+        self.fetch = fetch
+        self.details = dict(details or {})
+        self.relations = relations
+        self.attributes = attributes
+
+    def collect(self, region, resource_filter=None, filter_stats=None, session=None, graph=None, account=None, **options):
+        # Yield report rows for one region (or 'Global'), streaming page by page. A
+        # resource_filter is pushed into the API call where the service supports it and
+        # checked client-side otherwise. session selects another account's credentials.
+        # With a graph, every item is also added to it with its relationships, from the
+        # response already in hand.
+        if self.regional:
+            print(f"Fetching {self.label} in {region}...")
+            client = get_client(self.service, region, session)
+        else:
+            print(f"Fetching {self.label}...")
+            client = get_client(self.service, session=session)
+
+        compiled = resource_filter.compile(self.service, self.operation, filter_stats) if resource_filter else None
+        if self.fetch:
+            if compiled:
+                options['item_filter'] = compiled.apply
+            yield from self.fetch(client, region, session=session, **options)
+            return
+
+        params = dict(self.params)
+        if compiled:
+            params['Filters'] = params.get('Filters', []) + compiled.params.get('Filters', [])
+            if not params['Filters']:
+                del params['Filters']
+        items = paginate(client, self.operation, self.result_key, **params)
+        if compiled:
+            items = compiled.apply(items)
+        for item in items:
+            row = self.mapper(item, region)
+            if graph is not None:
+                graph.add_resource(resource_id(row), row['Resource Type'], row['Region'], row['Resource Name'], account,
+                                   self.attributes(item) if self.attributes else None,
+                                   self.relations(item, client) if self.relations else ())
+            yield row
+
+
+# Registered collectors, in the order their rows appear in the report
+REGISTRY = {}
+
+
+def register(collector):
+    if collector.name in REGISTRY:
+        raise ValueError(f"Collector {collector.name!r} is already registered")
+    REGISTRY[collector.name] = collector
+    return collector
+
+
+def select(names=None):
+    # Registered collectors matching names (all of them when names is empty), in report order
+    if not names:
+        return list(REGISTRY.values())
+    unknown = set(names) - set(REGISTRY)
+    if unknown:
+        raise ValueError(f"Unknown collectors: {', '.join(sorted(unknown))}. Available: {', '.join(REGISTRY)}")
+    return [collector for name, collector in REGISTRY.items() if name in names]
+
+
+def build_tasks(collectors, regions, options=None, filters=None, filter_stats=None, account=None, session=None, graph=None):
+    # One task per (collector, region), plus a single 'Global' task for global collectors.
+    # options maps a collector name to extra keyword arguments for its collect(), and
+    # filters maps a collector name to the ResourceFilter it should apply. With an account,
+    # the tasks use that account's session and every row carries an 'Account' column. With a
+    # graph, collectors that declare relations add their resources to it.
+    options = options or {}
+    filters = filters or {}
+    tasks = []
+    for collector in collectors:
+        collector_options = dict(options.get(collector.name, {}))
+        if filters.get(collector.name):
+            collector_options.update(resource_filter=filters[collector.name], filter_stats=filter_stats)
+        if session is not None:
+            collector_options['session'] = session
+        if graph is not None and collector.relations:
+            collector_options.update(graph=graph, account=account)
+        collector_regions = regions if collector.regional else ['Global']
+        for region in collector_regions:
+            func = lambda collector=collector, region=region, collector_options=collector_options: collector.collect(region, **collector_options)
+            if account is not None:
+                func = lambda func=func: with_account(func(), account)
+            tasks.append(Task(collector.name, region, func, account))
+    return tasks
+
+
+def with_account(rows, account):
+    # Records carry the account in a slot of their own, which adds the leading Account column
+    account = sys.intern(account)
+    for row in rows:
+        row.account = account
+        yield row
+
+
+def details_schema(collectors):
+    # Union of the detail fields declared by the given collectors, for typed sinks
+    schema = {}
+    for collector in collectors:
+        schema.update(collector.details)
+    return schema
+
+
+def to_int(value):
+    # SQS returns numeric attributes as strings; missing ones become None
+    return int(value) if value not in (None, '') else None
+
+
+def network_relations(vpc_id, subnet_ids=(), security_group_ids=()):
+    return ([(VPC, vpc_id)] + [(SUBNET, subnet_id) for subnet_id in subnet_ids]
+            + [(SECURITY_GROUP, group_id) for group_id in security_group_ids])
+
+
+def ec2_instance_relations(instance, client):
+    return network_relations(instance.get('VpcId'), [instance['SubnetId']] if instance.get('SubnetId') else [],
+                             [group['GroupId'] for group in instance.get('SecurityGroups', [])])
+
+
+def lambda_function_relations(function, client):
+    vpc_config = function.get('VpcConfig') or {}
+    return network_relations(vpc_config.get('VpcId'), vpc_config.get('SubnetIds', []), vpc_config.get('SecurityGroupIds', []))
+
+
+def elb_relations(elb, client):
+    return network_relations(elb.get('VpcId'), [zone['SubnetId'] for zone in elb.get('AvailabilityZones', []) if zone.get('SubnetId')],
+                             elb.get('SecurityGroups', []))
+
+
+def rds_instance_relations(db_instance, client):
+    subnet_group = db_instance.get('DBSubnetGroup') or {}
+    return network_relations(subnet_group.get('VpcId'), [subnet['SubnetIdentifier'] for subnet in subnet_group.get('Subnets', [])],
+                             [group['VpcSecurityGroupId'] for group in db_instance.get('VpcSecurityGroups', [])])
+
+
+def ecs_cluster_relations(cluster, client):
+    # list_clusters only returns ARNs, so this is the one relation that costs calls of its own
+    return [(SERVICE, service_arn) for service_arn in paginate(client, 'list_services', 'serviceArns', cluster=cluster)]
+
+
+def vpc_attributes(vpc):
+    return {'default': vpc.get('IsDefault', False), 'cidr': vpc.get('CidrBlock', '')}
+
+
+def map_ec2_instance(instance, region):
+    return Ec2Instance(region, instance['InstanceId'], '', instance['LaunchTime'],
+                       instance['InstanceType'], instance['State']['Name'],
+                       instance.get('PrivateIpAddress', 'N/A'), instance.get('PublicIpAddress', 'N/A'))
+
+
+def map_lambda_function(function, region):
+    last_modified = function.get('LastModified', 'N/A')
+    if last_modified != 'N/A':
+        # Lambda returns an ISO string; the report only shows the date part
+        last_modified = date.fromisoformat(last_modified.split('T')[0])
+    return LambdaFunction(region, function['FunctionName'], function['FunctionArn'], last_modified,
+                          function['Runtime'], function['Handler'], function['MemorySize'], function['Timeout'])
+
+
+def map_elb(elb, region):
+    dns_name = elb.get('DNSName', 'N/A')
+    scheme = elb.get('Scheme', 'N/A')  # Check if 'Scheme' key exists
+    return LoadBalancer(region, elb['LoadBalancerName'], elb['LoadBalancerArn'], elb['CreatedTime'],
+                        dns_name, scheme, elb['Type'])
+
+
+def map_vpc(vpc, region):
+    return Vpc(region, vpc['VpcId'], '', vpc.get('CreateTime', 'N/A'))
+
+
+def fetch_s3_buckets(s3_client, region, session=None, item_filter=None, names_only=False, max_workers=16, region_cache=None):
+    # One list_buckets stream; each bucket's region is resolved (or read from region_cache, a
+    # BucketRegionCache) and its versioning, encryption and lifecycle are fetched from that
+    # region, on a worker pool. names_only stops after the region.
+    for bucket, bucket_region, details in collect_s3_buckets(s3_client, region_cache, names_only, max_workers, session, item_filter):
+        yield S3Bucket(bucket_region, bucket['Name'], '', bucket.get('CreationDate', 'N/A'), *details)
+
+
+def map_rds_instance(db_instance, region):
+    return RdsInstance(region, db_instance['DBInstanceIdentifier'], db_instance['DBInstanceArn'], db_instance['InstanceCreateTime'],
+                       db_instance['Engine'], db_instance['DBInstanceStatus'])
+
+
+def map_efs_file_system(file_system, region):
+    return EfsFileSystem(region, file_system['Name'], file_system['FileSystemArn'], file_system['CreationTime'],
+                         file_system['PerformanceMode'], file_system['ThroughputMode'], file_system['LifeCycleState'])
+
+
+def fetch_sqs_queues(sqs_client, region, session=None, item_filter=None, names_only=False, max_workers=8):
+    # list_queues only returns URLs, so attributes come from a per-queue call on a worker pool.
+    # item_filter checks those attributes, so names_only still fetches them when filtering.
+    queues = collect_sqs_queues(sqs_client, names_only=names_only and not item_filter, max_workers=max_workers)
+    for queue_url, queue_attributes in queues:
+        if item_filter and not list(item_filter([queue_attributes])):
+            continue
+        queue_name = queue_url.split('/')[-1]
+        if queue_attributes is None or names_only:
+            # Names only mode: skip attribute enrichment entirely
+            yield SqsQueue(region, queue_name)
+            continue
+        yield SqsQueue(region, queue_name, queue_attributes.get('QueueArn', ''), epoch_micros(queue_attributes.get('CreatedTimestamp')),
+                       epoch_micros(queue_attributes.get('LastModifiedTimestamp')),
+                       to_int(queue_attributes.get('MessageRetentionPeriod')),
+                       to_int(queue_attributes.get('VisibilityTimeout')),
+                       to_int(queue_attributes.get('MaximumMessageSize')),
+                       to_int(queue_attributes.get('DelaySeconds')),
+                       queue_attributes.get('RedrivePolicy', ''))
+
+
+def map_ecr_repository(repository, region):
+    return EcrRepository(region, repository.get('repositoryName', ''), repository.get('repositoryArn', ''), repository.get('createdAt', ''))
+
+
+def map_ecs_cluster(cluster, region):
+    # Cluster name from the ARN; ECS clusters do not have a creation time
+    return EcsCluster(region, cluster.split('/')[-1], cluster)
+
+
+register(Collector('ec2', 'EC2 instances', 'ec2', 'describe_instances', 'Reservations[].Instances[]', map_ec2_instance,
+                   details=Ec2Instance.DETAILS,
+                   relations=ec2_instance_relations))
+register(Collector('lambda', 'Lambda functions', 'lambda', 'list_functions', 'Functions', map_lambda_function,
+                   details=LambdaFunction.DETAILS,
+                   relations=lambda_function_relations))
+register(Collector('elbv2', 'ELBs', 'elbv2', 'describe_load_balancers', 'LoadBalancers', map_elb,
+                   details=LoadBalancer.DETAILS, relations=elb_relations))
+register(Collector('vpc', 'VPCs', 'ec2', 'describe_vpcs', 'Vpcs', map_vpc,
+                   relations=lambda vpc, client: [], attributes=vpc_attributes))
+register(Collector('s3', 'S3 buckets', 's3', 'list_buckets', fetch=fetch_s3_buckets, regional=False, details=S3Bucket.DETAILS))
+register(Collector('rds', 'RDS instances', 'rds', 'describe_db_instances', 'DBInstances', map_rds_instance,
+                   details=RdsInstance.DETAILS, relations=rds_instance_relations))
+register(Collector('efs', 'EFS file systems', 'efs', 'describe_file_systems', 'FileSystems', map_efs_file_system,
+                   details=EfsFileSystem.DETAILS))
+register(Collector('sqs', 'SQS queues', 'sqs', 'list_queues', fetch=fetch_sqs_queues, details=SqsQueue.DETAILS))
+register(Collector('ecr', 'ECR repositories', 'ecr', 'describe_repositories', 'repositories', map_ecr_repository))
+register(Collector('ecs', 'ECS clusters', 'ecs', 'list_clusters', 'clusterArns', map_ecs_cluster,
+                   relations=ecs_cluster_relations))
@@ -0,0 +1,122 @@
+import os
+from collections import namedtuple
+
+from botocore.exceptions import ClientError
+
+from accounts import DEFAULT_ROLE_NAME, AccountSessions
+from clients import default_pool
+from instrumentation import default_instrumentation
+from ratelimit import default_rate_limiter
+
+# The slice of work one Lambda invocation does, parsed from its event:
+#   services     - which of the handler's services/sections to cover
+#   regions      - regions to scan; None means every region enabled for the account
+#   accounts     - account IDs to scan through role_name; None means the function's own account
+#   role_name    - role assumed in each of those accounts
+#   min_age_days - how old a resource must be to count (cleanup handlers)
+#   bucket       - S3 bucket the report goes to; defaults to the function's REPORT_BUCKET
+#                  environment variable, then to the handler's own default
+#   prefix       - key prefix for the report, e.g. 'reports/us-east-1/' for one Map item
+#   dry_run      - report what would be changed without changing it
+#   checkpoint   - where a run cut short by the Lambda timeout saves its progress: a key in the
+#                  report bucket or 'file:///path'; None means the handler's default key
+#
+# A full sweep is {} and a Step Functions Map can fan out over items like
+# {"regions": ["eu-west-1"], "prefix": "run-42/eu-west-1/"}.
+InvocationScope = namedtuple('InvocationScope', ['services', 'regions', 'accounts', 'role_name', 'min_age_days',
+                                                 'bucket', 'prefix', 'dry_run', 'checkpoint'])
+
+EVENT_FIELDS = set(InvocationScope._fields)
+
+# Environment variable holding the deployment's report bucket (set by main.tf)
+BUCKET_VARIABLE = 'REPORT_BUCKET'
+
+
+def _string_list(event, key):
+    # Lists may also be given as a comma-separated string
+    value = event.get(key)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{key!r} must be a list of strings")
+    value = [item.strip() for item in value if item.strip()]
+    return value or None
+
+
+def parse_event(event, services, bucket, min_age_days=0):
+    # services lists what the handler can do and bucket/min_age_days are its defaults (the
+    # REPORT_BUCKET environment variable takes precedence over bucket). Unknown
+    # keys are rejected, so a typo can't silently widen a scoped run into a full sweep.
+    event = event or {}
+    if not isinstance(event, dict):
+        raise ValueError('Event must be a JSON object')
+    unknown = set(event) - EVENT_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown event keys: {', '.join(sorted(unknown))}. Allowed: {', '.join(sorted(EVENT_FIELDS))}")
+
+    selected = _string_list(event, 'services') or list(services)
+    unsupported = set(selected) - set(services)
+    if unsupported:
+        raise ValueError(f"Unsupported services: {', '.join(sorted(unsupported))}. Available: {', '.join(services)}")
+
+    age = event.get('min_age_days', min_age_days)
+    if isinstance(age, bool) or not isinstance(age, (int, float)) or age < 0:
+        raise ValueError("'min_age_days' must be a non-negative number")
+
+    dry_run = event.get('dry_run', False)
+    if not isinstance(dry_run, bool):
+        raise ValueError("'dry_run' must be true or false")
+
+    for key in ('bucket', 'prefix', 'role_name', 'checkpoint'):
+        if key in event and not isinstance(event[key], str):
+            raise ValueError(f"{key!r} must be a string")
+
+    return InvocationScope(
+        services=[service for service in services if service in selected],
+        regions=_string_list(event, 'regions'),
+        accounts=_string_list(event, 'accounts'),
+        role_name=event.get('role_name', DEFAULT_ROLE_NAME),
+        min_age_days=age,
+        bucket=event.get('bucket') or os.environ.get(BUCKET_VARIABLE) or bucket,
+        prefix=event.get('prefix', ''),
+        dry_run=dry_run,
+        checkpoint=event.get('checkpoint'),
+    )
+
+
+# AccountSessions per role name, kept across warm invocations so assumed-role credentials are
+# reused until botocore refreshes them
+_account_sessions = {}
+
+
+def scope_sessions(scope):
+    # ([(account_id, session)], {account_id: error}) to run the invocation in: [(None, None)]
+    # for the function's own account when the event names none, otherwise one assumed-role
+    # session per account. Accounts whose role can't be assumed are skipped and returned with
+    # the error, so one of them doesn't fail the others. Every session is instrumented and
+    # rate limited like the default one, its limiter buckets keyed by account.
+    if not scope.accounts:
+        return [(None, None)], {}
+    account_sessions = _account_sessions.get(scope.role_name)
+    if account_sessions is None:
+        account_sessions = _account_sessions[scope.role_name] = AccountSessions(
+            scope.role_name, default_pool().session,
+            hooks=[lambda session, account_id: default_instrumentation().install(session),
+                   lambda session, account_id: default_rate_limiter().install(session, account_id)])
+    sessions, skipped = [], {}
+    for account_id in scope.accounts:
+        try:
+            sessions.append((account_id, account_sessions.session(account_id)))
+        except ClientError as error:
+            print(f"Skipping account {account_id}: {error}")
+            skipped[account_id] = str(error)
+    return sessions, skipped
+
+
+def bad_request(error):
+    return {
+        'statusCode': 400,
+        'body': f'Invalid event: {error}'
+    }
@@ -1,64 +1,180 @@
-import boto3
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Define a list of AWS regions
-aws_regions = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-west-2', 'eu-central-1', 'ap-northeast-1', 'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2', 'ap-south-1', 'sa-east-1']
+from clients import get_client
+from collectors import map_elb
+from records import LoadBalancer
+from paginate import iter_pages
+from regions import list_regions
+from scheduler import Scheduler, Task
+from sinks import open_sink
 
-# Iterate over each region
-for region in aws_regions:
+# describe_tags accepts at most this many ARNs per call
+TAGS_BATCH_SIZE = 20
+
+# What each ELB record holds on top of the inventory's DNS Name/Scheme/Type; 'json' fields are
+# lists or objects (kept as-is in JSON Lines, JSON text in CSV and Parquet)
+DETAILS = {
+    'DNS Name': 'string',
+    'Scheme': 'string',
+    'Type': 'string',
+    'State': 'string',
+    'VPC ID': 'string',
+    'IP Address Type': 'string',
+    'Availability Zones': 'json',
+    'Subnets': 'json',
+    'Security Groups': 'json',
+    'Tags': 'json',
+    'Listeners': 'json',
+    'Target Groups': 'json',
+}
+
+
+class LoadBalancerReport(LoadBalancer):
+    # The inventory's ELB record with every DETAILS field
+    __slots__ = ()
+    DETAILS = DETAILS
+
+
+# Extra lookups that can be left out with --skip
+DETAIL_LOOKUPS = ('tags', 'listeners', 'target-groups', 'health')
+
+# Default output file per format
+DEFAULT_OUTPUTS = {
+    'csv': 'elb_report.csv',
+    'jsonl': 'elb_report.jsonl.gz',
+    'parquet': 'elb_report.parquet',
+}
+
+
+def describe_tags(client, arns):
+    # {arn: {key: value}} for up to TAGS_BATCH_SIZE load balancers in one call
+    response = client.describe_tags(ResourceArns=arns)
+    return {description['ResourceArn']: {tag['Key']: tag['Value'] for tag in description.get('Tags', [])}
+            for description in response['TagDescriptions']}
+
+
+def describe_listeners(client, lb_arn):
+    return [{
+        'Port': listener.get('Port'),
+        'Protocol': listener.get('Protocol'),
+        'Default Actions': [action['Type'] for action in listener.get('DefaultActions', [])],
+    } for page in iter_pages(client, 'describe_listeners', LoadBalancerArn=lb_arn) for listener in page['Listeners']]
+
+
+def target_groups_by_lb(client):
+    # Every target group in the region, listed once and indexed by the load balancers using it,
+    # instead of one describe_target_groups call per load balancer
+    groups = {}
+    for page in iter_pages(client, 'describe_target_groups'):
+        for group in page['TargetGroups']:
+            for lb_arn in group.get('LoadBalancerArns', []):
+                groups.setdefault(lb_arn, []).append(group)
+    return groups
+
+
+def target_health(client, target_group_arn):
+    # {state: count} of the group's registered targets
+    states = {}
+    for description in client.describe_target_health(TargetGroupArn=target_group_arn)['TargetHealthDescriptions']:
+        state = description['TargetHealth']['State']
+        states[state] = states.get(state, 0) + 1
+    return states
+
+
+def describe_region(region, executor, skip=(), session=None):
+    # Yield one record per load balancer in the region, a page of load balancers at a time. The
+    # page's tag batches, listener lookups and target health checks all go to the shared
+    # executor, so they run concurrently within its bound across every region.
     print(f"Fetching load balancers in {region}...")
-    
-    # Initialize the Boto3 client for the Elastic Load Balancing service in the current region
-    elb_client = boto3.client('elbv2', region_name=region)
-    
-    # List all load balancers in the current region
-    response = elb_client.describe_load_balancers()
-    
-    # Extract load balancer information from the response
-    load_balancers = response['LoadBalancers']
-    
-    # Print load balancer information
-    for lb in load_balancers:
-        print("Load Balancer Name:", lb['LoadBalancerName'])
-        
-        # Check if 'DNSName' key exists before accessing it
-        if 'DNSName' in lb:
-            print("DNS Name:", lb['DNSName'])
-        else:
-            print("DNS Name: Not found")  # Print a message if 'DNSName' key is not present
-        
-        print("Load Balancer ARN:", lb['LoadBalancerArn'])
-        print("Load Balancer Type:", lb['Type'])
-        print("VPC ID:", lb['VpcId'])
-        print("Availability Zones:", lb['AvailabilityZones'])
-        
-        # Check if 'SecurityGroups' key exists before accessing it
-        if 'SecurityGroups' in lb:
-            print("Security Groups:", lb['SecurityGroups'])
-        else:
-            print("Security Groups: Not found")  # Print a message if 'SecurityGroups' key is not present
-        
-        # Check if 'Subnets' key exists before accessing it
-        if 'Subnets' in lb:
-            print("Subnets:", lb['Subnets'])
-        else:
-            print("Subnets: Not found")  # Print a message if 'Subnets' key is not present
-        
-        # Check if 'State' key exists before accessing it
-        if 'State' in lb:
-            print("State:", lb['State'])
-        else:
-            print("State: Not found")  # Print a message if 'State' key is not present
-        
-        # Check if 'Scheme' key exists before accessing it
-        if 'Scheme' in lb:
-            print("Scheme:", lb['Scheme'])
-        else:
-            print("Scheme: Not found")  # Print a message if 'Scheme' key is not present
-        
-        # Print the creation time if available
-        if 'CreatedTime' in lb:
-            print("Creation Time:", lb['CreatedTime'])
-        else:
-            print("Creation Time: Not found")  # Print a message if 'CreatedTime' key is not present
-        
-        print("---------------------------------------------")
+    client = get_client('elbv2', region, session)
+    groups = target_groups_by_lb(client) if 'target-groups' not in skip else {}
+    health = {}
+
+    for page in iter_pages(client, 'describe_load_balancers'):
+        load_balancers = page['LoadBalancers']
+        arns = [lb['LoadBalancerArn'] for lb in load_balancers]
+        tag_batches = []
+        if 'tags' not in skip:
+            tag_batches = [executor.submit(describe_tags, client, arns[start:start + TAGS_BATCH_SIZE])
+                           for start in range(0, len(arns), TAGS_BATCH_SIZE)]
+        listeners = {}
+        if 'listeners' not in skip:
+            listeners = {arn: executor.submit(describe_listeners, client, arn) for arn in arns}
+        if 'health' not in skip:
+            # A target group can serve several load balancers; its health is fetched once
+            for arn in arns:
+                for group in groups.get(arn, []):
+                    if group['TargetGroupArn'] not in health:
+                        health[group['TargetGroupArn']] = executor.submit(target_health, client, group['TargetGroupArn'])
+        tags = {arn: value for future in tag_batches for arn, value in future.result().items()}
+
+        for lb in load_balancers:
+            yield elb_record(lb, region, tags, listeners, groups, health, skip)
+
+
+def elb_record(lb, region, tags, listeners, groups, health, skip):
+    # The inventory's ELB row with the rest of what the API says about the load balancer
+    row = map_elb(lb, region)
+    arn = lb['LoadBalancerArn']
+    target_groups = None
+    if 'target-groups' not in skip:
+        target_groups = [{
+            'Name': group['TargetGroupName'],
+            'Protocol': group.get('Protocol'),
+            'Port': group.get('Port'),
+            'Target Type': group.get('TargetType'),
+            'Targets': health[group['TargetGroupArn']].result() if 'health' not in skip else None,
+        } for group in groups.get(arn, [])]
+    return LoadBalancerReport(
+        row.region, row.name, row.arn, row.created, *row.values,
+        lb.get('State', {}).get('Code', 'N/A'),
+        lb.get('VpcId', 'N/A'),
+        lb.get('IpAddressType', 'N/A'),
+        [zone['ZoneName'] for zone in lb.get('AvailabilityZones', [])],
+        [zone['SubnetId'] for zone in lb.get('AvailabilityZones', []) if zone.get('SubnetId')],
+        lb.get('SecurityGroups', []),
+        tags.get(arn, {}) if 'tags' not in skip else None,
+        listeners[arn].result() if 'listeners' not in skip else None,
+        target_groups,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Write one record per Elastic Load Balancer (v2) with its tags, listeners and target groups')
+    parser.add_argument('--regions', default='', help='Comma-separated regions (default: every enabled region)')
+    parser.add_argument('--format', default='csv', choices=sorted(DEFAULT_OUTPUTS), help='Output format')
+    parser.add_argument('--output', default=None, help='File to write (default depends on --format)')
+    parser.add_argument('--workers', type=int, default=8, help='Regions scanned at once')
+    parser.add_argument('--detail-workers', type=int, default=16, help='Tag, listener and target health calls in flight at once')
+    parser.add_argument('--skip', default='', help=f"Comma-separated lookups to leave out: {', '.join(DETAIL_LOOKUPS)}")
+    args = parser.parse_args()
+    args.skip = {item.strip() for item in args.skip.split(',') if item.strip()}
+    unknown = args.skip - set(DETAIL_LOOKUPS)
+    if unknown:
+        parser.error(f"Unknown --skip values: {', '.join(sorted(unknown))}")
+    if 'target-groups' in args.skip:
+        # Health is per target group
+        args.skip.add('health')
+    args.regions = [region.strip() for region in args.regions.split(',') if region.strip()] or list_regions()
+    args.output = args.output or DEFAULT_OUTPUTS[args.format]
+    return args
+
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    scheduler = Scheduler(max_workers=args.workers)
+    with ThreadPoolExecutor(max_workers=args.detail_workers) as executor, \
+            open_sink(args.format, args.output, DETAILS) as sink:
+        tasks = [Task('elbv2', region, lambda region=region: describe_region(region, executor, args.skip))
+                 for region in args.regions]
+        # Records come back in region order, written as each region's pages arrive
+        for _, records in scheduler.run(tasks):
+            sink.write_rows(records)
+    print(f"{sink.rows_written} load balancers written to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,80 +1,132 @@
 import csv
-import boto3
-from io import StringIO
-
-def fetch_data():
-    # Initialize Boto3 clients for S3, EC2, and VPC
-    s3_client = boto3.client('s3')
-    ec2_client = boto3.client('ec2')
-    vpc_client = boto3.client('ec2')
-
-    # Fetching S3 bucket information
-    s3_response = s3_client.list_buckets()
-    s3_buckets = [bucket['Name'] for bucket in s3_response['Buckets']]
-
-    # Fetching EC2 instance information
-    ec2_response = ec2_client.describe_instances()
-    ec2_instances = []
-    for reservation in ec2_response['Reservations']:
-        for instance in reservation['Instances']:
-            ec2_instances.append({
+
+from paginate import paginate
+
+# boto3 and the modules built on it are imported where they are first used rather than here, so
+# loading the handler stays cheap; warm invocations find them already in sys.modules
+
+# Report sections, in the order they are written
+SECTIONS = ('s3', 'ec2', 'vpc')
+
+# Bucket regions never change, so warm invocations reuse the ones already resolved; the
+# BucketRegionCache is created by the first invocation that lists buckets
+bucket_regions = None
+
+def fetch_s3_buckets(session=None):
+    # (name, region) per bucket; regions are looked up concurrently, and only for buckets not
+    # seen before. Pooled clients are only created once a section is actually read.
+    global bucket_regions
+    from clients import get_client
+    from s3_collector import BucketRegionCache, collect_s3_buckets
+
+    if bucket_regions is None:
+        bucket_regions = BucketRegionCache()
+    for bucket, region, _ in collect_s3_buckets(get_client('s3', session=session), bucket_regions, names_only=True, session=session):
+        yield bucket['Name'], region
+
+def fetch_ec2_instances(regions=(None,), session=None):
+    # None stands for the function's own region
+    from clients import get_client
+
+    for region in regions:
+        for instance in paginate(get_client('ec2', region, session), 'describe_instances', 'Reservations[].Instances[]'):
+            yield {
+                'Region': region,
                 'InstanceId': instance['InstanceId'],
                 'InstanceType': instance['InstanceType'],
                 'State': instance['State']['Name']
-            })
-
-    # Fetching VPC information
-    vpc_response = vpc_client.describe_vpcs()
-    vpcs = vpc_response['Vpcs']
-
+            }
+
+def fetch_vpcs(regions=(None,), session=None):
+    # VPCs are an EC2 API too, so this shares the EC2 clients
+    from clients import get_client
+
+    for region in regions:
+        for vpc in paginate(get_client('ec2', region, session), 'describe_vpcs', 'Vpcs'):
+            yield {**vpc, 'Region': region}
+
+def fetch_data(services=SECTIONS, regions=None, session=None):
+    # Lazy generators for the requested sections (None for the rest): each page is fetched only
+    # when save_to_csv reaches it, and skipped sections never build a client
+    regions = regions or [None]
+    s3_buckets = fetch_s3_buckets(session) if 's3' in services else None
+    ec2_instances = fetch_ec2_instances(regions, session) if 'ec2' in services else None
+    vpcs = fetch_vpcs(regions, session) if 'vpc' in services else None
     return s3_buckets, ec2_instances, vpcs
 
-def save_to_csv(s3_buckets, ec2_instances, vpcs):
-    # Prepare CSV data
-    csv_data = StringIO()
-    csv_writer = csv.writer(csv_data)
-    
+def save_to_csv(csv_file, s3_buckets, ec2_instances, vpcs, show_region=False):
+    # Write CSV data to any text file object (local file or S3 report stream); sections passed
+    # as None are left out, and show_region adds a leading Region column to the EC2 and VPC rows
+    csv_writer = csv.writer(csv_file)
+    region_column = ['Region'] if show_region else []
+    started = False
+
     # Write S3 bucket information
-    csv_writer.writerow(['S3 Buckets'])
-    for bucket in s3_buckets:
-        csv_writer.writerow([bucket])
+    if s3_buckets is not None:
+        csv_writer.writerow(['S3 Buckets'])
+        csv_writer.writerow(['Bucket Name', 'Region'])
+        for bucket, region in s3_buckets:
+            csv_writer.writerow([bucket, region])
+        started = True
 
     # Write EC2 instance information
-    csv_writer.writerow([])  # Add an empty row for separation
-    csv_writer.writerow(['EC2 Instances'])
-    csv_writer.writerow(['Instance ID', 'Instance Type', 'State'])
-    for instance in ec2_instances:
-        csv_writer.writerow([instance['InstanceId'], instance['InstanceType'], instance['State']])
+    if ec2_instances is not None:
+        if started:
+            csv_writer.writerow([])  # Add an empty row for separation
+        csv_writer.writerow(['EC2 Instances'])
+        csv_writer.writerow(region_column + ['Instance ID', 'Instance Type', 'State'])
+        for instance in ec2_instances:
+            csv_writer.writerow([instance['Region']] * show_region + [instance['InstanceId'], instance['InstanceType'], instance['State']])
+        started = True
 
     # Write VPC information
-    csv_writer.writerow([])  # Add an empty row for separation
-    csv_writer.writerow(['VPCs'])
-    csv_writer.writerow(['VPC ID', 'CIDR Block', 'State'])
-    for vpc in vpcs:
-        csv_writer.writerow([vpc['VpcId'], vpc['CidrBlock'], vpc['State']])
-
-    # Reset the StringIO buffer position to the beginning
-    csv_data.seek(0)
-
-    return csv_data
+    if vpcs is not None:
+        if started:
+            csv_writer.writerow([])  # Add an empty row for separation
+        csv_writer.writerow(['VPCs'])
+        csv_writer.writerow(region_column + ['VPC ID', 'CIDR Block', 'State'])
+        for vpc in vpcs:
+            csv_writer.writerow([vpc['Region']] * show_region + [vpc['VpcId'], vpc['CidrBlock'], vpc['State']])
 
 def lambda_handler(event, context):
-    # Fetch data
-    s3_buckets, ec2_instances, vpcs = fetch_data()
-
-    # Save data to CSV
-    csv_data = save_to_csv(s3_buckets, ec2_instances, vpcs)
-
-    # Initialize Boto3 client for S3
-    s3_client = boto3.client('s3')
-
-    # Upload the CSV data to S3
-    bucket_name = 'abctesting789'
-    file_key = 'aws_info.csv'  # Desired filename in S3
-    s3_client.put_object(Body=csv_data.getvalue(), Bucket=bucket_name, Key=file_key)
+    from clients import get_client
+    from events import bad_request, parse_event, scope_sessions
+    from instrumentation import default_instrumentation, emit_emf
+    from ratelimit import default_rate_limiter
+    from s3_report import open_report
+
+    # Pace and measure every API call, counting this invocation's only; the hooks stay
+    # installed across warm starts
+    default_rate_limiter()
+    default_instrumentation().reset()
+
+    # The event picks the slice of work: sections (services), regions, accounts and output.
+    # The report only reads, so dry_run and min_age_days don't change anything here.
+    try:
+        scope = parse_event(event, list(SECTIONS), bucket='abctesting789')
+    except ValueError as error:
+        return bad_request(error)
+
+    # Stream the CSV data straight to S3 as a multipart upload
+    file_key = f'{scope.prefix}aws_info.csv'  # Desired filename in S3
+    sessions, skipped_accounts = scope_sessions(scope)
+    with open_report(get_client('s3'), scope.bucket, file_key) as report:
+        for index, (account_id, session) in enumerate(sessions):
+            # Runs over other accounts write one block of sections per account
+            if account_id:
+                if index:
+                    csv.writer(report).writerow([])
+                csv.writer(report).writerow(['Account', account_id])
+            s3_buckets, ec2_instances, vpcs = fetch_data(scope.services, scope.regions, session)
+            save_to_csv(report, s3_buckets, ec2_instances, vpcs, show_region=bool(scope.regions))
+
+    # API call metrics for this invocation as CloudWatch EMF log lines
+    emit_emf(Handler='fetchingsavingreportins3')
 
     return {
         'statusCode': 200,
-        'body': 'CSV file created and saved to S3'
+        'body': 'CSV file created and saved to S3',
+        'bucket': scope.bucket,
+        'key': file_key,
+        'skipped_accounts': skipped_accounts
     }
-
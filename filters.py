@@ -0,0 +1,216 @@
+import json
+import threading
+from datetime import datetime, timezone
+
+import jmespath
+
+# Where each filter field lives for every supported (service, operation):
+#   server - native Filters name the API evaluates for us ('tag' expands to tag:<Key>/tag-key)
+#   client - JMESPath expression for the fallback check on each returned item
+# Fields that appear in neither map don't apply to that resource type: no resource of it can
+# match them, so ResourceFilter.inapplicable() reports them and all.py leaves the type out.
+FIELDS = {
+    ('ec2', 'describe_instances'): {
+        'server': {'states': 'instance-state-name', 'vpc_id': 'vpc-id', 'instance_types': 'instance-type', 'tags': 'tag'},
+        'client': {'created_before': 'LaunchTime'},
+    },
+    ('ec2', 'describe_vpcs'): {
+        'server': {'states': 'state', 'vpc_id': 'vpc-id', 'tags': 'tag'},
+        'client': {},
+    },
+    ('elbv2', 'describe_load_balancers'): {
+        'server': {},
+        'client': {'states': 'State.Code', 'vpc_id': 'VpcId', 'created_before': 'CreatedTime'},
+    },
+    ('rds', 'describe_db_instances'): {
+        'server': {},
+        'client': {'states': 'DBInstanceStatus', 'vpc_id': 'DBSubnetGroup.VpcId', 'instance_types': 'DBInstanceClass',
+                   'tags': 'TagList', 'created_before': 'InstanceCreateTime'},
+    },
+    ('efs', 'describe_file_systems'): {
+        'server': {},
+        'client': {'states': 'LifeCycleState', 'tags': 'Tags', 'created_before': 'CreationTime'},
+    },
+    ('lambda', 'list_functions'): {
+        'server': {},
+        'client': {'vpc_id': 'VpcConfig.VpcId'},
+    },
+    ('ecr', 'describe_repositories'): {
+        'server': {},
+        'client': {'created_before': 'createdAt'},
+    },
+    ('s3', 'list_buckets'): {
+        'server': {},
+        'client': {'created_before': 'CreationDate'},
+    },
+    # list_queues only returns URLs; the checks run on each queue's get_queue_attributes result
+    ('sqs', 'list_queues'): {
+        'server': {},
+        'client': {'created_before': 'CreatedTimestamp'},
+    },
+}
+
+# EC2 instance states worth inventorying or cleaning up; 'terminated' ones are already gone
+LIVE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# Every state a resource of each (service, operation) can be in. State names differ by type
+# (EC2 'running', VPC/RDS/EFS 'available', ELB 'active'), so a states filter is checked against
+# these before it runs rather than quietly matching nothing.
+STATES = {
+    ('ec2', 'describe_instances'): ['pending', 'running', 'shutting-down', 'terminated', 'stopping', 'stopped'],
+    ('ec2', 'describe_vpcs'): ['pending', 'available'],
+    ('elbv2', 'describe_load_balancers'): ['active', 'provisioning', 'active_impaired', 'failed'],
+    ('rds', 'describe_db_instances'): [
+        'available', 'backing-up', 'configuring-enhanced-monitoring', 'configuring-iam-database-auth',
+        'configuring-log-exports', 'converting-to-vpc', 'creating', 'delete-precheck', 'deleting', 'failed',
+        'inaccessible-encryption-credentials', 'inaccessible-encryption-credentials-recoverable', 'incompatible-network',
+        'incompatible-option-group', 'incompatible-parameters', 'incompatible-restore', 'insufficient-capacity',
+        'maintenance', 'modifying', 'moving-to-vpc', 'rebooting', 'resetting-master-credentials', 'renaming',
+        'restore-error', 'starting', 'stopped', 'stopping', 'storage-config-upgrade', 'storage-full',
+        'storage-optimization', 'upgrading',
+    ],
+    ('efs', 'describe_file_systems'): ['creating', 'available', 'updating', 'deleting', 'deleted', 'error'],
+}
+
+
+class ResourceFilter:
+    # Declarative filter for collectors:
+    #   states         - list of allowed state names
+    #   tags           - {key: value} that must all match; a value of None only requires the key
+    #   vpc_id         - VPC the resource must belong to
+    #   instance_types - list of allowed instance types/classes
+    #   created_before - datetime the resource must have been created before
+    def __init__(self, states=None, tags=None, vpc_id=None, instance_types=None, created_before=None):
+        self.states = list(states) if states else None
+        self.tags = dict(tags) if tags else None
+        self.vpc_id = vpc_id
+        self.instance_types = list(instance_types) if instance_types else None
+        self.created_before = created_before
+
+    def active_fields(self):
+        return [name for name in ('states', 'tags', 'vpc_id', 'instance_types', 'created_before')
+                if getattr(self, name) is not None]
+
+    def inapplicable(self, service, operation):
+        # Active fields the resource type behind (service, operation) has nothing to check against
+        fields = FIELDS.get((service, operation), {'server': {}, 'client': {}})
+        return [name for name in self.active_fields() if name not in fields['server'] and name not in fields['client']]
+
+    def invalid_states(self, service, operation):
+        # Requested states no resource of this type can be in
+        valid = STATES.get((service, operation))
+        if not self.states or valid is None:
+            return []
+        return [state for state in self.states if state not in valid]
+
+    def compile(self, service, operation, stats=None):
+        return CompiledFilter(self, service, operation, stats)
+
+
+class FilterStats:
+    # What filtering did over a run, per (service, operation). Items dropped by a native API
+    # filter never reach us and can't be counted, so those show as pushed-down fields. Items
+    # dropped client-side were downloaded in full first; bytes_discarded is their size, the
+    # transfer a native filter would have saved, not a saving.
+    def __init__(self):
+        self.pushed_down = {}
+        self.ignored = {}
+        self.items_seen = 0
+        self.items_dropped = 0
+        self.bytes_discarded = 0
+        self._lock = threading.Lock()
+
+    def record_compile(self, key, pushed_down, ignored):
+        with self._lock:
+            self.pushed_down[key] = pushed_down
+            self.ignored[key] = ignored
+
+    def record_item(self, item, kept):
+        size = 0 if kept else len(json.dumps(item, default=str))
+        with self._lock:
+            self.items_seen += 1
+            if not kept:
+                self.items_dropped += 1
+                self.bytes_discarded += size
+
+    def summary(self):
+        lines = [f"Filtered client-side: {self.items_dropped} of {self.items_seen} items dropped after download ({self.bytes_discarded} bytes)"]
+        for (service, operation), fields in sorted(self.pushed_down.items()):
+            if fields:
+                lines.append(f"Pushed down to {service}.{operation}: {', '.join(fields)}")
+        for (service, operation), fields in sorted(self.ignored.items()):
+            if fields:
+                lines.append(f"Not applicable to {service}.{operation}: {', '.join(fields)}")
+        return '\n'.join(lines)
+
+
+class CompiledFilter:
+    # A ResourceFilter bound to one API call: params holds the native Filters to send and
+    # apply() runs the client-side fallback on whatever comes back
+    def __init__(self, resource_filter, service, operation, stats=None):
+        self.stats = stats
+        fields = FIELDS.get((service, operation), {'server': {}, 'client': {}})
+        self.params = {}
+        self._checks = []
+        native_filters = []
+        pushed_down, ignored = [], []
+
+        for name in resource_filter.active_fields():
+            value = getattr(resource_filter, name)
+            if name in fields['server']:
+                native_filters.extend(self._native(fields['server'][name], value))
+                pushed_down.append(name)
+            elif name in fields['client']:
+                self._checks.append((name, jmespath.compile(fields['client'][name]), value))
+            else:
+                ignored.append(name)
+
+        if native_filters:
+            self.params['Filters'] = native_filters
+        if stats:
+            stats.record_compile((service, operation), pushed_down, ignored)
+
+    def _native(self, filter_name, value):
+        if filter_name == 'tag':
+            return [{'Name': f'tag:{key}', 'Values': [tag_value]} if tag_value is not None
+                    else {'Name': 'tag-key', 'Values': [key]}
+                    for key, tag_value in value.items()]
+        if isinstance(value, (list, tuple)):
+            return [{'Name': filter_name, 'Values': list(value)}]
+        return [{'Name': filter_name, 'Values': [value]}]
+
+    def matches(self, item):
+        for name, expression, expected in self._checks:
+            actual = expression.search(item)
+            if name == 'created_before':
+                if actual is None or _aware(actual) >= _aware(expected):
+                    return False
+            elif name == 'tags':
+                tags = {tag['Key']: tag.get('Value') for tag in actual or []}
+                for key, value in expected.items():
+                    if key not in tags or (value is not None and tags[key] != value):
+                        return False
+            elif isinstance(expected, list):
+                if actual not in expected:
+                    return False
+            elif actual != expected:
+                return False
+        return True
+
+    def apply(self, items):
+        if not self._checks:
+            yield from items
+            return
+        for item in items:
+            kept = self.matches(item)
+            if self.stats:
+                self.stats.record_item(item, kept)
+            if kept:
+                yield item
+
+
+def _aware(value):
+    # Compare naive datetimes as UTC; epoch seconds as strings (SQS attributes) are UTC too
+    if isinstance(value, str):
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
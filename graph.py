@@ -0,0 +1,159 @@
+import argparse
+import json
+import threading
+from collections import namedtuple
+
+# A resource in the graph. Resources the collectors only saw referenced (subnets, security
+# groups, ECS services) are nodes too, with just the type the reference implies.
+Node = namedtuple('Node', ['id', 'type', 'region', 'name', 'account', 'attributes'])
+
+# Relations a resource can have to another: source --relation--> target
+VPC = 'vpc'
+SUBNET = 'subnet'
+SECURITY_GROUP = 'security_group'
+SERVICE = 'service'
+
+# Node type implied by each relation's target
+TARGET_TYPES = {
+    VPC: 'VPC',
+    SUBNET: 'Subnet',
+    SECURITY_GROUP: 'Security Group',
+    SERVICE: 'ECS Service',
+}
+
+# Relations that place the source inside the target's VPC
+NETWORK_RELATIONS = (SUBNET, SECURITY_GROUP)
+
+
+class ResourceGraph:
+    # Relationships between collected resources, indexed both ways so every lookup by ID is a
+    # dict access: _edges[source][relation] and _referrers[target][relation] are sets of IDs.
+    # Collector tasks add to it concurrently; queries are meant for after the run.
+    def __init__(self):
+        self.nodes = {}
+        self._edges = {}
+        self._referrers = {}
+        self._lock = threading.Lock()
+
+    def add_resource(self, node_id, node_type, region, name='', account=None, attributes=None, relations=()):
+        # relations is [(relation, target_id), ...]. A resource in a VPC that also names subnets
+        # or security groups tells us they belong to that VPC as well, so they are linked to it.
+        with self._lock:
+            # Replaces the bare node a reference to this resource may already have created
+            self.nodes[node_id] = Node(node_id, node_type, region, name or node_id, account,
+                                       {'collected': True, **(attributes or {})})
+            vpcs = [target for relation, target in relations if relation == VPC]
+            for relation, target in relations:
+                self._link(node_id, relation, target, region, account)
+                if relation in NETWORK_RELATIONS:
+                    for vpc in vpcs:
+                        self._link(target, VPC, vpc, region, account)
+
+    def _link(self, source, relation, target, region, account):
+        if not target:
+            return
+        if target not in self.nodes:
+            self.nodes[target] = Node(target, TARGET_TYPES[relation], region, target, account, {})
+        self._edges.setdefault(source, {}).setdefault(relation, set()).add(target)
+        self._referrers.setdefault(target, {}).setdefault(relation, set()).add(source)
+
+    def get(self, node_id):
+        return self.nodes.get(node_id)
+
+    def targets(self, node_id, relation):
+        # IDs node_id points to through relation, e.g. targets(elb_arn, 'subnet')
+        return sorted(self._edges.get(node_id, {}).get(relation, ()))
+
+    def referrers(self, node_id, relation=None):
+        # IDs pointing at node_id, through one relation or any
+        referrers = self._referrers.get(node_id, {})
+        if relation is not None:
+            return sorted(referrers.get(relation, ()))
+        return sorted(set().union(*referrers.values())) if referrers else []
+
+    def vpc_of(self, node_id):
+        vpcs = self.targets(node_id, VPC)
+        return vpcs[0] if vpcs else None
+
+    def in_vpc(self, vpc_id):
+        # Every collected resource in the VPC, directly or through one of its subnets or
+        # security groups, as Nodes sorted by type and ID
+        members = set(self.referrers(vpc_id, VPC))
+        for member in list(members):
+            if self.nodes[member].type in (TARGET_TYPES[SUBNET], TARGET_TYPES[SECURITY_GROUP]):
+                members.update(self.referrers(member))
+        return sorted((self.nodes[member] for member in members if self.nodes[member].attributes.get('collected')),
+                      key=lambda node: (node.type, node.id))
+
+    def orphaned_vpcs(self, include_default=False):
+        # Collected VPCs with no collected resource in them; default VPCs are left out unless asked
+        return [node for node in sorted(self.nodes.values(), key=lambda node: (node.region, node.id))
+                if node.type == TARGET_TYPES[VPC] and node.attributes.get('collected')
+                and (include_default or not node.attributes.get('default'))
+                and not self.in_vpc(node.id)]
+
+    def save(self, path):
+        # JSON with one entry per node and per edge; load() rebuilds both indexes
+        with self._lock:
+            data = {
+                'nodes': [node._asdict() for node in self.nodes.values()],
+                'edges': [[source, relation, target] for source, relations in self._edges.items()
+                          for relation, targets in relations.items() for target in sorted(targets)],
+            }
+        with open(path, 'w') as graph_file:
+            json.dump(data, graph_file, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as graph_file:
+            data = json.load(graph_file)
+        graph = cls()
+        graph.nodes = {node['id']: Node(**node) for node in data['nodes']}
+        for source, relation, target in data['edges']:
+            graph._edges.setdefault(source, {}).setdefault(relation, set()).add(target)
+            graph._referrers.setdefault(target, {}).setdefault(relation, set()).add(source)
+        return graph
+
+    def summary(self):
+        counts = {}
+        for node in self.nodes.values():
+            counts[node.type] = counts.get(node.type, 0) + 1
+        edges = sum(len(targets) for relations in self._edges.values() for targets in relations.values())
+        return f"Graph: {len(self.nodes)} resources ({', '.join(f'{count} {name}' for name, count in sorted(counts.items()))}), {edges} relationships"
+
+
+def main():
+    # Query a graph saved by `all.py --graph-output` without calling AWS
+    parser = argparse.ArgumentParser(description='Query a saved resource relationship graph')
+    parser.add_argument('graph', help='Graph file written by all.py --graph-output')
+    parser.add_argument('--vpc', action='append', default=[], help='List everything in this VPC (repeatable)')
+    parser.add_argument('--resource', action='append', default=[], help='Show what this resource ID/ARN is linked to (repeatable)')
+    parser.add_argument('--orphaned-vpcs', action='store_true', help='List VPCs with no resources in them')
+    parser.add_argument('--include-default', action='store_true', help='Count default VPCs as orphaned too')
+    args = parser.parse_args()
+
+    graph = ResourceGraph.load(args.graph)
+    print(graph.summary())
+    for vpc_id in args.vpc:
+        print(f"Resources in {vpc_id}:")
+        for node in graph.in_vpc(vpc_id):
+            print(f"  {node.type}: {node.name} ({node.region})")
+    for resource_id in args.resource:
+        node = graph.get(resource_id)
+        if node is None:
+            print(f"{resource_id}: not in the graph")
+            continue
+        print(f"{node.type} {node.name} ({node.region}):")
+        for relation in TARGET_TYPES:
+            for target in graph.targets(resource_id, relation):
+                print(f"  -> {relation}: {target}")
+        for referrer in graph.referrers(resource_id):
+            print(f"  <- {graph.nodes[referrer].type}: {graph.nodes[referrer].name}")
+    if args.orphaned_vpcs:
+        print('Orphaned VPCs:')
+        for node in graph.orphaned_vpcs(args.include_default):
+            print(f"  {node.id} ({node.region})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+import json
+import threading
+import time
+import uuid
+
+from clients import default_pool
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket catches everything slower
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Error codes AWS APIs use when a call is throttled
+THROTTLING_ERRORS = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'SlowDown',
+    'AWS.SimpleQueueService.RequestThrottled',
+}
+
+# Input members that mark an operation as paginated; each successful call of one is a page
+PAGE_TOKENS = {'NextToken', 'nextToken', 'Marker', 'ContinuationToken', 'StartingToken'}
+
+# Key under which a call's bookkeeping rides along in botocore's request context
+_CONTEXT_KEY = 'instrumentation'
+
+
+class OperationStats:
+    # Aggregates for one (service, operation, region)
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.error_codes = {}
+        self.retries = 0
+        self.throttles = 0
+        self.pages = 0
+        self.response_bytes = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, latency_ms):
+        self.calls += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.histogram[index] += 1
+                return
+        self.histogram[-1] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls, capped at the observed
+        # maximum
+        if not self.calls:
+            return 0.0
+        threshold = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= threshold:
+                return min(float(LATENCY_BUCKETS_MS[index]), self.max_ms) if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'error_codes': dict(self.error_codes),
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'pages': self.pages,
+            'response_bytes': self.response_bytes,
+            'latency_ms': {
+                'total': round(self.total_ms, 3),
+                'mean': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+                'max': round(self.max_ms, 3),
+                'buckets': list(LATENCY_BUCKETS_MS) + ['inf'],
+                'counts': list(self.histogram),
+            },
+        }
+
+
+class Instrumentation:
+    # Per-call API metrics collected through botocore's event hooks, so every client built from
+    # the instrumented session is covered without touching the collectors. Install it before the
+    # first client is created: botocore clients copy the session's handlers when they are built.
+    # With record_spans, every call is also kept as an OpenTelemetry-style span.
+    def __init__(self, record_spans=False):
+        self.record_spans = record_spans
+        self.trace_id = uuid.uuid4().hex
+        self.stats = {}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        # unique_id makes installing twice on the same session a no-op
+        events = session.events
+        events.register('before-call', self._before_call, unique_id='instrumentation-before-call')
+        events.register('after-call', self._after_call, unique_id='instrumentation-after-call')
+        events.register('after-call-error', self._after_call_error, unique_id='instrumentation-after-call-error')
+        events.register('needs-retry', self._needs_retry, unique_id='instrumentation-needs-retry')
+        return self
+
+    def reset(self):
+        # Start a fresh run, e.g. at the top of each warm Lambda invocation
+        with self._lock:
+            self.trace_id = uuid.uuid4().hex
+            self.stats = {}
+            self.spans = []
+
+    def _stats(self, key):
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = OperationStats()
+        return stats
+
+    def _before_call(self, model, context, **kwargs):
+        context[_CONTEXT_KEY] = {
+            'key': (model.service_model.service_name, model.name, context.get('client_region') or 'global'),
+            'paginated': bool(PAGE_TOKENS & set(model.input_shape.members)) if model.input_shape else False,
+            'streaming': model.has_streaming_output,
+            'start': time.perf_counter(),
+            'start_ns': time.time_ns(),
+            'throttles': 0,
+        }
+
+    def _needs_retry(self, request_dict=None, response=None, **kwargs):
+        # Called after every HTTP attempt; only throttled ones are of interest here
+        call = (request_dict or {}).get('context', {}).get(_CONTEXT_KEY)
+        if call is None or response is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLING_ERRORS:
+            call['throttles'] += 1
+            with self._lock:
+                self._stats(call['key']).throttles += 1
+        return None
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        call = context.get(_CONTEXT_KEY)
+        if call is None:
+            return
+        size = http_response.headers.get('content-length')
+        if size is not None:
+            size = int(size)
+        elif not call['streaming']:
+            # Never read a streaming body here; it belongs to the caller
+            size = len(http_response.content or b'')
+        metadata = parsed.get('ResponseMetadata', {})
+        # botocore fires after-call for error responses too (the ClientError is raised later);
+        # those count as errors under their code, and only 2xx responses as pages
+        error = None
+        if parsed.get('Error') or not 200 <= http_response.status_code < 300:
+            error = parsed.get('Error', {}).get('Code') or str(http_response.status_code)
+        self._finish(call, metadata, size or 0, error=error)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        call = context.get(_CONTEXT_KEY)
+        if call is None:
+            return
+        metadata = getattr(exception, 'response', {}).get('ResponseMetadata', {})
+        self._finish(call, metadata, 0, error=type(exception).__name__)
+
+    def _finish(self, call, metadata, size, error):
+        # error is the API error code (or the transport exception's name) of a failed call
+        latency_ms = (time.perf_counter() - call['start']) * 1000
+        retries = metadata.get('RetryAttempts', 0)
+        with self._lock:
+            stats = self._stats(call['key'])
+            stats.record(latency_ms)
+            stats.retries += retries
+            stats.response_bytes += size
+            if error is not None:
+                stats.errors += 1
+                stats.error_codes[error] = stats.error_codes.get(error, 0) + 1
+            elif call['paginated']:
+                stats.pages += 1
+            if self.record_spans:
+                self.spans.append(self._span(call, metadata, retries, error))
+
+    def _span(self, call, metadata, retries, error):
+        service, operation, region = call['key']
+        return {
+            'trace_id': self.trace_id,
+            'span_id': uuid.uuid4().hex[:16],
+            'name': f'{service}.{operation}',
+            'kind': 'CLIENT',
+            'start_time_unix_nano': call['start_ns'],
+            'end_time_unix_nano': time.time_ns(),
+            'status': {'code': 'ERROR', 'message': error} if error is not None else {'code': 'OK'},
+            'attributes': {
+                'rpc.system': 'aws-api',
+                'rpc.service': service,
+                'rpc.method': operation,
+                'cloud.region': region,
+                'aws.request_id': metadata.get('RequestId', ''),
+                'http.status_code': metadata.get('HTTPStatusCode', 0),
+                'aws.retries': retries,
+                'aws.throttles': call['throttles'],
+            },
+        }
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self.stats.items())
+
+    def summary_table(self):
+        # One line per (service, operation, region), slowest total first
+        rows = sorted(self._snapshot(), key=lambda item: item[1].total_ms, reverse=True)
+        lines = [f"{'Service':<10} {'Operation':<28} {'Region':<16} {'Calls':>6} {'Pages':>6} {'Retries':>7} "
+                 f"{'Throttles':>9} {'Errors':>6} {'KB':>9} {'p50 ms':>8} {'p95 ms':>8} {'Max ms':>8} {'Total s':>8}"]
+        for (service, operation, region), stats in rows:
+            lines.append(f"{service:<10} {operation:<28} {region:<16} {stats.calls:>6} {stats.pages:>6} {stats.retries:>7} "
+                         f"{stats.throttles:>9} {stats.errors:>6} {stats.response_bytes / 1024:>9.1f} "
+                         f"{stats.percentile(0.5):>8.0f} {stats.percentile(0.95):>8.0f} {stats.max_ms:>8.0f} {stats.total_ms / 1000:>8.2f}")
+        calls = sum(stats.calls for _, stats in rows)
+        throttles = sum(stats.throttles for _, stats in rows)
+        lines.append(f"{calls} API calls, {throttles} throttled attempts")
+        return '\n'.join(lines)
+
+    def as_json(self):
+        return {
+            'trace_id': self.trace_id,
+            'operations': [dict(service=service, operation=operation, region=region, **stats.as_dict())
+                           for (service, operation, region), stats in self._snapshot()],
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as output:
+            json.dump(self.as_json(), output, indent=2)
+
+    def write_spans(self, path):
+        # One span per line
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, 'w') as output:
+            for span in spans:
+                output.write(json.dumps(span) + '\n')
+
+    def emf_lines(self, namespace, **properties):
+        # CloudWatch Embedded Metric Format records, one per (service, operation, region); printed
+        # from a Lambda they become metrics without any PutMetricData calls
+        timestamp = int(time.time() * 1000)
+        metrics = [
+            {'Name': 'Calls', 'Unit': 'Count'},
+            {'Name': 'Errors', 'Unit': 'Count'},
+            {'Name': 'Retries', 'Unit': 'Count'},
+            {'Name': 'Throttles', 'Unit': 'Count'},
+            {'Name': 'Pages', 'Unit': 'Count'},
+            {'Name': 'ResponseBytes', 'Unit': 'Bytes'},
+            {'Name': 'LatencyP50', 'Unit': 'Milliseconds'},
+            {'Name': 'LatencyP95', 'Unit': 'Milliseconds'},
+            {'Name': 'LatencyMax', 'Unit': 'Milliseconds'},
+        ]
+        lines = []
+        for (service, operation, region), stats in self._snapshot():
+            record = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['Service', 'Operation', 'Region']],
+                        'Metrics': metrics,
+                    }],
+                },
+                'Service': service,
+                'Operation': operation,
+                'Region': region,
+                'Calls': stats.calls,
+                'Errors': stats.errors,
+                'Retries': stats.retries,
+                'Throttles': stats.throttles,
+                'Pages': stats.pages,
+                'ResponseBytes': stats.response_bytes,
+                'LatencyP50': stats.percentile(0.5),
+                'LatencyP95': stats.percentile(0.95),
+                'LatencyMax': round(stats.max_ms, 3),
+                'TraceId': self.trace_id,
+            }
+            record.update(properties)
+            lines.append(json.dumps(record))
+        return lines
+
+
+# Module-level instance bound to the default client pool, shared across warm Lambda invocations
+_default_instrumentation = None
+_default_instrumentation_lock = threading.Lock()
+
+
+def default_instrumentation():
+    global _default_instrumentation
+    with _default_instrumentation_lock:
+        if _default_instrumentation is None:
+            _default_instrumentation = Instrumentation().install(default_pool().session)
+        return _default_instrumentation
+
+
+def emit_emf(namespace='AWSInventory', **properties):
+    # Print the default instrumentation's metrics as EMF lines for CloudWatch Logs
+    for line in default_instrumentation().emf_lines(namespace, **properties):
+        print(line)
@@ -1,88 +1,138 @@
-import boto3
 import csv
-from io import StringIO
-from datetime import datetime
-
-def fetch_ec2_instances():
-    # Initialize Boto3 client for EC2
-    ec2_client = boto3.client('ec2')
-
-    # Fetching EC2 instance information
-    ec2_regions = [region['RegionName'] for region in ec2_client.describe_regions()['Regions']]
-    ec2_instances = []
-
-    # Get current time
-    current_time = datetime.utcnow()
-
-    # Iterate through each region
-    for region in ec2_regions:
-        # Initialize EC2 client for the current region
-        ec2 = boto3.client('ec2', region_name=region)
-
-        # Fetch instances for the region
-        ec2_response = ec2.describe_instances()
-        
-        # Extract instance information
-        for reservation in ec2_response['Reservations']:
-            for instance in reservation['Instances']:
-                launch_time = instance['LaunchTime']
-                launch_datetime = datetime.strptime(launch_time.strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
-                # Calculate the difference in days
-                time_difference = current_time - launch_datetime
-                if time_difference.days >= 2:
-                    ec2_instances.append({
-                        'Region': region,
-                        'InstanceId': instance['InstanceId'],
-                        'InstanceType': instance['InstanceType'],
-                        'State': instance['State']['Name'],
-                        'LaunchTime': launch_datetime
-                    })
-                    print(f"New instance detected in {region} region: {instance['InstanceId']}")
-                    # Terminate the instance
-                    ec2.terminate_instances(InstanceIds=[instance['InstanceId']])
-                    print(f"Instance {instance['InstanceId']} terminated")
-
-    return ec2_instances
-
-def save_to_s3(bucket_name, file_key, csv_data):
-    # Initialize Boto3 client for S3
-    s3_client = boto3.client('s3')
-
-    # Upload the CSV data to S3
-    s3_client.put_object(Body=csv_data.getvalue(), Bucket=bucket_name, Key=file_key)
+from datetime import timedelta
+
+from filters import LIVE_INSTANCE_STATES, FilterStats, ResourceFilter
+from paginate import iter_pages_with_tokens
+
+# boto3 and the modules built on it are imported where they are first used rather than here, so
+# loading the handler stays cheap; warm invocations find them already in sys.modules
+
+def find_old_instance_pages(region, instance_filter, session=None, starting_token=None):
+    from cleanup import Candidate
+    from clients import get_client
+
+    # Get pooled EC2 client for the current region (and account, given its session)
+    ec2 = get_client('ec2', region, session)
+
+    # Only live instances are requested from the API; the launch age check runs on what comes back.
+    # Yields (candidates, next_token) per page so a scan can stop between pages and resume later.
+    for page, next_token in iter_pages_with_tokens(ec2, 'describe_instances', starting_token=starting_token, **instance_filter.params):
+        candidates = []
+        for instance in instance_filter.apply(instance for reservation in page.get('Reservations', []) for instance in reservation['Instances']):
+            print(f"New instance detected in {region} region: {instance['InstanceId']}")
+            candidates.append(Candidate('terminate_instance', region, instance['InstanceId'], instance['InstanceId'], {
+                'InstanceType': instance['InstanceType'],
+                'State': instance['State']['Name'],
+                'LaunchTime': instance['LaunchTime']
+            }))
+        yield candidates, next_token
+
+def find_old_instances(region, instance_filter, session=None):
+    for candidates, _ in find_old_instance_pages(region, instance_filter, session):
+        yield from candidates
+
+def scan_ec2_instances(engine, checkpoint, budget, account_id=None, filter_stats=None, regions=None, min_age_days=2, session=None):
+    # Instances launched at least min_age_days before the run started that aren't already
+    # terminated; the cutoff is fixed at the start so every invocation of a split run agrees
+    from checkpoint import scan
+    from regions import list_regions
+
+    cutoff = checkpoint.started - timedelta(days=min_age_days)
+    instance_filter = ResourceFilter(states=LIVE_INSTANCE_STATES, created_before=cutoff).compile('ec2', 'describe_instances', filter_stats)
+
+    # Scan the given regions (default: every enabled one) concurrently, resuming where the last
+    # invocation stopped; nothing is terminated until the scan is complete. Returns whether it is.
+    return scan(engine, checkpoint, budget, account_id, 'ec2', lambda: regions or list_regions(session),
+                lambda region, token: find_old_instance_pages(region, instance_filter, session, token))
+
+def terminate_instances(engine, ec2_instances):
+    # Terminate in batches per region, regions in parallel
+    results = engine.execute(ec2_instances)
+    for result in results:
+        if result.status == 'done':
+            print(f"Instance {result.resource_id} terminated")
+        elif result.status == 'failed':
+            print(f"Instance {result.resource_id} could not be terminated: {result.message}")
+    return results
 
 def lambda_handler(event, context):
-    # Fetch EC2 instances data
-    ec2_instances = fetch_ec2_instances()
-
-    # Print EC2 instances with regions
-    print("EC2 Instances:")
-    for instance in ec2_instances:
-        print(f"Region: {instance['Region']}, Instance ID: {instance['InstanceId']}, Instance Type: {instance['InstanceType']}, State: {instance['State']}, Launch Time: {instance['LaunchTime']}")
-
-    # Prepare CSV data
-    csv_data = StringIO()
-    csv_writer = csv.writer(csv_data)
-
-    # Write EC2 instance information
-    csv_writer.writerow(['Region', 'Instance ID', 'Instance Type', 'State', 'Launch Time'])
-    for instance in ec2_instances:
-        csv_writer.writerow([instance['Region'], instance['InstanceId'], instance['InstanceType'], instance['State'], instance['LaunchTime']])
-
-    # Reset the StringIO buffer position to the beginning
-    csv_data.seek(0)
-
-    # Get current date and time
-    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-
-    # Define S3 bucket and file key
-    bucket_name = 'script07'
-    file_key = f'ec2_instances_{current_datetime}.csv'
-
-    # Save CSV data to S3
-    save_to_s3(bucket_name, file_key, csv_data)
+    from checkpoint import TimeBudget, act, incomplete, open_checkpoint
+    from cleanup import CleanupEngine
+    from clients import get_client
+    from events import bad_request, parse_event, scope_sessions
+    from instrumentation import default_instrumentation, emit_emf
+    from ratelimit import default_rate_limiter
+    from s3_report import open_report
+
+    # Pace and measure every API call, counting this invocation's only; the hooks stay
+    # installed across warm starts
+    default_rate_limiter()
+    default_instrumentation().reset()
+
+    # The event picks the slice of work: regions, accounts, age threshold, output and dry run
+    try:
+        scope = parse_event(event, ['ec2'], bucket='script07', min_age_days=2)
+    except ValueError as error:
+        return bad_request(error)
+
+    # Progress of this event's run so far; a run that would overrun the Lambda timeout saves it
+    # and returns early, and the next invocation with the same event carries on from there
+    budget = TimeBudget(context)
+    checkpoint = open_checkpoint(scope, 'fetchNdel')
+
+    filter_stats = FilterStats()
+    report_rows = []
+    sessions, skipped_accounts = scope_sessions(scope)
+    for account_id, session in sessions:
+        # Dry run reports what would be terminated without terminating it
+        engine = CleanupEngine(dry_run=scope.dry_run, session=session)
+
+        # Fetch EC2 instances data
+        if not scan_ec2_instances(engine, checkpoint, budget, account_id, filter_stats, scope.regions, scope.min_age_days, session):
+            return incomplete(checkpoint, 'fetchNdel')
+        ec2_instances = checkpoint.candidates(account_id, 'ec2')
+
+        # Print EC2 instances with regions
+        print(f"EC2 Instances in account {account_id}:" if account_id else "EC2 Instances:")
+        for instance in ec2_instances:
+            print(f"Region: {instance.region}, Instance ID: {instance.resource_id}, Instance Type: {instance.details['InstanceType']}, State: {instance.details['State']}, Launch Time: {instance.details['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S')}")
+
+        # Terminate the old instances that an earlier invocation hasn't already dealt with
+        if not act(engine, checkpoint, budget, account_id, 'ec2', terminate_instances):
+            return incomplete(checkpoint, 'fetchNdel')
+        report_rows.extend((account_id, instance, checkpoint.result(account_id, instance)) for instance in ec2_instances)
+    print(filter_stats.summary())
+
+    # The report is named after the time the run started, however many invocations it took
+    current_datetime = checkpoint.started.strftime("%Y-%m-%d_%H-%M-%S")
+
+    # Define S3 file key under the event's prefix
+    file_key = f'{scope.prefix}ec2_instances_{current_datetime}.csv'
+
+    # Stream the CSV straight to S3 as a multipart upload
+    with open_report(get_client('s3'), scope.bucket, file_key) as report:
+        csv_writer = csv.writer(report)
+
+        # Write EC2 instance information along with what happened to each instance; runs over
+        # other accounts get a leading Account column
+        account_column = ['Account'] if scope.accounts else []
+        csv_writer.writerow(account_column + ['Region', 'Instance ID', 'Instance Type', 'State', 'Launch Time', 'Result', 'Message'])
+        for account_id, instance, result in report_rows:
+            csv_writer.writerow([account_id] * bool(scope.accounts) + [instance.region, instance.resource_id, instance.details['InstanceType'], instance.details['State'], instance.details['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S'), result.status, result.message])
+
+    # The run is complete, so there is nothing left to resume
+    checkpoint.delete()
+
+    # API call metrics for this invocation as CloudWatch EMF log lines
+    emit_emf(Handler='fetchNdel')
 
     return {
         'statusCode': 200,
-        'body': 'EC2 instances CSV file created and saved to S3'
+        'body': 'EC2 instances CSV file created and saved to S3',
+        'bucket': scope.bucket,
+        'key': file_key,
+        'instances': len(report_rows),
+        'complete': True,
+        'invocations': checkpoint.state['invocations'],
+        'skipped_accounts': skipped_accounts
     }
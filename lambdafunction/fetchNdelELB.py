@@ -1,87 +1,130 @@
-import boto3
 import csv
-from datetime import datetime, timedelta
-from io import StringIO
-
-def fetch_old_elbs():
-    # Initialize Boto3 client for ELB
-    elb_client = boto3.client('elbv2')
-
-    # Get current time in UTC timezone
-    current_time = datetime.utcnow()
-
-    # Fetch all ELBs
-    response = elb_client.describe_load_balancers()
-    elbs = response['LoadBalancers']
-
-    old_elbs = []
-
-    # Iterate through each ELB
-    for elb in elbs:
-        elb_name = elb['LoadBalancerName']
-        creation_time = elb['CreatedTime'].replace(tzinfo=None)  # Convert to naive datetime
-
-        # Calculate the difference in days
-        age_of_elb = (current_time - creation_time).days
-
-        # If the ELB is older than two weeks (14 days), add it to the list
-        if age_of_elb >= 0:
-            old_elbs.append(elb)
-
-    return old_elbs
-
-def delete_old_elbs(old_elbs):
-    # Initialize Boto3 client for ELB
-    elb_client = boto3.client('elbv2')
-
-    # Delete old ELBs
-    for elb in old_elbs:
-        elb_name = elb['LoadBalancerName']
-        elb_client.delete_load_balancer(LoadBalancerArn=elb['LoadBalancerArn'])
-        print(f"Deleted old ELB: {elb_name}")
-
-def save_to_s3(bucket_name, file_key, csv_data):
-    # Initialize Boto3 client for S3
-    s3_client = boto3.client('s3')
-
-    # Upload the CSV data to S3
-    s3_client.put_object(Body=csv_data.getvalue(), Bucket=bucket_name, Key=file_key)
+from datetime import timedelta
+
+from filters import ResourceFilter
+from paginate import iter_pages_with_tokens
+
+# boto3 and the modules built on it are imported where they are first used rather than here, so
+# loading the handler stays cheap; warm invocations find them already in sys.modules
+
+def find_old_elb_pages(region, elb_filter, session=None, starting_token=None):
+    from cleanup import Candidate
+    from clients import get_client
+
+    # Get pooled Boto3 client for ELB in the current region (and account, given its session)
+    elb_client = get_client('elbv2', region, session)
+
+    # Iterate through every ELB, page by page, keeping the ones created before the cutoff.
+    # Yields (candidates, next_token) per page so a scan can stop between pages and resume later.
+    # Candidates keep only what the report needs, not the whole API entry, since every one of
+    # them stays in memory (and in the checkpoint) until the run is done.
+    for page, next_token in iter_pages_with_tokens(elb_client, 'describe_load_balancers', starting_token=starting_token):
+        yield [Candidate('delete_load_balancer', region, elb['LoadBalancerArn'], elb['LoadBalancerName'], {'CreatedTime': elb['CreatedTime']})
+               for elb in elb_filter.apply(page.get('LoadBalancers', []))], next_token
+
+def find_old_elbs(region, elb_filter, session=None):
+    for candidates, _ in find_old_elb_pages(region, elb_filter, session):
+        yield from candidates
+
+def scan_old_elbs(engine, checkpoint, budget, account_id=None, filter_stats=None, regions=None, min_age_days=0, session=None):
+    # Age threshold in days, counted from the start of the run; 0 means every ELB counts as old
+    from checkpoint import scan
+    from regions import list_regions
+
+    cutoff = checkpoint.started - timedelta(days=min_age_days)
+    elb_filter = ResourceFilter(created_before=cutoff).compile('elbv2', 'describe_load_balancers', filter_stats)
+
+    # Scan the given regions (default: every enabled one) concurrently, resuming where the last
+    # invocation stopped. Returns whether every region has been scanned.
+    return scan(engine, checkpoint, budget, account_id, 'elbv2', lambda: regions or list_regions(session),
+                lambda region, token: find_old_elb_pages(region, elb_filter, session, token))
+
+def delete_old_elbs(engine, old_elbs):
+    # Delete old ELBs, regions in parallel under a per-region rate limit
+    results = engine.execute(old_elbs)
+    for result in results:
+        if result.status == 'done':
+            print(f"Deleted old ELB: {result.name}")
+        elif result.status == 'failed':
+            print(f"Could not delete old ELB {result.name}: {result.message}")
+    return results
 
 def lambda_handler(event, context):
-    # Fetch old ELBs
-    old_elbs = fetch_old_elbs()
-
-    # Print details of old ELBs
-    print("Old Elastic Load Balancers:")
-    for elb in old_elbs:
-        print(elb['LoadBalancerName'])
-
-    # Delete old ELBs
-    delete_old_elbs(old_elbs)
-
-    # Prepare CSV data for S3
-    csv_data = StringIO()
-    csv_writer = csv.writer(csv_data)
-    
-    # Write old ELB details to CSV
-    csv_writer.writerow(['Old ELB Name', 'Creation Time'])
-    for elb in old_elbs:
-        csv_writer.writerow([elb['LoadBalancerName'], elb['CreatedTime'].strftime("%Y-%m-%d %H:%M:%S")])
-
-    # Reset the StringIO buffer position to the beginning
-    csv_data.seek(0)
-
-    # Get current date and time
-    current_datetime = datetime.utcnow().strftime("%Y-%m-%d_%H-%M-%S")
-
-    # Define S3 bucket and file key for CSV
-    bucket_name = 'script07'
-    file_key = f'old_elbs_{current_datetime}.csv'
-
-    # Save CSV data to S3
-    save_to_s3(bucket_name, file_key, csv_data)
+    from checkpoint import TimeBudget, act, incomplete, open_checkpoint
+    from cleanup import CleanupEngine
+    from clients import get_client
+    from events import bad_request, parse_event, scope_sessions
+    from instrumentation import default_instrumentation, emit_emf
+    from ratelimit import default_rate_limiter
+    from s3_report import open_report
+
+    # Pace and measure every API call, counting this invocation's only; the hooks stay
+    # installed across warm starts
+    default_rate_limiter()
+    default_instrumentation().reset()
+
+    # The event picks the slice of work: regions, accounts, age threshold, output and dry run
+    try:
+        scope = parse_event(event, ['elbv2'], bucket='script07', min_age_days=0)
+    except ValueError as error:
+        return bad_request(error)
+
+    # Progress of this event's run so far; a run that would overrun the Lambda timeout saves it
+    # and returns early, and the next invocation with the same event carries on from there
+    budget = TimeBudget(context)
+    checkpoint = open_checkpoint(scope, 'fetchNdelELB')
+
+    report_rows = []
+    sessions, skipped_accounts = scope_sessions(scope)
+    for account_id, session in sessions:
+        # Dry run reports what would be deleted without deleting it
+        engine = CleanupEngine(dry_run=scope.dry_run, session=session)
+
+        # Fetch old ELBs
+        if not scan_old_elbs(engine, checkpoint, budget, account_id, regions=scope.regions, min_age_days=scope.min_age_days, session=session):
+            return incomplete(checkpoint, 'fetchNdelELB')
+        old_elbs = checkpoint.candidates(account_id, 'elbv2')
+
+        # Print details of old ELBs
+        print(f"Old Elastic Load Balancers in account {account_id}:" if account_id else "Old Elastic Load Balancers:")
+        for elb in old_elbs:
+            print(elb.name)
+
+        # Delete the old ELBs that an earlier invocation hasn't already dealt with
+        if not act(engine, checkpoint, budget, account_id, 'elbv2', delete_old_elbs):
+            return incomplete(checkpoint, 'fetchNdelELB')
+        report_rows.extend((account_id, elb, checkpoint.result(account_id, elb)) for elb in old_elbs)
+
+    # The report is named after the time the run started, however many invocations it took
+    current_datetime = checkpoint.started.strftime("%Y-%m-%d_%H-%M-%S")
+
+    # Define S3 file key for CSV under the event's prefix
+    file_key = f'{scope.prefix}old_elbs_{current_datetime}.csv'
+
+    # Stream the CSV straight to S3 as a multipart upload
+    with open_report(get_client('s3'), scope.bucket, file_key) as report:
+        csv_writer = csv.writer(report)
+
+        # Write old ELB details to CSV along with what happened to each ELB; runs over other
+        # accounts get a leading Account column
+        account_column = ['Account'] if scope.accounts else []
+        csv_writer.writerow(account_column + ['Old ELB Name', 'Region', 'Creation Time', 'Result', 'Message'])
+        for account_id, elb, result in report_rows:
+            csv_writer.writerow([account_id] * bool(scope.accounts) + [elb.name, elb.region, elb.details['CreatedTime'].strftime("%Y-%m-%d %H:%M:%S"), result.status, result.message])
+
+    # The run is complete, so there is nothing left to resume
+    checkpoint.delete()
+
+    # API call metrics for this invocation as CloudWatch EMF log lines
+    emit_emf(Handler='fetchNdelELB')
 
     return {
         'statusCode': 200,
-        'body': 'Old ELBs deleted and CSV file saved to S3'
+        'body': 'Old ELBs deleted and CSV file saved to S3',
+        'bucket': scope.bucket,
+        'key': file_key,
+        'load_balancers': len(report_rows),
+        'complete': True,
+        'invocations': checkpoint.state['invocations'],
+        'skipped_accounts': skipped_accounts
     }
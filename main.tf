@@ -47,6 +47,134 @@ resource "aws_lambda_function" "hello_lambda" {
   memory_size = 128
 }
 
+# 5. Shared modules layer. The inventory and cleanup handlers import the modules at the
+# repository root (clients, scheduler, filters, checkpoint, events, ...); Lambda puts a layer's
+# python/ directory on sys.path, so they ship once here for every handler.
+data "archive_file" "shared_modules" {
+  type        = "zip"
+  output_path = "${path.module}/shared_modules.zip"
+
+  dynamic "source" {
+    for_each = fileset(path.module, "*.py")
+    content {
+      content  = file("${path.module}/${source.value}")
+      filename = "python/${source.value}"
+    }
+  }
+}
+
+resource "aws_lambda_layer_version" "shared_modules" {
+  layer_name          = "aws-inventory-shared"
+  filename            = data.archive_file.shared_modules.output_path
+  source_code_hash    = data.archive_file.shared_modules.output_base64sha256
+  compatible_runtimes = ["python3.12"]
+}
+
+# 6. Inventory and cleanup handlers
+variable "report_bucket" {
+  description = "Bucket the handlers write their reports and checkpoints to"
+  type        = string
+}
+
+variable "member_role_name" {
+  description = "Role the handlers assume in the accounts listed in an event's accounts"
+  type        = string
+  default     = "OrganizationAccountAccessRole"
+}
+
+resource "aws_iam_role" "inventory_exec_role" {
+  name               = "inventory_exec_role"
+  assume_role_policy = aws_iam_role.lambda_exec_role.assume_role_policy
+}
+
+resource "aws_iam_role_policy_attachment" "inventory_logs" {
+  role       = aws_iam_role.inventory_exec_role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+}
+
+resource "aws_iam_role_policy" "inventory" {
+  name = "inventory"
+  role = aws_iam_role.inventory_exec_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "ec2:Describe*",
+          "ec2:TerminateInstances",
+          "elasticloadbalancing:Describe*",
+          "elasticloadbalancing:DeleteLoadBalancer",
+          "s3:ListAllMyBuckets",
+          "s3:GetBucketLocation",
+          # head_bucket, the fallback when get_bucket_location is refused
+          "s3:ListBucket",
+        ]
+        Resource = "*"
+      },
+      # Reports and checkpoints; a report that fails part way aborts its multipart upload
+      {
+        Effect   = "Allow"
+        Action   = ["s3:GetObject", "s3:PutObject", "s3:DeleteObject", "s3:AbortMultipartUpload"]
+        Resource = "arn:aws:s3:::${var.report_bucket}/*"
+      },
+      {
+        Effect   = "Allow"
+        Action   = "sts:AssumeRole"
+        Resource = "arn:aws:iam::*:role/${var.member_role_name}"
+      },
+    ]
+  })
+}
+
+data "archive_file" "cleanup_handlers" {
+  type        = "zip"
+  source_dir  = "${path.module}/lambdafunction"
+  output_path = "${path.module}/lambdafunction.zip"
+  excludes    = ["__pycache__", "fetchNdel.explanation"]
+}
+
+locals {
+  # function name => (archive, handler); the report handler lives at the repository root, so
+  # its archive holds just that file
+  handlers = {
+    fetchNdel                = { archive = data.archive_file.cleanup_handlers, handler = "fetchNdel.lambda_handler" }
+    fetchNdelELB             = { archive = data.archive_file.cleanup_handlers, handler = "fetchNdelELB.lambda_handler" }
+    fetchingsavingreportins3 = { archive = data.archive_file.report_handler, handler = "fetchingsavingreportins3.lambda_handler" }
+  }
+}
+
+data "archive_file" "report_handler" {
+  type        = "zip"
+  source_file = "${path.module}/fetchingsavingreportins3.py"
+  output_path = "${path.module}/fetchingsavingreportins3.zip"
+}
+
+resource "aws_lambda_function" "handlers" {
+  for_each = local.handlers
+
+  function_name = each.key
+  role          = aws_iam_role.inventory_exec_role.arn
+  handler       = each.value.handler
+  runtime       = "python3.12"
+  layers        = [aws_lambda_layer_version.shared_modules.arn]
+
+  filename         = each.value.archive.output_path
+  source_code_hash = each.value.archive.output_base64sha256
+
+  # The cleanup handlers checkpoint shortly before the timeout and resume on the next invocation
+  timeout     = 10
+  memory_size = 128
+
+  environment {
+    # Where reports and checkpoints go when the event names no bucket
+    variables = {
+      REPORT_BUCKET = var.report_bucket
+    }
+  }
+}
+
 output "lambda_function_name" {
   value = aws_lambda_function.hello_lambda.function_name
   description = "Name of the Lambda function"
@@ -61,3 +189,8 @@ output "lambda_execution_role_arn" {
   value = aws_iam_role.lambda_exec_role.arn
   description = "IAM Role ARN for Lambda Execution"
 }
+
+output "handler_function_arns" {
+  value       = { for name, function in aws_lambda_function.handlers : name => function.arn }
+  description = "ARNs of the inventory and cleanup handlers"
+}
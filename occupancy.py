@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from clients import get_client
+from paginate import iter_pages
+
+# A (service, region) that came back empty this many scans in a row is dormant: it is only
+# rescanned every 2, 4, 8... runs (at most every MAX_SKIP_RUNS), and in between it gets a
+# batched existence check instead
+EMPTY_AFTER = 3
+MAX_SKIP_RUNS = 16
+# Every scope is scanned regardless once the last full sweep is older than this
+DEFAULT_FULL_SWEEP_INTERVAL = 7 * 24 * 3600
+
+# Resource Groups Tagging API type per collector, for the existence check. Only tagged
+# resources show up there, so the check can miss untagged ones; the backoff scans and the
+# scheduled full sweep catch those.
+TAGGING_TYPES = {
+    'ec2': 'ec2:instance',
+    'lambda': 'lambda:function',
+    'elbv2': 'elasticloadbalancing:loadbalancer',
+    'vpc': 'ec2:vpc',
+    'rds': 'rds:db',
+    'efs': 'elasticfilesystem:file-system',
+    'sqs': 'sqs',
+    'ecr': 'ecr:repository',
+    'ecs': 'ecs:cluster',
+}
+
+
+def tagging_service(resource_arn):
+    # 'arn:aws:ec2:us-east-1:123:instance/i-1' -> 'ec2:instance'; 'arn:aws:sqs:...:q' -> 'sqs'
+    parts = resource_arn.split(':', 5)
+    resource = parts[5] if len(parts) > 5 else ''
+    if '/' in resource or ':' in resource:
+        return f"{parts[2]}:{re.split('[/:]', resource, 1)[0]}"
+    return parts[2]
+
+
+def existence_check(region, services, session=None):
+    # One paginated get_resources call covering every dormant service of a region; returns the
+    # services that have at least one (tagged) resource there. If the check itself fails, every
+    # service counts as found so nothing is skipped on its account.
+    wanted = {TAGGING_TYPES[service]: service for service in services if service in TAGGING_TYPES}
+    if not wanted:
+        return set()
+    client = get_client('resourcegroupstaggingapi', region, session)
+    found = set()
+    try:
+        for page in iter_pages(client, 'get_resources', ResourceTypeFilters=sorted(wanted)):
+            found.update(wanted[kind] for kind in map(tagging_service, (item['ResourceARN'] for item in page['ResourceTagMappingList']))
+                         if kind in wanted)
+            if len(found) == len(wanted):
+                break
+    except ClientError as error:
+        print(f"Existence check failed in {region}, scanning instead: {error}")
+        return set(services)
+    return found
+
+
+class OccupancyMap:
+    # What each (account, service, region) held on recent runs, saved to a JSON file between
+    # runs. plan() decides which scopes to scan this run; record() feeds the results back.
+    def __init__(self, path, full_sweep_interval=DEFAULT_FULL_SWEEP_INTERVAL, empty_after=EMPTY_AFTER,
+                 max_skip_runs=MAX_SKIP_RUNS, full_sweep=False):
+        self.path = path
+        self.empty_after = empty_after
+        self.max_skip_runs = max_skip_runs
+        self.state = {'run': 0, 'last_full_sweep': 0, 'scopes': {}}
+        if os.path.exists(path):
+            with open(path) as occupancy_file:
+                self.state = json.load(occupancy_file)
+        self.state['run'] += 1
+        self.full_sweep = full_sweep or time.time() - self.state['last_full_sweep'] > full_sweep_interval
+        self.skipped = 0
+        self.checked = 0
+        self._lock = threading.Lock()
+
+    def _key(self, account, service, region):
+        return f'{account or "default"}|{service}|{region}'
+
+    def due(self, account, service, region):
+        # Whether the scope gets a real scan this run
+        if self.full_sweep:
+            return True
+        scope = self.state['scopes'].get(self._key(account, service, region))
+        if scope is None or scope['empty_runs'] < self.empty_after:
+            return True
+        interval = min(self.max_skip_runs, 2 ** (scope['empty_runs'] - self.empty_after + 1))
+        return self.state['run'] - scope['last_scanned'] >= interval
+
+    def plan(self, tasks, session_for=lambda account: None, max_workers=16):
+        # The tasks to run: every due scope, plus dormant ones whose region's existence check
+        # found something. Global tasks are always run. session_for(account) gives the session
+        # for a task's account.
+        dormant = {}
+        for task in tasks:
+            if task.region != 'Global' and not self.due(task.account, task.service, task.region):
+                dormant.setdefault((task.account, task.region), []).append(task.service)
+
+        def check(scope):
+            account, region = scope
+            return scope, existence_check(region, dormant[scope], session_for(account))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            woken = {scope: found for scope, found in executor.map(check, dormant)}
+        self.checked = len(dormant)
+
+        planned = []
+        for task in tasks:
+            services = dormant.get((task.account, task.region))
+            if services is not None and task.service in services and task.service not in woken[(task.account, task.region)]:
+                self.skipped += 1
+                continue
+            planned.append(task)
+        return planned
+
+    def record(self, account, service, region, count):
+        with self._lock:
+            scope = self.state['scopes'].setdefault(self._key(account, service, region), {'empty_runs': 0, 'last_scanned': 0})
+            scope['empty_runs'] = 0 if count else scope['empty_runs'] + 1
+            scope['last_scanned'] = self.state['run']
+            if count:
+                scope['last_seen'] = time.time()
+
+    def save(self, complete=True):
+        # A full sweep only counts once every scope was scanned
+        if self.full_sweep and complete:
+            self.state['last_full_sweep'] = time.time()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as occupancy_file:
+            json.dump(self.state, occupancy_file, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def summary(self):
+        if self.full_sweep:
+            return 'Occupancy: full sweep, every service scanned in every region'
+        return f"Occupancy: {self.skipped} empty service/region scans skipped after {self.checked} existence checks"
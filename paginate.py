@@ -0,0 +1,61 @@
+import jmespath
+
+# Largest page each list/describe call accepts. boto3 maps PageSize onto the operation's own
+# limit parameter (MaxResults, MaxRecords, MaxItems, PageSize, maxResults...), so one value per
+# operation is enough to keep the number of round trips as low as the API allows.
+PAGE_SIZES = {
+    ('ec2', 'describe_instances'): 1000,
+    ('ec2', 'describe_vpcs'): 1000,
+    ('lambda', 'list_functions'): 50,
+    ('elbv2', 'describe_load_balancers'): 400,
+    ('rds', 'describe_db_instances'): 100,
+    ('efs', 'describe_file_systems'): 100,
+    ('sqs', 'list_queues'): 1000,
+    ('ecr', 'describe_repositories'): 1000,
+    ('ecs', 'list_clusters'): 100,
+    ('s3', 'list_buckets'): 10000,
+}
+
+
+def page_size_for(client, operation):
+    service = client.meta.service_model.service_name
+    return PAGE_SIZES.get((service, operation))
+
+
+def iter_pages(client, operation, page_size=None, starting_token=None, **kwargs):
+    # Yield raw response pages one at a time; only the current page is held in memory
+    if not client.can_paginate(operation):
+        yield getattr(client, operation)(**kwargs)
+        return
+
+    pagination_config = {}
+    page_size = page_size or page_size_for(client, operation)
+    if page_size:
+        pagination_config['PageSize'] = page_size
+    if starting_token:
+        pagination_config['StartingToken'] = starting_token
+
+    paginator = client.get_paginator(operation)
+    yield from paginator.paginate(PaginationConfig=pagination_config, **kwargs)
+
+
+def paginate(client, operation, expression, page_size=None, starting_token=None, **kwargs):
+    # Yield the items matched by a JMESPath expression (e.g. 'Reservations[].Instances[]')
+    # across every page of the operation, streaming them as each page arrives
+    compiled = jmespath.compile(expression)
+    for page in iter_pages(client, operation, page_size=page_size, starting_token=starting_token, **kwargs):
+        for item in compiled.search(page) or []:
+            yield item
+
+
+# Response keys that carry the token for the next page. For operations with a single token,
+# the raw value works as the paginator's StartingToken. NextMarker comes before Marker because
+# some APIs also echo the request's Marker back.
+NEXT_TOKEN_KEYS = ('NextToken', 'nextToken', 'NextMarker', 'NextContinuationToken', 'Marker')
+
+
+def iter_pages_with_tokens(client, operation, page_size=None, starting_token=None, **kwargs):
+    # Yield (page, next_token) so a caller can stop after any page and later resume with
+    # starting_token=next_token; next_token is None after the last page
+    for page in iter_pages(client, operation, page_size=page_size, starting_token=starting_token, **kwargs):
+        yield page, next((page[key] for key in NEXT_TOKEN_KEYS if page.get(key)), None)
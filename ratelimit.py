@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+
+from clients import configure, default_pool
+from instrumentation import THROTTLING_ERRORS
+
+# Defaults for every (account, service, region) bucket, in calls per second
+DEFAULT_INITIAL_RATE = 20.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 200.0
+# Additive increase: calls/s gained per second of unthrottled traffic
+DEFAULT_INCREASE = 2.0
+# Multiplicative decrease applied on a throttle, at most once per DECREASE_INTERVAL seconds so a
+# burst of in-flight calls throttled together only counts once
+DEFAULT_DECREASE = 0.5
+DECREASE_INTERVAL = 1.0
+
+# Full-jitter backoff for throttled attempts
+BASE_DELAY = 0.2
+MAX_DELAY = 20.0
+
+# Keys under which a call's bucket, and whether its last attempt was already counted as a
+# throttle, ride along in botocore's request context
+_CONTEXT_KEY = 'ratelimit'
+_THROTTLED_KEY = 'ratelimit-throttled'
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    # Wall-clock budget shared by every call of a run; None means no deadline
+    def __init__(self, seconds=None):
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    def check(self, needed=0.0):
+        # Raise if the deadline has passed, or would pass while waiting `needed` seconds
+        remaining = self.remaining()
+        if remaining is not None and remaining < needed:
+            raise DeadlineExceeded('Run deadline exceeded')
+
+
+class TokenBucket:
+    # Token bucket whose refill rate adapts AIMD-style: it creeps up while calls succeed and
+    # halves when the API throttles, settling just under the API's real limit
+    def __init__(self, rate=DEFAULT_INITIAL_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = 1.0
+        self.calls = 0
+        self.throttles = 0
+        self.waited = 0.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Burst capacity of one second's worth of calls
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.calls += 1
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+                self.waited += wait
+            if deadline:
+                deadline.check(wait)
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.tokens = min(self.tokens, 0.0)
+                self._last_decrease = now
+
+
+class RateLimiter:
+    # One adaptive bucket per (account, service, region), applied to every HTTP attempt of every
+    # client built from an installed session. Throttled attempts are retried here with full
+    # jitter backoff; other retryable errors are left to botocore's retry mode. Nothing waits
+    # past the deadline: a call that would raises DeadlineExceeded instead.
+    def __init__(self, deadline=None, max_attempts=10, **bucket_options):
+        self.deadline = deadline or Deadline()
+        self.max_attempts = max_attempts
+        self.bucket_options = bucket_options
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(**self.bucket_options)
+            return bucket
+
+    def install(self, session, account='default'):
+        # Clients copy the session's handlers when they are built, so install before creating any.
+        # The account labels this session's buckets; unique_id keeps a second install a no-op.
+        events = session.events
+        events.register('before-call', lambda model, context, **kwargs: self._before_call(account, model, context),
+                        unique_id='ratelimit-before-call')
+        events.register_first('before-send', self._before_send, unique_id='ratelimit-before-send')
+        events.register_first('needs-retry', self._needs_retry, unique_id='ratelimit-needs-retry')
+        events.register('after-call', self._after_call, unique_id='ratelimit-after-call')
+        return self
+
+    def _before_call(self, account, model, context):
+        self.deadline.check()
+        key = (account, model.service_model.service_name, context.get('client_region') or 'global')
+        context[_CONTEXT_KEY] = self.bucket(key)
+
+    def _before_send(self, request, **kwargs):
+        # Every attempt, retries included, spends a token
+        bucket = request.context.get(_CONTEXT_KEY)
+        if bucket is not None:
+            bucket.acquire(self.deadline)
+
+    def _needs_retry(self, attempts, request_dict, response=None, **kwargs):
+        context = request_dict['context']
+        bucket = context.get(_CONTEXT_KEY)
+        if bucket is None or response is None:
+            return None
+        context[_THROTTLED_KEY] = response[1].get('Error', {}).get('Code') in THROTTLING_ERRORS
+        if not context[_THROTTLED_KEY]:
+            return None
+        bucket.on_throttle()
+        if attempts >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1)))
+        self.deadline.check(delay)
+        return delay
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        # after-call fires for error responses too: only a 2xx without an Error is a success,
+        # and a call that ends throttled is a decrease unless needs-retry already counted it
+        bucket = context.get(_CONTEXT_KEY)
+        if bucket is None:
+            return
+        code = parsed.get('Error', {}).get('Code')
+        if code is None and 200 <= http_response.status_code < 300:
+            bucket.on_success()
+        elif code in THROTTLING_ERRORS and not context.get(_THROTTLED_KEY):
+            bucket.on_throttle()
+
+    def summary(self):
+        # Final rate and throttles per bucket, most throttled first
+        with self._lock:
+            buckets = sorted(self.buckets.items(), key=lambda item: item[1].throttles, reverse=True)
+        lines = [f"{'Account':<14} {'Service':<10} {'Region':<16} {'Calls':>6} {'Throttles':>9} {'Rate/s':>7} {'Waited s':>9}"]
+        for (account, service, region), bucket in buckets:
+            lines.append(f"{account:<14} {service:<10} {region:<16} {bucket.calls:>6} {bucket.throttles:>9} "
+                         f"{bucket.rate:>7.1f} {bucket.waited:>9.2f}")
+        return '\n'.join(lines)
+
+
+# Module-level limiter bound to the default client pool, shared across warm Lambda invocations
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def default_rate_limiter():
+    # Call before the first client is built. The first call switches the default pool (same
+    # session, so hooks already installed stay) to standard retries, as botocore's adaptive mode
+    # would pace every call a second time on top of the limiter.
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            pool = configure(session=default_pool().session, retry_mode='standard')
+            _default_limiter = RateLimiter().install(pool.session)
+        return _default_limiter
@@ -0,0 +1,179 @@
+import sys
+from collections.abc import Mapping
+from datetime import date, datetime, time, timedelta, timezone
+
+from sinks import ACCOUNT_FIELD, DETAILS_FIELD, FIELDNAMES, TIME_FIELD
+
+# Compact report rows. A collector used to build two dicts per resource; a record is one slotted
+# object per resource, with its type (and detail field names) on the class, the region interned,
+# the detail values in a tuple and timestamps as integer microseconds since the epoch. Records
+# are read-only mappings with the report's field names, so sinks, the snapshot store and the
+# graph read them like the old dicts; datetimes and the details dict are only built when a field
+# is read, which the sink does once, as it writes the row (see sinks.plain_row).
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ACCOUNT_FIELDNAMES = [ACCOUNT_FIELD] + FIELDNAMES
+
+
+def to_micros(value):
+    # datetime/date -> microseconds since the epoch (naive times are UTC); placeholders like
+    # 'N/A' and values already converted are returned as they are
+    if isinstance(value, datetime):
+        delta = (value if value.tzinfo else value.replace(tzinfo=timezone.utc)) - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    if isinstance(value, date):
+        return to_micros(datetime.combine(value, time()))
+    return value
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def epoch_micros(seconds):
+    # Epoch seconds as the API returns them, e.g. SQS's '1700000000', straight to microseconds
+    return int(float(seconds or 0) * 1000000)
+
+
+class Record(Mapping):
+    # Subclasses set TYPE, DETAILS (detail field -> kind, as in Collector.details) and, for
+    # resources whose time is only a date, DATE_ONLY. values are the detail values in DETAILS
+    # order; no values at all means the row has no details (e.g. SQS names only mode).
+    __slots__ = ('account', 'region', 'name', 'arn', 'created', 'values')
+    TYPE = ''
+    DETAILS = {}
+    DATE_ONLY = False
+    _timestamps = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._timestamps = tuple(name for name, kind in cls.DETAILS.items() if kind == 'timestamp')
+
+    def __init__(self, region, name, arn='', created='', *values):
+        self.account = None
+        self.region = sys.intern(region)
+        self.name = name
+        self.arn = arn
+        self.created = to_micros(created)
+        if self._timestamps:
+            values = tuple(to_micros(value) if kind == 'timestamp' else value for value, kind in zip(values, self.DETAILS.values()))
+        self.values = values
+
+    @property
+    def created_time(self):
+        if not isinstance(self.created, int):
+            return self.created
+        created = from_micros(self.created)
+        return created.date() if self.DATE_ONLY else created
+
+    @property
+    def details(self):
+        details = dict(zip(self.DETAILS, self.values))
+        for name in self._timestamps:
+            if isinstance(details.get(name), int):
+                details[name] = from_micros(details[name])
+        return details
+
+    def as_dict(self):
+        # The plain row, built in one go; what dict(record) gives, only faster
+        row = {
+            'Resource Type': self.TYPE,
+            'Region': self.region,
+            'Resource Name': self.name,
+            'Resource ARN': self.arn,
+            TIME_FIELD: self.created_time,
+            DETAILS_FIELD: self.details,
+        }
+        if self.account is not None:
+            return {ACCOUNT_FIELD: self.account, **row}
+        return row
+
+    def _fields(self):
+        return ACCOUNT_FIELDNAMES if self.account is not None else FIELDNAMES
+
+    def __getitem__(self, field):
+        getter = FIELD_GETTERS.get(field)
+        if getter is None or (field == ACCOUNT_FIELD and self.account is None):
+            raise KeyError(field)
+        return getter(self)
+
+    def __iter__(self):
+        return iter(self._fields())
+
+    def __len__(self):
+        return len(self._fields())
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+# Report field -> how a record produces it
+FIELD_GETTERS = {
+    ACCOUNT_FIELD: lambda record: record.account,
+    'Resource Type': lambda record: record.TYPE,
+    'Region': lambda record: record.region,
+    'Resource Name': lambda record: record.name,
+    'Resource ARN': lambda record: record.arn,
+    TIME_FIELD: lambda record: record.created_time,
+    DETAILS_FIELD: lambda record: record.details,
+}
+
+
+class Ec2Instance(Record):
+    __slots__ = ()
+    TYPE = 'EC2 Instance'
+    DETAILS = {'Instance Type': 'string', 'State': 'string', 'Private IP': 'string', 'Public IP': 'string'}
+
+
+class LambdaFunction(Record):
+    __slots__ = ()
+    TYPE = 'Lambda Function'
+    DETAILS = {'Runtime': 'string', 'Handler': 'string', 'Memory': 'int64', 'Timeout': 'int64'}
+    # Lambda returns an ISO string; the report only shows the date part
+    DATE_ONLY = True
+
+
+class LoadBalancer(Record):
+    __slots__ = ()
+    TYPE = 'ELB'
+    DETAILS = {'DNS Name': 'string', 'Scheme': 'string', 'Type': 'string'}
+
+
+class Vpc(Record):
+    __slots__ = ()
+    TYPE = 'VPC'
+
+
+class S3Bucket(Record):
+    __slots__ = ()
+    TYPE = 'S3 Bucket'
+    DETAILS = {'Versioning': 'string', 'Encryption': 'string', 'Lifecycle Rules': 'int64'}
+
+
+class RdsInstance(Record):
+    __slots__ = ()
+    TYPE = 'RDS Instance'
+    DETAILS = {'Engine': 'string', 'Status': 'string'}
+
+
+class EfsFileSystem(Record):
+    __slots__ = ()
+    TYPE = 'EFS File System'
+    DETAILS = {'Performance Mode': 'string', 'Throughput Mode': 'string', 'LifeCycle State': 'string'}
+
+
+class SqsQueue(Record):
+    __slots__ = ()
+    TYPE = 'SQS Queue'
+    DETAILS = {'Last Updated': 'timestamp', 'Message Retention Period': 'int64', 'Visibility Timeout': 'int64',
+               'Maximum Message Size': 'int64', 'Delay Seconds': 'int64', 'Redrive Policy': 'string'}
+
+
+class EcrRepository(Record):
+    __slots__ = ()
+    TYPE = 'ECR Repository'
+
+
+class EcsCluster(Record):
+    __slots__ = ()
+    TYPE = 'ECS Cluster'
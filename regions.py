@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import time
+
+from clients import get_client
+
+# How long a saved region catalogue is trusted before describe_regions is called again
+DEFAULT_CATALOGUE_TTL = 24 * 3600
+
+# Regions per session, kept for the life of the process so warm Lambda invocations skip
+# describe_regions; None is the default session
+_regions = {}
+_regions_lock = threading.Lock()
+
+
+def list_regions(session=None, refresh=False):
+    # Regions enabled for the account, as returned by EC2 describe_regions; session selects
+    # another account's credentials
+    with _regions_lock:
+        regions = _regions.get(session)
+    if regions is None or refresh:
+        response = get_client('ec2', session=session).describe_regions()
+        regions = [region['RegionName'] for region in response['Regions']]
+        with _regions_lock:
+            _regions[session] = regions
+    return list(regions)
+
+
+def describe_regions(session=None):
+    # {region: opt-in status} for every region, including ones the account hasn't opted in to
+    response = get_client('ec2', session=session).describe_regions(AllRegions=True)
+    return {region['RegionName']: region.get('OptInStatus', 'opt-in-not-required') for region in response['Regions']}
+
+
+def enabled(statuses):
+    return sorted(region for region, status in statuses.items() if status != 'not-opted-in')
+
+
+class RegionCatalogue:
+    # Region list per account saved to a JSON file, so separate runs skip describe_regions until
+    # the entry is older than ttl. Regions the account hasn't opted in to are kept with their
+    # status but never returned.
+    def __init__(self, path, ttl=DEFAULT_CATALOGUE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path) as catalogue_file:
+                self._entries = json.load(catalogue_file)
+
+    def regions(self, session=None, account='default', refresh=False):
+        with self._lock:
+            entry = self._entries.get(account)
+        if entry is None or refresh or time.time() - entry['fetched'] > self.ttl:
+            entry = {'fetched': time.time(), 'regions': describe_regions(session)}
+            with self._lock:
+                self._entries[account] = entry
+                self._save()
+        return enabled(entry['regions'])
+
+    def _save(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as catalogue_file:
+            json.dump(self._entries, catalogue_file, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
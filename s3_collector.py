@@ -0,0 +1,137 @@
+import fcntl
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from clients import get_client
+from paginate import iter_pages
+
+# get_bucket_location's LocationConstraint for buckets created before regions had names; None
+# (or '') is us-east-1
+LEGACY_LOCATIONS = {'EU': 'eu-west-1'}
+
+# "Not configured" answers of the detail calls, and the value the report shows for them
+NOT_CONFIGURED = {
+    'ServerSideEncryptionConfigurationNotFoundError': 'None',
+    'NoSuchLifecycleConfiguration': 0,
+}
+
+
+class BucketRegionCache:
+    # Bucket name -> region, kept in a JSON file between runs. A bucket never changes region, so
+    # entries don't expire. Should a name be deleted and reused in another region, botocore
+    # follows S3's redirect for the stale entry. Without a path the cache lasts for the process.
+    def __init__(self, path=None):
+        self.path = path
+        self.regions = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as cache_file:
+                self.regions = json.load(cache_file)['buckets']
+
+    def get(self, bucket):
+        with self._lock:
+            region = self.regions.get(bucket)
+            if region is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return region
+
+    def set(self, bucket, region):
+        with self._lock:
+            self.regions[bucket] = region
+
+    def save(self):
+        # Several shard workers can share one cache file: under an exclusive lock on a sidecar
+        # file, merge in whatever the others saved since this process loaded it, then replace
+        if not self.path:
+            return
+        with self._lock, open(f'{self.path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(self.path):
+                with open(self.path) as cache_file:
+                    self.regions = {**json.load(cache_file)['buckets'], **self.regions}
+            temporary = f'{self.path}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as cache_file:
+                json.dump({'buckets': self.regions}, cache_file, indent=1, sort_keys=True)
+            os.replace(temporary, self.path)
+
+
+def resolve_region(s3_client, bucket):
+    # get_bucket_location, or when that is refused, the region head_bucket reports in its
+    # response headers (S3 sends them even with an error). None if neither tells.
+    try:
+        location = s3_client.get_bucket_location(Bucket=bucket).get('LocationConstraint')
+        return LEGACY_LOCATIONS.get(location, location) or 'us-east-1'
+    except ClientError:
+        pass
+    try:
+        return s3_client.head_bucket(Bucket=bucket)['ResponseMetadata']['HTTPHeaders'].get('x-amz-bucket-region')
+    except ClientError as error:
+        return error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-amz-bucket-region')
+
+
+def bucket_detail(call, bucket, default=None):
+    # One detail call; "not configured" comes back as its report value and other refusals
+    # (e.g. AccessDenied on a single bucket) as default, so one bucket can't fail the run
+    try:
+        return call(Bucket=bucket), None
+    except ClientError as error:
+        return None, NOT_CONFIGURED.get(error.response.get('Error', {}).get('Code', ''), default)
+
+
+def describe_bucket(s3_client, bucket):
+    # (versioning, encryption, lifecycle rule count) from a client in the bucket's region
+    versioning, fallback = bucket_detail(s3_client.get_bucket_versioning, bucket, 'N/A')
+    versioning = versioning.get('Status', 'Disabled') if versioning is not None else fallback
+    encryption, fallback = bucket_detail(s3_client.get_bucket_encryption, bucket, 'N/A')
+    if encryption is not None:
+        rules = encryption.get('ServerSideEncryptionConfiguration', {}).get('Rules', [])
+        encryption = rules[0].get('ApplyServerSideEncryptionByDefault', {}).get('SSEAlgorithm', 'None') if rules else 'None'
+    else:
+        encryption = fallback
+    lifecycle, fallback = bucket_detail(s3_client.get_bucket_lifecycle_configuration, bucket)
+    lifecycle = len(lifecycle.get('Rules', [])) if lifecycle is not None else fallback
+    return versioning, encryption, lifecycle
+
+
+def bucket_info(bucket, cache, names_only=False, session=None):
+    # (region, details) of one bucket. The region comes from list_buckets when S3 included it,
+    # then the cache, then a lookup; detail calls go to the pooled client for that region.
+    name = bucket['Name']
+    region = bucket.get('BucketRegion') or cache.get(name)
+    if region is None:
+        region = resolve_region(get_client('s3', session=session), name)
+        if region is None:
+            return 'N/A', ()
+        cache.set(name, region)
+    elif bucket.get('BucketRegion'):
+        cache.set(name, region)
+    if names_only:
+        return region, ()
+    return region, describe_bucket(get_client('s3', region, session), name)
+
+
+def collect_s3_buckets(s3_client, cache=None, names_only=False, max_workers=16, session=None, item_filter=None):
+    # Yield (bucket, region, details) for every bucket, in list_buckets order. Region lookups
+    # and detail calls for each page of buckets run on a bounded worker pool, so at most one
+    # page is in flight. details is () in names_only mode (names and regions only).
+    # item_filter(buckets) drops buckets before anything is looked up for them.
+    cache = cache if cache is not None else BucketRegionCache()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for page in iter_pages(s3_client, 'list_buckets'):
+                buckets = page.get('Buckets', [])
+                if item_filter:
+                    buckets = list(item_filter(buckets))
+                infos = executor.map(lambda bucket: bucket_info(bucket, cache, names_only, session), buckets)
+                for bucket, (region, details) in zip(buckets, infos):
+                    yield bucket, region, details
+    finally:
+        cache.save()
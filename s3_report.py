@@ -0,0 +1,153 @@
+import io
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+def make_compressor(compression):
+    # Returns an object with compress()/flush(), or None for uncompressed output
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        return zlib.compressobj(wbits=31)  # 31 = gzip container
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard package (pip install zstandard)')
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+class MultipartUpload(io.RawIOBase):
+    # Binary file-like object that streams into an S3 multipart upload. Bytes are compressed
+    # on the fly, cut into part_size chunks and uploaded by a small thread pool; at most
+    # max_workers parts are in flight, so peak memory is about part_size * (max_workers + 1)
+    # however large the report is. Small reports that never fill a part go up with a single
+    # put_object instead.
+    def __init__(self, s3_client, bucket, key, part_size=DEFAULT_PART_SIZE, compression=None,
+                 max_workers=4, max_attempts=5, extra_args=None):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.extra_args = dict(extra_args or {})
+        self.upload_id = None
+        self.bytes_uploaded = 0
+        self._compressor = make_compressor(compression)
+        self._buffer = bytearray()
+        self._futures = []
+        self._in_flight = threading.BoundedSemaphore(max_workers)
+        self._executor = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed upload')
+        data = bytes(data)
+        self._buffer += self._compressor.compress(data) if self._compressor else data
+        while len(self._buffer) >= self.part_size:
+            self._submit_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _submit_part(self, body):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self.upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        part_number = len(self._futures) + 1
+        self.bytes_uploaded += len(body)
+        # Block while max_workers parts are already uploading, so buffered parts stay bounded
+        self._in_flight.acquire()
+        future = self._executor.submit(self._upload_part, part_number, body)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, body):
+        for attempt in range(self.max_attempts):
+            try:
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=body)
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            except Exception:
+                if attempt == self.max_attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, min(10.0, 0.5 * 2 ** attempt)))
+
+    def close(self):
+        # Flush the compressor, upload the last part and complete the upload
+        if self.closed:
+            return
+        try:
+            if self._compressor:
+                self._buffer += self._compressor.flush()
+            if self.upload_id is None:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self.extra_args)
+                self.bytes_uploaded = len(self._buffer)
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                parts = [future.result() for future in self._futures]
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            if self._executor:
+                self._executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        # Drop any uploaded parts so a failed report doesn't leave billable fragments behind.
+        # In-flight parts are allowed to finish first, otherwise they could outlive the abort.
+        for future in self._futures:
+            future.cancel()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self._buffer = bytearray()
+        if not self.closed:
+            super().close()
+
+
+@contextmanager
+def open_report(s3_client, bucket, key, encoding='utf-8', **kwargs):
+    # Text stream for csv.writer & co. that lands in s3://bucket/key. The upload completes when
+    # the block exits and is aborted if the block raises.
+    upload = MultipartUpload(s3_client, bucket, key, **kwargs)
+    text = io.TextIOWrapper(io.BufferedWriter(upload, buffer_size=64 * 1024), encoding=encoding, newline='')
+    try:
+        yield text
+        text.flush()
+    except BaseException:
+        upload.abort()
+        try:
+            text.close()
+        except ValueError:
+            # Buffered text had nowhere to go once the upload was aborted
+            pass
+        raise
+    text.close()
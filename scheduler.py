@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Marks the end of a task's row stream
+_DONE = object()
+
+# One unit of collection work: fetch one service in one region ('Global' for global services),
+# optionally in another account
+Task = namedtuple('Task', ['service', 'region', 'func', 'account'], defaults=[None])
+
+# Wall time and row count recorded for every finished task
+TaskTiming = namedtuple('TaskTiming', ['service', 'region', 'seconds', 'rows', 'account'], defaults=[None])
+
+
+class _TaskError:
+    # Carries an exception from a worker thread to the consumer of the task's rows
+    def __init__(self, error):
+        self.error = error
+
+
+class Scheduler:
+    def __init__(self, max_workers=16, service_limits=None, default_service_limit=None, region_limit=None,
+                 lookahead=None):
+        # max_workers bounds the whole run, service_limits maps a service name to its own cap,
+        # default_service_limit applies to services without an entry and region_limit caps
+        # how many tasks may hit the same region of the same account at once. lookahead caps how
+        # many tasks may start beyond the one being yielded (default twice max_workers), which
+        # bounds how many finished-but-not-yet-yielded streams sit in memory.
+        self.max_workers = max_workers
+        self.lookahead = lookahead or 2 * max_workers
+        self.service_limits = dict(service_limits or {})
+        self.default_service_limit = default_service_limit
+        self.region_limit = region_limit
+        self.timings = []
+        self._lock = threading.Lock()
+        self._service_semaphores = {}
+        self._region_semaphores = {}
+
+    def _semaphore(self, semaphores, key, limit):
+        if not limit:
+            return None
+        with self._lock:
+            if key not in semaphores:
+                semaphores[key] = threading.BoundedSemaphore(limit)
+            return semaphores[key]
+
+    def _run_task(self, task, channel):
+        service_semaphore = self._semaphore(
+            self._service_semaphores, task.service,
+            self.service_limits.get(task.service, self.default_service_limit))
+        region_semaphore = self._semaphore(self._region_semaphores, (task.account, task.region), self.region_limit)
+
+        rows = 0
+        # Always take the service slot before the region slot so tasks can't deadlock each other
+        if service_semaphore:
+            service_semaphore.acquire()
+        try:
+            if region_semaphore:
+                region_semaphore.acquire()
+            try:
+                start = time.perf_counter()
+                for row in task.func():
+                    channel.put(row)
+                    rows += 1
+            finally:
+                if region_semaphore:
+                    region_semaphore.release()
+        except BaseException as error:
+            channel.put(_TaskError(error))
+            raise
+        finally:
+            if service_semaphore:
+                service_semaphore.release()
+            channel.put(_DONE)
+
+        with self._lock:
+            self.timings.append(TaskTiming(task.service, task.region, time.perf_counter() - start, rows, task.account))
+
+    def _drain(self, channel):
+        while True:
+            item = channel.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _TaskError):
+                raise item.error
+            yield item
+
+    def run(self, tasks):
+        # Yield (task, rows) in submission order so the output is identical to a serial run no
+        # matter which task finishes first. Rows of the task at the head of the order stream
+        # straight through; later tasks buffer until their turn, and only lookahead of them are
+        # started at a time. Producers never block on the consumer: a worker holding a service
+        # or region slot while waiting for the head to drain could starve the head of that slot.
+        tasks = list(tasks)
+        channels = [queue.SimpleQueue() for _ in tasks]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            try:
+                for index, (task, channel) in enumerate(zip(tasks, channels)):
+                    # The executor starts tasks in submission order, so the head is always running
+                    for ahead in range(len(futures), min(len(tasks), index + 1 + self.lookahead)):
+                        futures.append(executor.submit(self._run_task, tasks[ahead], channels[ahead]))
+                    rows = self._drain(channel)
+                    yield task, rows
+                    # Finish the stream even if the caller didn't consume all of it
+                    for _ in rows:
+                        pass
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def print_summary(self):
+        # Print per-task wall time, slowest first; the account column only shows in multi-account runs
+        accounts = any(timing.account for timing in self.timings)
+        print(f"{'Account':<14} " * accounts + f"{'Service':<10} {'Region':<16} {'Seconds':>9} {'Rows':>7}")
+        for timing in sorted(self.timings, key=lambda t: t.seconds, reverse=True):
+            print(f"{timing.account or '':<14} " * accounts + f"{timing.service:<10} {timing.region:<16} {timing.seconds:>9.2f} {timing.rows:>7}")
+        total = sum(timing.seconds for timing in self.timings)
+        print(f"{len(self.timings)} tasks, {total:.2f}s of API time")
@@ -0,0 +1,439 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+import collectors
+from accounts import DEFAULT_ROLE_NAME, AccountSessions, list_accounts
+from clients import default_pool, get_client
+from regions import list_regions
+from s3_collector import BucketRegionCache
+from sinks import DEFAULT_BATCH_SIZE, DEFAULT_OUTPUTS, open_sink
+from snapshot import decode_row, encode_row
+
+# Sharded inventory: the work is split into (account, region, service) shards on a queue, any
+# number of worker processes (on one machine or many) claim shards and each writes the shard's
+# rows to its own partial file, and a merge writes the partial files into one report in shard
+# order. Rerunning a shard rewrites the same partial file, so retries and duplicate deliveries
+# can't duplicate rows, and the merge of a given set of partial files is always the same report.
+#
+#   python shards.py enqueue --queue shards.db --output-dir parts
+#   python shards.py work --queue shards.db --output-dir parts --processes 8     (on every node)
+#   python shards.py merge --output-dir parts --output aws_resources_info.csv
+#
+# The queue is a SQLite file by default (one machine, or a shared disk), or an SQS queue URL
+# for workers on several machines; --endpoint-url points it at any SQS-compatible service.
+# The output directory must be shared by every worker and the merge.
+
+# One unit of work; seq is the shard's place in the merged report. account is None for the
+# caller's own account and region is 'Global' for global collectors.
+Shard = namedtuple('Shard', ['seq', 'account', 'region', 'service'])
+
+# A claimed shard; receipt is what the queue needs to complete or release it
+Claim = namedtuple('Claim', ['shard', 'receipt', 'attempt'])
+
+DEFAULT_LEASE = 900
+DEFAULT_MAX_ATTEMPTS = 3
+MANIFEST = 'manifest.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    worker TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS shards_state ON shards (state, seq);
+"""
+
+
+def shard_id(shard):
+    return f"{shard.seq:06d}-{shard.account or 'default'}-{shard.region}-{shard.service}"
+
+
+def to_body(shard):
+    return json.dumps(shard._asdict(), sort_keys=True)
+
+
+def from_body(body):
+    return Shard(**json.loads(body))
+
+
+class SqliteQueue:
+    # Shards in a SQLite table. A claim is a lease: a shard whose worker died becomes claimable
+    # again once the lease runs out, and a shard that failed max_attempts times stays 'failed'
+    # until retry() is called.
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def put(self, shards):
+        # Enqueueing the same shards again is a no-op
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany('INSERT OR IGNORE INTO shards (id, seq, body) VALUES (?, ?, ?)',
+                              [(shard_id(shard), shard.seq, to_body(shard)) for shard in shards])
+        self.conn.execute('COMMIT')
+
+    def claim(self, worker, lease=DEFAULT_LEASE):
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Leases that ran out count as failed attempts
+            self.conn.execute("UPDATE shards SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                              "error = 'lease expired' WHERE state = 'running' AND lease_until < ?", (self.max_attempts, now))
+            row = self.conn.execute("SELECT id, body, attempts FROM shards WHERE state = 'pending' ORDER BY seq LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE shards SET state = 'running', attempts = attempts + 1, lease_until = ?, worker = ? WHERE id = ?",
+                              (now + lease, worker, row[0]))
+            return Claim(from_body(row[1]), row[0], row[2] + 1)
+        finally:
+            self.conn.execute('COMMIT')
+
+    def complete(self, claim):
+        self.conn.execute("UPDATE shards SET state = 'done', error = NULL WHERE id = ?", (claim.receipt,))
+
+    def release(self, claim, error):
+        # Put a failed shard back for another attempt, or give up on it
+        self.conn.execute("UPDATE shards SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ? WHERE id = ?",
+                          (self.max_attempts, error, claim.receipt))
+
+    def remaining(self):
+        # Shards that are still pending or being worked on
+        return self.conn.execute("SELECT COUNT(*) FROM shards WHERE state IN ('pending', 'running')").fetchone()[0]
+
+    def failed(self):
+        return [(from_body(body), error) for body, error in
+                self.conn.execute("SELECT body, error FROM shards WHERE state = 'failed' ORDER BY seq")]
+
+    def retry(self, shards):
+        self.conn.executemany("UPDATE shards SET state = 'pending', attempts = 0, error = NULL WHERE id = ?",
+                              [(shard_id(shard),) for shard in shards])
+
+    def status(self):
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM shards GROUP BY state'))
+
+
+class SqsQueue:
+    # Shards as SQS messages. The visibility timeout is the lease; a shard received more than
+    # max_attempts times is recorded as failed in the output directory and dropped.
+    def __init__(self, queue_url, output_dir, max_attempts=DEFAULT_MAX_ATTEMPTS, endpoint_url=None, wait_seconds=5):
+        self.queue_url = queue_url
+        self.output_dir = output_dir
+        self.max_attempts = max_attempts
+        self.wait_seconds = wait_seconds
+        if endpoint_url:
+            pool = default_pool()
+            self.client = pool.session.client('sqs', endpoint_url=endpoint_url, config=pool.config)
+        else:
+            self.client = get_client('sqs')
+
+    def put(self, shards):
+        shards = list(shards)
+        for start in range(0, len(shards), 10):
+            self.client.send_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(shard.seq), 'MessageBody': to_body(shard)} for shard in shards[start:start + 10]])
+
+    def claim(self, worker, lease=DEFAULT_LEASE):
+        while True:
+            messages = self.client.receive_message(
+                QueueUrl=self.queue_url, MaxNumberOfMessages=1, VisibilityTimeout=int(lease),
+                WaitTimeSeconds=self.wait_seconds, AttributeNames=['ApproximateReceiveCount']).get('Messages', [])
+            if not messages:
+                return None
+            message = messages[0]
+            attempt = int(message['Attributes'].get('ApproximateReceiveCount', 1))
+            shard = from_body(message['Body'])
+            if attempt <= self.max_attempts:
+                return Claim(shard, message['ReceiptHandle'], attempt)
+            write_failure(self.output_dir, shard, 'gave up after the lease expired too often')
+            self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+
+    def complete(self, claim):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=claim.receipt)
+
+    def release(self, claim, error):
+        if claim.attempt >= self.max_attempts:
+            write_failure(self.output_dir, claim.shard, error)
+            self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=claim.receipt)
+        else:
+            # Visible again right away for the next worker
+            self.client.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=claim.receipt, VisibilityTimeout=0)
+
+    def remaining(self):
+        attributes = self.client.get_queue_attributes(
+            QueueUrl=self.queue_url, AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'])['Attributes']
+        return int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+
+    def failed(self):
+        return read_failures(self.output_dir)
+
+    def retry(self, shards):
+        for shard in shards:
+            failure = os.path.join(self.output_dir, shard_id(shard) + '.failed')
+            if os.path.exists(failure):
+                os.remove(failure)
+        self.put(shards)
+
+    def status(self):
+        return {'remaining': self.remaining(), 'failed': len(self.failed())}
+
+
+def open_queue(spec, output_dir, max_attempts=DEFAULT_MAX_ATTEMPTS, endpoint_url=None):
+    # An http(s) URL is an SQS queue; anything else is the path of a SQLite queue file
+    if spec.startswith(('https://', 'http://')):
+        return SqsQueue(spec, output_dir, max_attempts, endpoint_url)
+    return SqliteQueue(spec, max_attempts)
+
+
+def part_path(output_dir, shard):
+    return os.path.join(output_dir, shard_id(shard) + '.jsonl.gz')
+
+
+def write_failure(output_dir, shard, error):
+    with open(os.path.join(output_dir, shard_id(shard) + '.failed'), 'w') as failure_file:
+        json.dump({'shard': shard._asdict(), 'error': error}, failure_file)
+
+
+def read_failures(output_dir):
+    failures = []
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith('.failed'):
+            with open(os.path.join(output_dir, name)) as failure_file:
+                failure = json.load(failure_file)
+            failures.append((Shard(**failure['shard']), failure['error']))
+    return failures
+
+
+def plan_shards(collector_list, scopes):
+    # Shards in report order: account by account, then collector by collector, then region by
+    # region, as all.py writes them. scopes is [(account, regions)].
+    shards = []
+    for account, regions in scopes:
+        for collector in collector_list:
+            for region in (regions if collector.regional else ['Global']):
+                shards.append(Shard(len(shards), account, region, collector.name))
+    return shards
+
+
+def write_manifest(output_dir, shards):
+    # The full shard list, so the merge knows what a complete run looks like without asking the
+    # queue. Written to a temporary file and renamed, like the partial files.
+    os.makedirs(output_dir, exist_ok=True)
+    temporary = os.path.join(output_dir, MANIFEST + '.tmp')
+    with open(temporary, 'w') as manifest_file:
+        json.dump({'shards': [shard._asdict() for shard in shards]}, manifest_file, indent=1)
+    os.replace(temporary, os.path.join(output_dir, MANIFEST))
+
+
+def read_manifest(output_dir):
+    with open(os.path.join(output_dir, MANIFEST)) as manifest_file:
+        return [Shard(**shard) for shard in json.load(manifest_file)['shards']]
+
+
+def run_shard(shard, output_dir, sessions, options):
+    # Collect one shard into its partial file. The rows go to a temporary file that is renamed
+    # into place only once the shard is complete, so a partial file is always a whole shard and
+    # a rerun simply replaces it.
+    collector = collectors.REGISTRY[shard.service]
+    session = sessions.session(shard.account) if shard.account else None
+    rows = collector.collect(shard.region, session=session, **options.get(shard.service, {}))
+    if shard.account:
+        rows = collectors.with_account(rows, shard.account)
+    path = part_path(output_dir, shard)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    count = 0
+    with gzip.open(temporary, 'wt', encoding='utf-8') as part_file:
+        for row in rows:
+            part_file.write(encode_row(row) + '\n')
+            count += 1
+    os.replace(temporary, path)
+    return count
+
+
+def work(queue_spec, output_dir, role_name=None, lease=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS,
+         endpoint_url=None, options=None, poll=5):
+    # Worker loop: claim, run and complete shards until none are left. A shard that raises is
+    # released for another attempt. When nothing is claimable but other workers still hold
+    # shards, wait: their leases may run out and the shards come back.
+    queue = open_queue(queue_spec, output_dir, max_attempts, endpoint_url)
+    options = dict(options or {})
+    if 's3' in options:
+        # The cache comes in as its path, since options are handed to worker processes
+        options['s3'] = {**options['s3'], 'region_cache': BucketRegionCache(options['s3'].get('region_cache'))}
+    sessions = AccountSessions(role_name or DEFAULT_ROLE_NAME, default_pool().session)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    done = 0
+    while True:
+        claim = queue.claim(worker, lease)
+        if claim is None:
+            if not queue.remaining():
+                return done
+            time.sleep(poll)
+            continue
+        try:
+            rows = run_shard(claim.shard, output_dir, sessions, options)
+        except Exception as error:
+            print(f"[{worker}] shard {shard_id(claim.shard)} failed (attempt {claim.attempt}): {error}", file=sys.stderr)
+            queue.release(claim, f'{type(error).__name__}: {error}')
+            continue
+        queue.complete(claim)
+        done += 1
+        print(f"[{worker}] shard {shard_id(claim.shard)}: {rows} rows")
+
+
+def merge(output_dir, output_format, output_path, allow_partial=False, batch_size=DEFAULT_BATCH_SIZE):
+    # Write every shard's partial file into one report, in shard order. The result depends only
+    # on the partial files, so merging again gives the same report. Missing shards are an error
+    # unless allow_partial is set. Returns the shards that were missing.
+    shards = read_manifest(output_dir)
+    missing = [shard for shard in shards if not os.path.exists(part_path(output_dir, shard))]
+    if missing and not allow_partial:
+        raise RuntimeError(f"{len(missing)} of {len(shards)} shards have no output yet, e.g. {shard_id(missing[0])}")
+    skipped = set(missing)
+    names = {shard.service for shard in shards}
+    details = collectors.details_schema([collector for collector in collectors.REGISTRY.values() if collector.name in names])
+    accounts = any(shard.account for shard in shards)
+    with open_sink(output_format, output_path, details, batch_size, accounts=accounts) as sink:
+        for shard in shards:
+            if shard in skipped:
+                continue
+            with gzip.open(part_path(output_dir, shard), 'rt', encoding='utf-8') as part_file:
+                sink.write_rows(decode_row(line) for line in part_file)
+    return missing
+
+
+def work_processes(processes, *args, **kwargs):
+    # Run the worker loop in this many processes; each has its own queue connection and clients
+    if processes <= 1:
+        return work(*args, **kwargs)
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=work, args=args, kwargs=kwargs) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [worker for worker in workers if worker.exitcode]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {processes} worker processes exited with an error")
+
+
+def enqueue(args):
+    # Plan the shards for the caller's account (or every account in --accounts), write the
+    # manifest and put the shards on the queue
+    if args.accounts:
+        account_sessions = AccountSessions(args.role_name, default_pool().session)
+        scopes = [(account.id, regions) for account, _, regions in account_sessions.resolve(
+            list_accounts(args.accounts), lambda account, session: args.regions or list_regions(session))]
+    else:
+        scopes = [(None, args.regions or list_regions())]
+    shards = plan_shards(args.collectors, scopes)
+    write_manifest(args.output_dir, shards)
+    open_queue(args.queue, args.output_dir, args.max_attempts, args.endpoint_url).put(shards)
+    print(f"Enqueued {len(shards)} shards")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sharded inventory: enqueue (account, region, service) shards, work them from any number of processes, merge the results')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def queue_options(command):
+        command.add_argument('--queue', default='shards.db', help='SQLite queue file, or an SQS queue URL')
+        command.add_argument('--output-dir', default='shards', help='Directory of partial files shared by every worker and the merge')
+        command.add_argument('--endpoint-url', default=None, help='SQS-compatible endpoint for an SQS --queue')
+        command.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Attempts per shard before it is marked failed')
+
+    def enqueue_options(command):
+        command.add_argument('--services', default='', help=f"Comma-separated collectors to run (default: all of {', '.join(collectors.REGISTRY)})")
+        command.add_argument('--regions', default='', help='Comma-separated regions (default: every enabled region)')
+        command.add_argument('--accounts', default=None, help="Inventory other accounts: 'organizations' or a file of account IDs (id[,name] per line)")
+
+    def work_options(command):
+        command.add_argument('--processes', type=int, default=1, help='Worker processes on this machine')
+        command.add_argument('--lease', type=float, default=DEFAULT_LEASE, help='Seconds a claimed shard stays with its worker before it is handed out again')
+        command.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in each account')
+        command.add_argument('--sqs-names-only', action='store_true', help='List SQS queue names without fetching their attributes')
+        command.add_argument('--sqs-workers', type=int, default=8, help='Concurrent get_queue_attributes calls per region')
+        command.add_argument('--s3-names-only', action='store_true', help='List S3 bucket names and regions without their versioning, encryption and lifecycle')
+        command.add_argument('--s3-workers', type=int, default=16, help='Concurrent S3 bucket region and detail lookups')
+        command.add_argument('--s3-region-cache', default=None, help='JSON file caching each S3 bucket\'s region between runs')
+
+    def merge_options(command):
+        command.add_argument('--format', default='csv', choices=sorted(DEFAULT_OUTPUTS), help='Output format')
+        command.add_argument('--output', default=None, help='File to write (default depends on --format)')
+        command.add_argument('--allow-partial', action='store_true', help='Merge whatever shards have finished instead of failing on missing ones')
+
+    enqueue_command = commands.add_parser('enqueue', help='Plan the shards and put them on the queue')
+    queue_options(enqueue_command)
+    enqueue_options(enqueue_command)
+    enqueue_command.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in each account')
+    work_command = commands.add_parser('work', help='Claim and run shards until the queue is empty')
+    queue_options(work_command)
+    work_options(work_command)
+    merge_command = commands.add_parser('merge', help='Write the finished shards into one report')
+    merge_command.add_argument('--output-dir', default='shards', help='Directory of partial files')
+    merge_options(merge_command)
+    status_command = commands.add_parser('status', help='Count shards by state')
+    queue_options(status_command)
+    retry_command = commands.add_parser('retry', help='Put failed shards back on the queue')
+    queue_options(retry_command)
+    run_command = commands.add_parser('run', help='enqueue, work and merge on this machine')
+    queue_options(run_command)
+    enqueue_options(run_command)
+    work_options(run_command)
+    merge_options(run_command)
+
+    args = parser.parse_args()
+    if hasattr(args, 'services'):
+        try:
+            args.collectors = collectors.select([name.strip() for name in args.services.split(',') if name.strip()])
+        except ValueError as error:
+            parser.error(str(error))
+        args.regions = [region.strip() for region in args.regions.split(',') if region.strip()]
+    if hasattr(args, 'format'):
+        args.output = args.output or DEFAULT_OUTPUTS[args.format]
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command in ('enqueue', 'run'):
+        enqueue(args)
+    if args.command in ('work', 'run'):
+        options = {
+            'sqs': {'names_only': args.sqs_names_only, 'max_workers': args.sqs_workers},
+            's3': {'names_only': args.s3_names_only, 'max_workers': args.s3_workers, 'region_cache': args.s3_region_cache},
+        }
+        work_processes(args.processes, args.queue, args.output_dir, args.role_name, args.lease, args.max_attempts,
+                       args.endpoint_url, options)
+    if args.command in ('status', 'retry'):
+        queue = open_queue(args.queue, args.output_dir, args.max_attempts, args.endpoint_url)
+        failed = queue.failed()
+        if args.command == 'retry':
+            queue.retry([shard for shard, _ in failed])
+            print(f"Requeued {len(failed)} failed shards")
+        else:
+            print(', '.join(f'{state}: {count}' for state, count in sorted(queue.status().items())))
+            for shard, error in failed:
+                print(f"  failed {shard_id(shard)}: {error}")
+    if args.command in ('merge', 'run'):
+        try:
+            missing = merge(args.output_dir, args.format, args.output, args.allow_partial)
+        except RuntimeError as error:
+            sys.exit(f"Merge failed: {error}. Run 'status' and 'retry', or merge with --allow-partial")
+        print(f"Merged into {args.output}" + (f", {len(missing)} shards missing" if missing else ''))
+
+
+if __name__ == '__main__':
+    main()
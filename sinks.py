@@ -0,0 +1,240 @@
+import csv
+import gzip
+import json
+from datetime import date, datetime, time, timezone
+
+# pyarrow is optional and takes ~100 ms to import, so it is only loaded once a Parquet sink is
+# opened; see load_pyarrow()
+pyarrow = None
+
+# Columns of the inventory report
+FIELDNAMES = ['Resource Type', 'Region', 'Resource Name', 'Resource ARN', 'Creation/Last Modified Time', 'Other Information']
+TIME_FIELD = 'Creation/Last Modified Time'
+DETAILS_FIELD = 'Other Information'
+# Leading column added in multi-account runs
+ACCOUNT_FIELD = 'Account'
+
+# Units appended to detail values when they are rendered as text
+UNITS = {
+    'Message Retention Period': ' seconds',
+    'Visibility Timeout': ' seconds',
+    'Maximum Message Size': ' bytes',
+    'Delay Seconds': ' seconds',
+}
+
+# Rows buffered by a sink before they are written out
+DEFAULT_BATCH_SIZE = 5000
+
+# Default output file per format
+DEFAULT_OUTPUTS = {
+    'csv': 'aws_resources_info.csv',
+    'jsonl': 'aws_resources_info.jsonl.gz',
+    'parquet': 'aws_resources_info.parquet',
+}
+
+
+def load_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet output requires pyarrow (pip install pyarrow)') from None
+    return pyarrow
+
+
+def plain_row(row):
+    # A row as a dict the sink can change; records (see records.py) build theirs in one step
+    as_dict = getattr(row, 'as_dict', None)
+    return as_dict() if as_dict else dict(row)
+
+
+def render_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=json_default, sort_keys=True)
+    return str(value)
+
+
+def render_details(details):
+    # {'Engine': 'mysql', 'Status': 'available'} -> 'Engine: mysql, Status: available'
+    if not details:
+        return ''
+    if isinstance(details, str):
+        return details
+    return ', '.join(f"{key}: {render_value(value)}{UNITS.get(key, '')}" for key, value in details.items())
+
+
+def to_timestamp(value):
+    # Timestamps as aware UTC datetimes; placeholders like 'N/A' become null
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime.combine(value, time(), tzinfo=timezone.utc)
+    return None
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class Sink:
+    # Buffers up to batch_size rows and hands them to _write_batch, so memory stays constant
+    # however many rows are streamed through
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._buffer = []
+
+    def write(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write_batch(self, rows):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class CsvSink(Sink):
+    # The original report: timestamps and 'Other Information' rendered as text
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, fileobj=None, accounts=False):
+        super().__init__(path, batch_size)
+        self._owns_file = fileobj is None
+        self._file = fileobj or open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=[ACCOUNT_FIELD] + FIELDNAMES if accounts else FIELDNAMES)
+        self._writer.writeheader()
+
+    def _write_batch(self, rows):
+        self._writer.writerows(map(self._render, rows))
+
+    @staticmethod
+    def _render(row):
+        row = plain_row(row)
+        row[TIME_FIELD] = render_value(row[TIME_FIELD])
+        row[DETAILS_FIELD] = render_details(row[DETAILS_FIELD])
+        return row
+
+    def _close(self):
+        if self._owns_file:
+            self._file.close()
+
+
+class JsonLinesSink(Sink):
+    # One JSON object per row, gzip'd when the path ends in .gz. Timestamps are ISO 8601 (null
+    # when unknown) and 'Other Information' stays a typed object.
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        if path.endswith('.gz'):
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+
+    def _write_batch(self, rows):
+        self._file.write(''.join(json.dumps(self._render(row), default=json_default) + '\n' for row in rows))
+
+    @staticmethod
+    def _render(row):
+        row = plain_row(row)
+        row[TIME_FIELD] = to_timestamp(row[TIME_FIELD])
+        return row
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetSink(Sink):
+    # Columnar output with a real timestamp column and 'Other Information' as a struct whose
+    # fields come from the collectors' details declarations. Each batch becomes one row group.
+    ARROW_TYPES = {
+        'string': lambda: pyarrow.string(),
+        'int64': lambda: pyarrow.int64(),
+        'timestamp': lambda: pyarrow.timestamp('us', tz='UTC'),
+        'json': lambda: pyarrow.string(),
+    }
+
+    def __init__(self, path, details=None, batch_size=DEFAULT_BATCH_SIZE, accounts=False):
+        load_pyarrow()
+        super().__init__(path, batch_size)
+        self.details = dict(details or {})
+        self._text_fields = ([ACCOUNT_FIELD] if accounts else []) + FIELDNAMES[:4]
+        columns = [(name, pyarrow.string()) for name in self._text_fields]
+        columns.append((TIME_FIELD, pyarrow.timestamp('us', tz='UTC')))
+        # Parquet can't store a struct without fields, so the column is dropped when no
+        # collector declared any details
+        if self.details:
+            columns.append((DETAILS_FIELD, pyarrow.struct(
+                [(name, self.ARROW_TYPES[kind]()) for name, kind in self.details.items()])))
+        self.schema = pyarrow.schema(columns)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def _typed_details(self, details):
+        typed = {}
+        for name, kind in self.details.items():
+            value = details.get(name) if isinstance(details, dict) else None
+            if kind == 'timestamp':
+                value = to_timestamp(value)
+            elif kind == 'int64':
+                value = value if isinstance(value, int) else None
+            elif kind == 'json':
+                value = json.dumps(value, default=json_default, sort_keys=True) if value is not None else None
+            elif value is not None:
+                value = str(value)
+            typed[name] = value
+        return typed
+
+    def _write_batch(self, rows):
+        records = []
+        for row in map(plain_row, rows):
+            record = {name: row[name] for name in self._text_fields}
+            record[TIME_FIELD] = to_timestamp(row[TIME_FIELD])
+            if self.details:
+                record[DETAILS_FIELD] = self._typed_details(row[DETAILS_FIELD])
+            records.append(record)
+        self._writer.write_table(pyarrow.Table.from_pylist(records, schema=self.schema))
+
+    def _close(self):
+        self._writer.close()
+
+
+def open_sink(output_format, path, details=None, batch_size=DEFAULT_BATCH_SIZE, accounts=False):
+    # accounts adds the leading Account column of multi-account runs; JSON Lines rows simply
+    # carry it as another key
+    if output_format == 'csv':
+        return CsvSink(path, batch_size, accounts=accounts)
+    if output_format == 'jsonl':
+        return JsonLinesSink(path, batch_size)
+    if output_format == 'parquet':
+        return ParquetSink(path, details, batch_size, accounts=accounts)
+    raise ValueError(f"Unknown output format {output_format!r}")
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import Counter
+from collections.abc import Mapping
+from datetime import date, datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    service TEXT NOT NULL,
+    region TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    run_id INTEGER NOT NULL,
+    PRIMARY KEY (service, region, resource_id)
+);
+CREATE TABLE IF NOT EXISTS scans (
+    service TEXT NOT NULL,
+    region TEXT NOT NULL,
+    scanned_at REAL NOT NULL,
+    PRIMARY KEY (service, region)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    run_id INTEGER NOT NULL,
+    at REAL NOT NULL,
+    change TEXT NOT NULL,
+    service TEXT NOT NULL,
+    region TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    row TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_run ON history (run_id);
+"""
+
+
+def resource_id(row):
+    # ARN when the collector has one, otherwise the name/ID (instance ID, VPC ID, bucket name...)
+    return row.get('Resource ARN') or row['Resource Name']
+
+
+def encode_value(value):
+    # Tag timestamps so cached rows come back with the same types the collectors produced;
+    # records (see records.py) are stored as the plain rows they stand for
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    return str(value)
+
+
+def decode_value(value):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__date__' in value:
+        return date.fromisoformat(value['__date__'])
+    return value
+
+
+def encode_row(row):
+    return json.dumps(row, default=encode_value)
+
+
+def decode_row(encoded):
+    return json.loads(encoded, object_hook=decode_value)
+
+
+def row_digest(row):
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=encode_value).encode('utf-8')).hexdigest()
+
+
+class SnapshotStore:
+    # Local SQLite copy of the last inventory, one scope per (service, region). A rescanned scope
+    # is diffed against the stored one; scopes that are still fresh are served from the cache.
+    def __init__(self, path='aws_inventory.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.run_id = self.conn.execute('INSERT INTO runs (started_at) VALUES (?)', (time.time(),)).lastrowid
+        self.conn.commit()
+        self.counts = Counter()
+
+    def close(self):
+        self.conn.close()
+
+    def last_scanned(self, service, region):
+        row = self.conn.execute('SELECT scanned_at FROM scans WHERE service = ? AND region = ?', (service, region)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, service, region, ttl=None):
+        # A ttl of None means a cached scope never expires on its own
+        scanned_at = self.last_scanned(service, region)
+        if scanned_at is None:
+            return False
+        return ttl is None or time.time() - scanned_at < ttl
+
+    def cached_rows(self, service, region):
+        # Rows of a scope as of its last scan, in the order they were collected. Uses its own
+        # connection so scheduler worker threads can read while the main thread writes.
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(
+                'SELECT row FROM resources WHERE service = ? AND region = ? ORDER BY position',
+                (service, region))
+            for (row,) in cursor:
+                yield decode_row(row)
+        finally:
+            conn.close()
+
+    def track(self, service, region, rows):
+        # Pass rows through unchanged while upserting them, then drop whatever the scope held
+        # that this scan didn't see. Everything is committed together once the scan completes,
+        # so a failed scan leaves the previous snapshot intact.
+        now = time.time()
+        conn = self.conn
+        counts = Counter()
+        try:
+            for position, row in enumerate(rows):
+                key = (service, region, resource_id(row))
+                digest = row_digest(row)
+                encoded = encode_row(row)
+                existing = conn.execute(
+                    'SELECT digest FROM resources WHERE service = ? AND region = ? AND resource_id = ?', key).fetchone()
+                if existing is None:
+                    conn.execute(
+                        'INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        key + (position, encoded, digest, now, now, self.run_id))
+                    self._record(counts, 'added', key, encoded, now)
+                else:
+                    conn.execute(
+                        'UPDATE resources SET position = ?, row = ?, digest = ?, last_seen = ?, run_id = ? '
+                        'WHERE service = ? AND region = ? AND resource_id = ?',
+                        (position, encoded, digest, now, self.run_id) + key)
+                    if existing[0] != digest:
+                        self._record(counts, 'changed', key, encoded, now)
+                yield row
+
+            removed = conn.execute(
+                'SELECT resource_id, row FROM resources WHERE service = ? AND region = ? AND run_id != ?',
+                (service, region, self.run_id)).fetchall()
+            for removed_id, encoded in removed:
+                self._record(counts, 'removed', (service, region, removed_id), encoded, now)
+            conn.execute(
+                'DELETE FROM resources WHERE service = ? AND region = ? AND run_id != ?', (service, region, self.run_id))
+            conn.execute('INSERT OR REPLACE INTO scans VALUES (?, ?, ?)', (service, region, now))
+            conn.commit()
+            self.counts.update(counts)
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _record(self, counts, change, key, encoded, now):
+        self.conn.execute('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?)', (self.run_id, now, change) + key + (encoded,))
+        counts[change] += 1
+
+    def changes(self, run_id=None):
+        # (change, service, region, resource_id, row) for every change recorded in a run
+        cursor = self.conn.execute(
+            'SELECT change, service, region, resource_id, row FROM history WHERE run_id = ? ORDER BY rowid',
+            (run_id or self.run_id,))
+        for change, service, region, changed_id, row in cursor:
+            yield change, service, region, changed_id, decode_row(row)
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from paginate import iter_pages
+
+# Only the attributes the inventory report actually uses, instead of AttributeNames=['All']
+REPORT_ATTRIBUTES = [
+    'QueueArn',
+    'CreatedTimestamp',
+    'LastModifiedTimestamp',
+    'MessageRetentionPeriod',
+    'VisibilityTimeout',
+    'MaximumMessageSize',
+    'DelaySeconds',
+    'RedrivePolicy',
+]
+
+# Queue deleted between list_queues and get_queue_attributes
+NON_EXISTENT_QUEUE_ERRORS = {
+    'AWS.SimpleQueueService.NonExistentQueue',
+    'QueueDoesNotExist',
+}
+
+
+def get_queue_attributes(sqs_client, queue_url):
+    # Fetch the report attributes of one queue; throttled calls are retried by the client's retry
+    # config (and the rate limiter, when installed). Returns None if the queue disappeared before
+    # we got to it.
+    try:
+        response = sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=REPORT_ATTRIBUTES)
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code', '') in NON_EXISTENT_QUEUE_ERRORS:
+            return None
+        raise
+    return response.get('Attributes', {})
+
+
+def collect_sqs_queues(sqs_client, names_only=False, max_workers=8):
+    # Yield (queue_url, attributes) for every queue in the client's region, in list_queues order.
+    # Attribute calls for each page of queue URLs are spread over a bounded worker pool, so at
+    # most one page of attributes is in memory. In names_only mode attributes are skipped and
+    # None is yielded instead.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page in iter_pages(sqs_client, 'list_queues'):
+            queue_urls = page.get('QueueUrls', [])
+            if names_only:
+                for queue_url in queue_urls:
+                    yield queue_url, None
+                continue
+
+            attributes = executor.map(lambda queue_url: get_queue_attributes(sqs_client, queue_url), queue_urls)
+            for queue_url, queue_attributes in zip(queue_urls, attributes):
+                if queue_attributes is not None:
+                    yield queue_url, queue_attributes
@@ -0,0 +1,87 @@
+import os
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import clients
+from accounts import AccountSessions, organization_accounts
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield
+    clients.configure()
+
+
+def member_account(organizations, name):
+    status = organizations.create_account(AccountName=name, Email=f'{name}@example.com')['CreateAccountStatus']
+    return status['AccountId']
+
+
+def test_organization_accounts_skips_suspended(aws):
+    organizations = boto3.client('organizations')
+    organizations.create_organization(FeatureSet='ALL')
+    active = member_account(organizations, 'active')
+    closed = member_account(organizations, 'closed')
+    organizations.close_account(AccountId=closed)
+
+    accounts = {account.id: account.name for account in organization_accounts()}
+
+    assert accounts[active] == 'active'
+    assert closed not in accounts
+
+
+def test_resolve_skips_account_whose_role_cannot_be_assumed(aws, capsys):
+    base_session = boto3.Session()
+    denied = '222222222222'
+
+    def deny(params, **kwargs):
+        if denied in params['body']['RoleArn']:
+            error = {'Code': 'AccessDenied', 'Message': 'not authorized to perform sts:AssumeRole'}
+            return SimpleNamespace(status_code=403), {'Error': error, 'ResponseMetadata': {'HTTPStatusCode': 403}}
+        return None
+
+    base_session.events.register('before-call.sts.AssumeRole', deny)
+    sessions = AccountSessions(base_session=base_session)
+    accounts = [SimpleNamespace(id='111111111111'), SimpleNamespace(id=denied)]
+
+    results = sessions.resolve(accounts, lambda account, session: session.client('sts').get_caller_identity()['Arn'])
+
+    assert [account.id for account, _, _ in results] == ['111111111111']
+    assert 'assumed-role/OrganizationAccountAccessRole' in results[0][2]
+    assert f'Skipping account {denied}' in capsys.readouterr().out
+
+
+def test_assumed_credentials_refresh(aws):
+    # Moto's credentials expire after DurationSeconds; at the 15 minute minimum they are within
+    # botocore's refresh window straight away, so every read assumes the role again
+    sessions = AccountSessions(base_session=boto3.Session(), duration=900)
+    session = sessions.session('111111111111')
+    assert sessions.assumed == 1
+
+    credentials = session.get_credentials()
+    first = credentials.get_frozen_credentials()
+    assert first.access_key != os.environ['AWS_ACCESS_KEY_ID']
+    assert sessions.assumed == 2
+    assert credentials.method == 'sts-assume-role'
+
+
+def test_sessions_share_one_model_loader(aws):
+    sessions = AccountSessions(base_session=boto3.Session())
+    hooked = []
+    sessions.hooks.append(lambda session, account_id: hooked.append(account_id))
+
+    first = sessions.session('111111111111')
+    second = sessions.session('222222222222')
+
+    assert sessions.session('111111111111') is first
+    assert hooked == ['111111111111', '222222222222']
+    loader = first._session.get_component('data_loader')
+    assert second._session.get_component('data_loader') is loader
@@ -0,0 +1,95 @@
+import json
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import bulk
+import clients
+import collectors
+from scheduler import Scheduler
+
+REGIONS = ['us-east-1', 'eu-west-1']
+TAGS = [{'ResourceType': 'instance', 'Tags': [{'Key': 'team', 'Value': 'inventory'}]}]
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield
+    clients.configure()
+
+
+def launch(region, count, tagged=True):
+    params = {'TagSpecifications': TAGS} if tagged else {}
+    ec2 = boto3.client('ec2', region_name=region)
+    return [instance['InstanceId'] for instance in ec2.run_instances(
+        ImageId='ami-12345678', MinCount=count, MaxCount=count, **params)['Instances']]
+
+
+def run(tasks):
+    return [(task.service, task.region, dict(row)) for task, rows in Scheduler(max_workers=4).run(tasks) for row in rows]
+
+
+def test_tagging_backend_matches_native_order(aws):
+    for region in REGIONS:
+        launch(region, 2)
+    for region in REGIONS:
+        boto3.client('rds', region_name=region).create_db_instance(
+            DBInstanceIdentifier=f'db-{region}', DBInstanceClass='db.t3.micro', Engine='postgres',
+            Tags=[{'Key': 'team', 'Value': 'inventory'}])
+    selected = collectors.select(['ec2', 'rds'])
+
+    native = run(collectors.build_tasks(selected, REGIONS))
+    tagging = run(bulk.build_tasks(selected, REGIONS, 'tagging'))
+
+    # Collector-major, as the native backend writes them
+    assert [(service, region) for service, region, _ in native] == (
+        [('ec2', region) for region in REGIONS for _ in range(2)] + [('rds', region) for region in REGIONS])
+    assert tagging == native
+
+
+def test_tagging_backend_misses_untagged_resources(aws):
+    tagged = launch('us-east-1', 1)
+    launch('us-east-1', 1, tagged=False)
+
+    rows = run(bulk.build_tasks(collectors.select(['ec2']), ['us-east-1'], 'tagging'))
+
+    assert [row['Resource Name'] for _, _, row in rows] == tagged
+
+
+def test_config_backend_describes_what_the_aggregator_returns(aws):
+    instance_ids = {region: launch(region, 2, tagged=False) for region in REGIONS}
+    results = [json.dumps({'arn': f'arn:aws:ec2:{region}:123456789012:instance/{instance_id}',
+                           'resourceType': 'AWS::EC2::Instance', 'awsRegion': region})
+               for region in reversed(REGIONS) for instance_id in instance_ids[region]]
+    queries = []
+
+    def select(params, **kwargs):
+        # moto has no select_aggregate_resource_config; answer it with the aggregator's rows
+        queries.append(json.loads(params['body']))
+        return SimpleNamespace(status_code=200), {'Results': results, 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    clients.default_pool().session.events.register('before-call.config.SelectAggregateResourceConfig', select)
+    selected = collectors.select(['ec2'])
+
+    rows = run(bulk.build_tasks(selected, REGIONS, 'config', account='123456789012', aggregator='org'))
+
+    assert len(queries) == 1
+    assert "accountId = '123456789012'" in queries[0]['Expression']
+    assert [row for _, _, row in rows] == [{'Account': '123456789012', **row} for _, _, row in run(collectors.build_tasks(selected, REGIONS))]
+
+
+def test_stale_id_falls_back_to_listing_without_duplicates(aws, monkeypatch):
+    instance_ids = launch('us-east-1', 3)
+    monkeypatch.setitem(bulk.ENRICHMENTS, 'ec2', bulk.ENRICHMENTS['ec2']._replace(batch_size=2))
+    arns = [f'arn:aws:ec2:us-east-1:123456789012:instance/{instance_id}' for instance_id in instance_ids + ['i-0123456789abcdef0']]
+
+    rows = list(bulk.enrich(collectors.REGISTRY['ec2'], 'us-east-1', arns))
+
+    assert sorted(row['Resource Name'] for row in rows) == sorted(instance_ids)
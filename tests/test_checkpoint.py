@@ -0,0 +1,99 @@
+import csv
+import io
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import checkpoint
+import clients
+import paginate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambdafunction'))
+import fetchNdel  # noqa: E402
+import fetchNdelELB  # noqa: E402
+
+BUCKET = 'script07'
+REGIONS = ['us-east-1', 'eu-west-1']
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield boto3.client('s3')
+    clients.configure()
+
+
+@pytest.fixture
+def account(aws, monkeypatch):
+    # Small pages and action chunks, so a run has many points at which it can stop
+    monkeypatch.setitem(paginate.PAGE_SIZES, ('elbv2', 'describe_load_balancers'), 2)
+    monkeypatch.setattr(checkpoint, 'ACT_CHUNK_SIZE', 2)
+    aws.create_bucket(Bucket=BUCKET)
+    for region in REGIONS:
+        ec2 = boto3.client('ec2', region_name=region)
+        ec2.run_instances(ImageId='ami-12345678', MinCount=3, MaxCount=3)
+        subnets = [subnet['SubnetId'] for subnet in ec2.describe_subnets()['Subnets'][:2]]
+        elbv2 = boto3.client('elbv2', region_name=region)
+        for index in range(5):
+            elbv2.create_load_balancer(Name=f'lb-{index}', Subnets=subnets)
+    return aws
+
+
+class ShortContext:
+    # Lambda context whose time runs out after a few budget checks
+    def __init__(self, checks):
+        self.checks = checks
+
+    def get_remaining_time_in_millis(self):
+        self.checks -= 1
+        return 60000 if self.checks > 0 else 100
+
+
+def split_run(handler, event, checks=3):
+    invocations = 0
+    while True:
+        invocations += 1
+        response = handler.lambda_handler(event, ShortContext(checks))
+        if response.get('complete'):
+            return response, invocations
+        assert response['statusCode'] == 202
+        assert invocations < 40
+
+
+def report(s3, response):
+    return s3.get_object(Bucket=BUCKET, Key=response['key'])['Body'].read()
+
+
+@pytest.mark.parametrize('handler', [fetchNdel, fetchNdelELB], ids=lambda handler: handler.__name__)
+def test_split_run_matches_single_run(account, handler):
+    event = {'regions': REGIONS, 'min_age_days': 0, 'dry_run': True}
+
+    single = handler.lambda_handler({**event, 'prefix': 'single/'}, None)
+    split, invocations = split_run(handler, {**event, 'prefix': 'split/'})
+
+    assert invocations > 1
+    assert split['invocations'] == invocations
+    assert report(account, split) == report(account, single)
+
+
+def test_split_run_deletes_each_resource_once(account):
+    event = {'regions': REGIONS, 'checkpoint': 'checkpoints/elb.json'}
+
+    response, invocations = split_run(fetchNdelELB, event, checks=4)
+
+    rows = list(csv.DictReader(io.StringIO(report(account, response).decode())))
+    assert invocations > 1
+    assert len(rows) == 10
+    assert {row['Result'] for row in rows} == {'done'}
+    for region in REGIONS:
+        assert boto3.client('elbv2', region_name=region).describe_load_balancers()['LoadBalancers'] == []
+    # The finished run removed its checkpoint
+    keys = [entry['Key'] for entry in account.list_objects_v2(Bucket=BUCKET)['Contents']]
+    assert keys == [response['key']]
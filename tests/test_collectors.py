@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import clients
+import collectors
+from filters import ResourceFilter
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield
+    clients.configure()
+
+
+def test_sqs_timestamps_are_epoch_seconds(aws):
+    boto3.client('sqs').create_queue(QueueName='queue')
+    now = datetime.now(timezone.utc)
+
+    row, = collectors.REGISTRY['sqs'].collect('us-east-1')
+
+    assert abs(row['Creation/Last Modified Time'] - now) < timedelta(minutes=1)
+    assert abs(row['Other Information']['Last Updated'] - now) < timedelta(minutes=1)
+    # The age filter reads the same attribute: a queue created just now isn't a day old
+    resource_filter = ResourceFilter(created_before=now - timedelta(days=1))
+    assert list(collectors.REGISTRY['sqs'].collect('us-east-1', resource_filter=resource_filter)) == []
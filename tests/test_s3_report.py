@@ -0,0 +1,85 @@
+import gzip
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from s3_report import MIN_PART_SIZE, MultipartUpload, open_report
+
+BUCKET = 'reports'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def fail_parts(client, failures):
+    # Make upload_part raise for the given part numbers, once per entry in failures
+    failed = []
+
+    def fail(params, **kwargs):
+        part_number = int(params['query_string']['partNumber'])
+        if part_number in failures:
+            failures.remove(part_number)
+            failed.append(part_number)
+            raise ConnectionResetError(f'part {part_number} dropped')
+
+    client.meta.events.register('before-call.s3.UploadPart', fail)
+    return failed
+
+
+def open_uploads(client):
+    return client.list_multipart_uploads(Bucket=BUCKET).get('Uploads', [])
+
+
+def test_small_report_is_a_single_put(s3):
+    with open_report(s3, BUCKET, 'small.csv.gz', compression='gzip') as report:
+        report.write('a,b\n1,2\n')
+
+    assert gzip.decompress(s3.get_object(Bucket=BUCKET, Key='small.csv.gz')['Body'].read()) == b'a,b\n1,2\n'
+    assert open_uploads(s3) == []
+
+
+def test_failed_part_is_retried(s3):
+    data = os.urandom(2 * MIN_PART_SIZE + 1024)
+    failed = fail_parts(s3, [2])
+
+    upload = MultipartUpload(s3, BUCKET, 'big.bin')
+    upload.write(data)
+    upload.close()
+
+    assert failed == [2]
+    assert s3.get_object(Bucket=BUCKET, Key='big.bin')['Body'].read() == data
+    assert open_uploads(s3) == []
+
+
+def test_part_that_keeps_failing_aborts_the_upload(s3):
+    fail_parts(s3, [2, 2])
+
+    upload = MultipartUpload(s3, BUCKET, 'big.bin', max_attempts=2)
+    upload.write(os.urandom(2 * MIN_PART_SIZE + 1024))
+    with pytest.raises(ConnectionResetError):
+        upload.close()
+
+    assert open_uploads(s3) == []
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET)
+
+
+def test_error_in_the_report_block_aborts_the_upload(s3):
+    with pytest.raises(RuntimeError):
+        with open_report(s3, BUCKET, 'report.csv', part_size=MIN_PART_SIZE) as report:
+            report.write('x' * (MIN_PART_SIZE + 1024))
+            report.flush()
+            assert len(open_uploads(s3)) == 1
+            raise RuntimeError('collector failed')
+
+    assert open_uploads(s3) == []
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET)
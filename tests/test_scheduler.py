@@ -0,0 +1,93 @@
+import threading
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import clients
+import collectors
+from scheduler import Scheduler, Task
+
+REGIONS = ['us-east-1', 'eu-west-1', 'ap-southeast-2']
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield
+    clients.configure()
+
+
+def numbered(index, rows=3, delay=0):
+    def func():
+        time.sleep(delay)
+        for row in range(rows):
+            yield index, row
+    return func
+
+
+def test_rows_match_a_serial_run(aws):
+    for count, region in enumerate(REGIONS, start=1):
+        boto3.client('ec2', region_name=region).run_instances(ImageId='ami-12345678', MinCount=count, MaxCount=count)
+        boto3.client('sqs', region_name=region).create_queue(QueueName=f'queue-{region}')
+    tasks = collectors.build_tasks(collectors.select(['ec2', 'sqs', 'vpc']), REGIONS)
+
+    serial = [(task.service, task.region, dict(row)) for task in tasks for row in task.func()]
+    parallel = [(task.service, task.region, dict(row)) for task, rows in Scheduler(max_workers=8).run(tasks) for row in rows]
+
+    assert parallel == serial
+
+
+def test_tasks_that_finish_first_still_wait_their_turn():
+    # The earliest tasks are the slowest, so the later ones are done before the head is
+    tasks = [Task('ec2', f'region-{index}', numbered(index, delay=0.05 * (6 - index))) for index in range(6)]
+
+    yielded = [(task.region, list(rows)) for task, rows in Scheduler(max_workers=6).run(tasks)]
+
+    assert yielded == [(f'region-{index}', [(index, row) for row in range(3)]) for index in range(6)]
+
+
+def test_lookahead_bounds_started_tasks():
+    started = []
+    lock = threading.Lock()
+
+    def recorded(index):
+        def func():
+            with lock:
+                started.append(index)
+            yield from numbered(index, delay=0.01 * (index % 3))()
+        return func
+
+    tasks = [Task('ec2', index, recorded(index)) for index in range(20)]
+    for task, rows in Scheduler(max_workers=4, lookahead=3).run(tasks):
+        with lock:
+            assert max(started) - task.region <= 3
+        list(rows)
+
+    assert sorted(started) == list(range(20))
+
+
+def test_producer_never_blocks_on_the_consumer():
+    finished = threading.Event()
+
+    def later():
+        yield from numbered(1, rows=10000)()
+        finished.set()
+
+    scheduler = Scheduler(max_workers=2, default_service_limit=1)
+    tasks = [Task('ec2', 'head', numbered(0, rows=10000)), Task('ec2', 'later', later)]
+    runs = scheduler.run(tasks)
+    task, rows = next(runs)
+    assert next(rows) == (0, 0)
+
+    # The head is still being read, yet the next task in the same service got its slot and ran
+    # to the end without waiting for anyone to take its rows
+    assert finished.wait(5)
+    assert sum(1 for _ in rows) == 9999
+    task, rows = next(runs)
+    assert task.region == 'later' and sum(1 for _ in rows) == 10000
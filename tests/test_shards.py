@@ -0,0 +1,95 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import clients
+import collectors
+import shards
+from sinks import open_sink
+
+REGIONS = ['us-east-1', 'eu-west-1']
+SERVICES = ['ec2', 'vpc', 'sqs']
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield
+    clients.configure()
+
+
+@pytest.fixture
+def queue(aws, tmp_path):
+    # Shards for a small account, enqueued on an SQS queue; returns the queue URL
+    for region in REGIONS:
+        boto3.client('ec2', region_name=region).run_instances(ImageId='ami-12345678', MinCount=3, MaxCount=3)
+        boto3.client('sqs', region_name=region).create_queue(QueueName=f'queue-{region}')
+    planned = shards.plan_shards(collectors.select(SERVICES), [(None, REGIONS)])
+    shards.write_manifest(str(tmp_path), planned)
+    queue_url = boto3.client('sqs').create_queue(QueueName='shards')['QueueUrl']
+    shards.open_queue(queue_url, str(tmp_path)).put(planned)
+    return queue_url
+
+
+def work(queue_url, output_dir):
+    return shards.work(queue_url, str(output_dir), max_attempts=2, poll=0.1)
+
+
+def merged(output_dir, name='inventory.csv'):
+    path = output_dir / name
+    shards.merge(str(output_dir), 'csv', str(path))
+    return path.read_bytes()
+
+
+def test_sqs_queue_merge_matches_a_serial_run(queue, tmp_path):
+    assert work(queue, tmp_path) == 2 * len(SERVICES)
+
+    selected = collectors.select(SERVICES)
+    serial = tmp_path / 'serial.csv'
+    with open_sink('csv', str(serial), collectors.details_schema(selected)) as sink:
+        for task in collectors.build_tasks(selected, REGIONS):
+            sink.write_rows(task.func())
+    assert merged(tmp_path) == serial.read_bytes()
+    assert shards.open_queue(queue, str(tmp_path)).status() == {'remaining': 0, 'failed': 0}
+
+
+def test_failed_shard_blocks_the_merge_until_retried(queue, tmp_path, monkeypatch):
+    run_shard = shards.run_shard
+
+    def flaky(shard, *args):
+        if (shard.service, shard.region) == ('vpc', 'eu-west-1'):
+            raise RuntimeError('region unreachable')
+        return run_shard(shard, *args)
+
+    monkeypatch.setattr(shards, 'run_shard', flaky)
+    work(queue, tmp_path)
+    sqs_queue = shards.open_queue(queue, str(tmp_path), max_attempts=2)
+
+    assert [(shard.service, shard.region) for shard, _ in sqs_queue.failed()] == [('vpc', 'eu-west-1')]
+    with pytest.raises(RuntimeError, match='1 of 6 shards have no output yet'):
+        merged(tmp_path)
+    missing = shards.merge(str(tmp_path), 'csv', str(tmp_path / 'partial.csv'), allow_partial=True)
+    assert [(shard.service, shard.region) for shard in missing] == [('vpc', 'eu-west-1')]
+
+    monkeypatch.setattr(shards, 'run_shard', run_shard)
+    sqs_queue.retry([shard for shard, _ in sqs_queue.failed()])
+    assert work(queue, tmp_path) == 1
+    assert sqs_queue.status() == {'remaining': 0, 'failed': 0}
+    merged(tmp_path)
+
+
+def test_merge_is_idempotent(queue, tmp_path):
+    work(queue, tmp_path)
+    first = merged(tmp_path, 'first.csv')
+
+    # A duplicate delivery reruns shards that are already done; each rewrites its own partial
+    # file, so neither it nor merging again adds rows
+    shards.open_queue(queue, str(tmp_path)).put(shards.read_manifest(str(tmp_path)))
+    work(queue, tmp_path)
+
+    assert merged(tmp_path, 'second.csv') == first
+    assert merged(tmp_path, 'third.csv') == first
@@ -0,0 +1,99 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import clients
+import collectors
+from all import use_snapshot
+from scheduler import Scheduler
+from snapshot import SnapshotStore
+
+REGIONS = ['us-east-1', 'eu-west-1']
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        clients.configure()
+        yield
+    clients.configure()
+
+
+@pytest.fixture
+def tasks(aws):
+    for region in REGIONS:
+        boto3.client('ec2', region_name=region).run_instances(ImageId='ami-12345678', MinCount=2, MaxCount=2)
+        boto3.client('sqs', region_name=region).create_queue(QueueName=f'queue-{region}')
+    return collectors.build_tasks(collectors.select(['ec2', 'sqs']), REGIONS)
+
+
+def inventory(path, tasks, rescan_services=(), rescan_regions=(), ttls=None, default_ttl=None):
+    # One all.py run against the snapshot: returns the rows, the (service, region) pairs that
+    # were actually scanned and the store, whose run_id identifies this run's changes
+    store = SnapshotStore(str(path))
+    planned = use_snapshot(store, tasks, set(rescan_services), set(rescan_regions), ttls or {}, default_ttl)
+    rows, scanned = [], []
+    for (task, task_rows), (_, cached) in zip(Scheduler(max_workers=4).run(task for task, _ in planned), planned):
+        if not cached:
+            task_rows = store.track(task.service, task.region, task_rows)
+            scanned.append((task.service, task.region))
+        rows.extend(dict(row) for row in task_rows)
+    return rows, scanned, store
+
+
+def backdate(store, service, seconds):
+    store.conn.execute('UPDATE scans SET scanned_at = scanned_at - ? WHERE service = ?', (seconds, service))
+    store.conn.commit()
+
+
+def test_cached_rows_match_a_fresh_scan(tasks, tmp_path):
+    path = tmp_path / 'inventory.db'
+    first, scanned, _ = inventory(path, tasks)
+    assert len(scanned) == 4
+
+    cached, scanned, store = inventory(path, tasks, default_ttl=3600)
+
+    assert scanned == []
+    assert cached == first
+    assert list(store.changes()) == []
+
+
+def test_ttl_expires_per_service(tasks, tmp_path):
+    path = tmp_path / 'inventory.db'
+    _, _, store = inventory(path, tasks)
+    backdate(store, 'ec2', 7200)
+
+    _, scanned, _ = inventory(path, tasks, ttls={'ec2': 3600, 'sqs': 10800})
+
+    assert scanned == [('ec2', region) for region in REGIONS]
+
+
+def test_selective_rescan(tasks, tmp_path):
+    path = tmp_path / 'inventory.db'
+    inventory(path, tasks)
+
+    _, scanned, _ = inventory(path, tasks, rescan_services=['sqs'], rescan_regions=['eu-west-1'])
+
+    assert scanned == [('sqs', 'eu-west-1')]
+
+
+def test_rescan_records_the_diff(tasks, tmp_path):
+    path = tmp_path / 'inventory.db'
+    first, _, _ = inventory(path, tasks)
+    instance_id = next(row['Resource Name'] for row in first if row['Resource Type'] == 'EC2 Instance')
+    boto3.client('ec2').stop_instances(InstanceIds=[instance_id])
+    sqs = boto3.client('sqs', region_name='eu-west-1')
+    sqs.delete_queue(QueueUrl=sqs.get_queue_url(QueueName='queue-eu-west-1')['QueueUrl'])
+    sqs.create_queue(QueueName='added')
+
+    rows, _, store = inventory(path, tasks)
+
+    changes = [(change, service, region, row['Resource Name']) for change, service, region, _, row in store.changes()]
+    assert sorted(changes) == [('added', 'sqs', 'eu-west-1', 'added'),
+                               ('changed', 'ec2', 'us-east-1', instance_id),
+                               ('removed', 'sqs', 'eu-west-1', 'queue-eu-west-1')]
+    assert store.counts == {'added': 1, 'changed': 1, 'removed': 1}
+    assert 'queue-eu-west-1' not in {row['Resource Name'] for row in rows}